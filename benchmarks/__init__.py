@@ -0,0 +1,7 @@
+"""
+Performance benchmarks for the invoice extraction pipeline
+
+Run with:
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.compare before.json after.json
+"""
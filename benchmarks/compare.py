@@ -0,0 +1,37 @@
+"""
+Compare two benchmark result files
+
+Usage:
+    python -m benchmarks.compare before.json after.json [--metric p95_ms]
+"""
+import argparse
+import json
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--metric', default='p50_ms')
+    args = parser.parse_args(argv)
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print(f"{'stage':40} {before['meta'].get('commit') or 'before':>12} {after['meta'].get('commit') or 'after':>12}   change")
+    for name in sorted(set(before['stages']) | set(after['stages'])):
+        old = before['stages'].get(name, {}).get(args.metric)
+        new = after['stages'].get(name, {}).get(args.metric)
+        if old is None or new is None:
+            change = 'n/a'
+        elif old == 0:
+            change = '-'
+        else:
+            change = f"{(new - old) / old * 100:+.1f}%"
+        print(f"{name:40} {old if old is not None else '-':>12} {new if new is not None else '-':>12}   {change}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Measurement helpers for the benchmark suite
+"""
+import os
+import resource
+import statistics
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+
+def setup_django(**env: str) -> None:
+    """
+    Configure Django for benchmarking
+
+    Environment overrides (e.g. LLM_BACKEND='fake') are applied before the
+    settings module is imported.
+    """
+    for key, value in env.items():
+        os.environ[key] = value
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'extractor_project.settings')
+
+    import django
+    django.setup()
+
+
+@contextmanager
+def benchmark_database():
+    """Create a throwaway test database for the duration of the run"""
+    from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(peak / divisor, 1)
+
+
+def percentile(samples, fraction: float) -> float:
+    """Nearest-rank percentile of a list of samples"""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def measure(
+    fn: Callable[[int], Any],
+    iterations: int,
+    warmup: int = 1,
+    setup: Optional[Callable[[], None]] = None,
+    count_queries: bool = True,
+) -> Dict[str, Any]:
+    """
+    Run fn(i) `iterations` times and summarize latency, throughput,
+    memory and database queries
+
+    Args:
+        fn: Operation to benchmark, called with the iteration number
+        iterations: Number of measured calls
+        warmup: Unmeasured calls made first
+        setup: Called before every call, outside the measurement
+        count_queries: Whether to count database queries per call
+
+    Returns:
+        Dictionary with latency percentiles (ms), ops/s, peak RSS (MB),
+        mean DB queries per call and the number of failed calls (warmup
+        calls included)
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    errors = 0
+    # A failing warmup call must not abort the run, but it is still a failure
+    for i in range(warmup):
+        if setup:
+            setup()
+        try:
+            if fn(-1 - i) is False:
+                errors += 1
+        except Exception:
+            errors += 1
+
+    samples = []
+    queries = 0
+    for i in range(iterations):
+        if setup:
+            setup()
+        context = CaptureQueriesContext(connection) if count_queries else None
+        start = time.perf_counter()
+        try:
+            if context is not None:
+                with context:
+                    result = fn(i)
+            else:
+                result = fn(i)
+            if result is False:
+                errors += 1
+        except Exception:
+            errors += 1
+        samples.append(time.perf_counter() - start)
+        if context is not None:
+            queries += len(context.captured_queries)
+
+    total = sum(samples)
+    return {
+        'iterations': iterations,
+        'errors': errors,
+        'p50_ms': round(percentile(samples, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+        'mean_ms': round(statistics.mean(samples) * 1000, 3),
+        'throughput_ops': round(iterations / total, 2) if total else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'db_queries_per_op': round(queries / iterations, 2) if count_queries else None,
+    }
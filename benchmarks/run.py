@@ -0,0 +1,538 @@
+"""
+Run the benchmark suite and write the results to a JSON file
+
+Every stage uses the fake LLM backend, so the numbers measure the pipeline
+itself (parsing, queueing, DB writes, serialization) and the configured
+fake latency instead of the network.
+
+Usage:
+    python -m benchmarks.run [--iterations 20] [--llm-latency 0] \
+        [--stages upload,serializer] [--output results.json]
+"""
+import argparse
+import json
+import logging
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from .harness import benchmark_database, measure, setup_django
+from . import synthetic
+
+PDF_PAGE_COUNTS = (1, 5, 20)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _write_documents(directory: Path):
+    """Write the synthetic documents used by the extraction stages"""
+    documents = {}
+    for pages in PDF_PAGE_COUNTS:
+        path = directory / f'factura_{pages}p.pdf'
+        path.write_bytes(synthetic.make_pdf(pages=pages))
+        documents[f'pdf_{pages}p'] = path
+    if synthetic.PIL_AVAILABLE:
+        path = directory / 'factura.png'
+        path.write_bytes(synthetic.make_image())
+        documents['png'] = path
+        path = directory / 'ticket_photo.jpg'
+        path.write_bytes(synthetic.make_image(width=4000, height=3000, fmt='JPEG'))
+        documents['jpg_photo'] = path
+    if synthetic.DOCX_AVAILABLE:
+        path = directory / 'factura.docx'
+        path.write_bytes(synthetic.make_docx(pages=2))
+        documents['docx'] = path
+    return documents
+
+
+def bench_parsers(ctx, iterations):
+    from invoice_extractor.services import InvoiceExtractionService
+
+    service = InvoiceExtractionService()
+    amounts = ['$1.234,56', '12.100,00', '$ 10.000', 'invalid', None]
+    dates = ['15/01/2024', '15-01-2024', '2024-01-15', '15/01/24', 'invalid']
+    return {
+        'parse_currency': measure(
+            lambda i: service.parse_currency(amounts[i % len(amounts)]),
+            iterations * 100, count_queries=False,
+        ),
+        'parse_date': measure(
+            lambda i: service.parse_date(dates[i % len(dates)]),
+            iterations * 100, count_queries=False,
+        ),
+    }
+
+
+def bench_extraction(ctx, iterations):
+    from django.test import override_settings
+    from invoice_extractor.services import InvoiceExtractionService
+
+    results = {}
+    with override_settings(EXTRACTION_CACHE={}):
+        service = InvoiceExtractionService()
+        for name, path in ctx['documents'].items():
+            results[f'extract_invoice_data[{name}]'] = measure(
+                lambda i, path=path: service.extract_invoice_data(str(path))['success'],
+                iterations,
+            )
+
+    cache_dir = ctx['tmp_dir'] / 'cache'
+    with override_settings(EXTRACTION_CACHE={'BACKEND': 'disk', 'LOCATION': str(cache_dir)}):
+        service = InvoiceExtractionService()
+        path = str(ctx['documents']['pdf_1p'])
+        results['extract_invoice_data[cached]'] = measure(
+            lambda i: service.extract_invoice_data(path)['success'], iterations,
+        )
+    return results
+
+
+def _upload(client, document_path):
+    from django.core.files.uploadedfile import SimpleUploadedFile
+
+    document = SimpleUploadedFile(document_path.name, document_path.read_bytes())
+    response = client.post('/api/invoices/process/', {'document': document}, format='multipart')
+    return response.status_code < 300
+
+
+def bench_upload(ctx, iterations):
+    from django.test import override_settings
+    from rest_framework.test import APIClient
+    from invoice_extractor.jobs import run_next_job
+
+    client = APIClient()
+    path = ctx['documents']['pdf_1p']
+    results = {}
+    with override_settings(EXTRACTION_CACHE={}):
+        with override_settings(INVOICE_PROCESSING_ASYNC=True):
+            results['upload[async]'] = measure(lambda i: _upload(client, path), iterations)
+            results['worker_job'] = measure(lambda i: run_next_job() is not None, iterations)
+        with override_settings(INVOICE_PROCESSING_ASYNC=False):
+            results['upload[sync]'] = measure(lambda i: _upload(client, path), iterations)
+    return results
+
+
+def bench_serializer(ctx, iterations):
+    from decimal import Decimal
+    from invoice_extractor.models import Invoice, InvoiceItem
+    from rest_framework.test import APIClient
+    from invoice_extractor.serializers import InvoiceSerializer
+
+    invoices = Invoice.objects.bulk_create([
+        Invoice(
+            original_filename=f'factura_{n}.pdf', status='completed', invoice_number=f'00002-{n:08d}',
+            total_amount=Decimal('12100.00'), raw_extraction=synthetic.invoice_data(n),
+        )
+        for n in range(10)
+    ])
+    InvoiceItem.objects.bulk_create([
+        InvoiceItem(invoice=invoice, description=f'Producto {i}', quantity=1,
+                    unit_price=Decimal('100.00'), total_price=Decimal('100.00'))
+        for invoice in invoices
+        for i in range(20)
+    ])
+    invoice = invoices[0]
+    client = APIClient()
+    return {
+        'serializer[detail]': measure(
+            lambda i: InvoiceSerializer(Invoice.objects.get(pk=invoice.pk)).data, iterations * 10,
+        ),
+        'api[list]': measure(
+            lambda i: client.get('/api/invoices/').status_code == 200, iterations * 10,
+        ),
+        'api[list?expand=items]': measure(
+            lambda i: client.get('/api/invoices/?expand=items').status_code == 200, iterations * 10,
+        ),
+    }
+
+
+FILTER_QUERIES = {
+    'status': 'status=failed',
+    'vendor_cuit': 'vendor_cuit={vendor_cuit}',
+    'customer_cuit': 'customer_cuit={customer_cuit}',
+    'invoice_number': 'invoice_number=00003-00000042',
+    'date_range': 'date_from=2024-03-01&date_to=2024-03-07',
+    'vendor_cuit+date_range': 'vendor_cuit={vendor_cuit}&date_from=2024-01-01&date_to=2024-06-30',
+    'total_min': 'total_min=90000',
+}
+
+
+def _fill_invoices(rows):
+    """Bulk insert `rows` completed invoices and return the CUITs used"""
+    import random
+    from datetime import date, timedelta
+    from decimal import Decimal
+    from django.db import connection
+    from invoice_extractor.models import Invoice
+
+    rng = random.Random(0)
+    vendors = [synthetic.make_cuit(rng, '30') for _ in range(200)]
+    customers = [synthetic.make_cuit(rng, '20') for _ in range(2000)]
+    Invoice.objects.bulk_create([
+        Invoice(
+            original_filename=f'factura_{n}.pdf',
+            status='failed' if n % 50 == 0 else 'completed',
+            invoice_number=f'{n % 20:05d}-{n:08d}',
+            invoice_date=date(2024, 1, 1) + timedelta(days=n % 366),
+            vendor_cuit=rng.choice(vendors),
+            customer_cuit=rng.choice(customers),
+            total_amount=Decimal(rng.randint(100, 100000)),
+        )
+        for n in range(rows)
+    ], batch_size=1000)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    return vendors, customers
+
+
+def bench_filters(ctx, iterations, rows=20000):
+    """
+    Time the list filters on a large table and record their query plans
+
+    Each result carries the EXPLAIN output and whether it mentions one of
+    the Invoice indexes.
+    """
+    from django.http import QueryDict
+    from rest_framework.test import APIClient
+    from invoice_extractor.filters import filter_invoices
+    from invoice_extractor.models import Invoice
+
+    vendors, customers = _fill_invoices(rows)
+
+    index_names = [index.name for index in Invoice._meta.indexes]
+    client = APIClient()
+    results = {}
+    for name, query in FILTER_QUERIES.items():
+        query = query.format(vendor_cuit=vendors[0], customer_cuit=customers[0])
+        queryset = filter_invoices(Invoice.objects.order_by('-uploaded_at', '-id'), QueryDict(query))[:10]
+        plan = queryset.explain()
+        metrics = measure(
+            lambda i, query=query: client.get(f'/api/invoices/?{query}').status_code == 200, iterations,
+        )
+        metrics['query_plan'] = plan
+        metrics['uses_index'] = any(index_name in plan for index_name in index_names)
+        results[f'filter[{name}]'] = metrics
+    return results
+
+
+def bench_export(ctx, iterations, rows=50000):
+    """Stream every invoice of a large table in each export format"""
+    from rest_framework.test import APIClient
+    from invoice_extractor.export import EXPORT_FORMATS, PYARROW_AVAILABLE
+
+    _fill_invoices(rows)
+    client = APIClient()
+
+    def export(query):
+        response = client.get(f'/api/invoices/export/?{query}')
+        for _ in response.streaming_content:
+            pass
+        return response.status_code == 200
+
+    results = {}
+    for export_format in EXPORT_FORMATS:
+        if export_format == 'parquet' and not PYARROW_AVAILABLE:
+            continue
+        results[f'export[{export_format}, {rows} rows]'] = measure(
+            lambda i, export_format=export_format: export(f'format={export_format}'),
+            max(1, iterations // 5), warmup=0,
+        )
+    return results
+
+
+def bench_preprocessing(ctx, iterations):
+    """Image normalization cost, and extraction latency and image tokens with and without it"""
+    from django.test import override_settings
+    from PIL import Image
+    from invoice_extractor.preprocessing import estimate_image_tokens, preprocess_image
+    from invoice_extractor.services import InvoiceExtractionService
+
+    cache_dir = ctx['tmp_dir'] / 'preprocessed'
+    clear_cache = lambda: shutil.rmtree(cache_dir, ignore_errors=True)
+    results = {}
+    with override_settings(IMAGE_PREPROCESSING_CACHE_DIR=str(cache_dir), IMAGE_PREPROCESSING_ENABLED=True,
+                           EXTRACTION_CACHE={}):
+        for name in ('jpg_photo', 'png'):
+            if name not in ctx['documents']:
+                continue
+            path = str(ctx['documents'][name])
+            results[f'preprocess_image[{name}, cold]'] = measure(
+                lambda i: preprocess_image(path) != path, iterations, setup=clear_cache, count_queries=False,
+            )
+            results[f'preprocess_image[{name}, cached]'] = measure(
+                lambda i: preprocess_image(path) != path, iterations, count_queries=False,
+            )
+            with Image.open(path) as image:
+                original_size = image.size
+            with Image.open(preprocess_image(path)) as image:
+                preprocessed_size = image.size
+
+            for enabled, size in ((False, original_size), (True, preprocessed_size)):
+                with override_settings(IMAGE_PREPROCESSING_ENABLED=enabled):
+                    service = InvoiceExtractionService()
+                    metrics = measure(
+                        lambda i: service.extract_invoice_data(path)['success'], iterations,
+                        setup=clear_cache, count_queries=False,
+                    )
+                metrics['image_size'] = f'{size[0]}x{size[1]}'
+                metrics['image_tokens'] = estimate_image_tokens(*size)
+                results[f"extract_invoice_data[{name}, preprocessing {'on' if enabled else 'off'}]"] = metrics
+    return results
+
+
+def bench_pruning(ctx, iterations):
+    """Extraction latency and prompt size of the multi-page PDFs with and without page pruning"""
+    from django.conf import settings
+    from django.test import override_settings
+    from invoice_extractor.engines import estimate_tokens
+    from invoice_extractor.fast_path import extract_pdf_pages
+    from invoice_extractor.page_pruning import select_pages
+    from invoice_extractor.services import InvoiceExtractionService
+
+    results = {}
+    with override_settings(EXTRACTION_CACHE={}):
+        for pages in PDF_PAGE_COUNTS[1:]:
+            path = str(ctx['documents'][f'pdf_{pages}p'])
+            page_texts = extract_pdf_pages(path)
+            selected = select_pages(page_texts, settings.PAGE_PRUNING_MAX_PAGES)
+            for enabled, texts in ((False, page_texts), (True, [page_texts[i] for i in selected])):
+                with override_settings(PAGE_PRUNING_ENABLED=enabled):
+                    service = InvoiceExtractionService()
+                    metrics = measure(lambda i: service.extract_invoice_data(path)['success'], iterations)
+                metrics['pages'] = len(texts)
+                metrics['context_tokens'] = estimate_tokens('\n\n'.join(texts))
+                results[f"extract_invoice_data[pdf_{pages}p, pruning {'on' if enabled else 'off'}]"] = metrics
+    return results
+
+
+def bench_loader(ctx, iterations, threads=8):
+    """Documents loaded per second by concurrent threads, in-process and in a worker process pool"""
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+    from django.test import override_settings
+    from invoice_extractor.loaders import DocumentLoader
+
+    names = [name for name in ('pdf_20p', 'jpg_photo', 'docx') if name in ctx['documents']]
+    paths = [str(ctx['documents'][name]) for name in names] * threads
+    cache_dir = ctx['tmp_dir'] / 'preprocessed'
+
+    results = {}
+    with override_settings(IMAGE_PREPROCESSING_CACHE_DIR=str(cache_dir)):
+        for workers in (0, os.cpu_count() or 1):
+            loader = DocumentLoader(workers=workers, timeout=120)
+
+            def load_all(i):
+                shutil.rmtree(cache_dir, ignore_errors=True)
+                with ThreadPoolExecutor(threads) as pool:
+                    return all(loaded.documents for loaded in pool.map(loader.load, paths))
+
+            try:
+                metrics = measure(load_all, max(1, iterations // 4), count_queries=False)
+            finally:
+                loader.shutdown()
+            metrics['documents_per_second'] = round(len(paths) / (metrics['p50_ms'] / 1000), 2)
+            results[f'load_document[{threads} threads, {workers} processes]'] = metrics
+    return results
+
+
+def bench_concurrency(ctx, iterations, extractions=100, threads=8, latency=0.2):
+    """Extractions waiting on the LLM at once: sync calls in a thread pool vs async calls in one event loop"""
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from django.conf import settings
+    from django.test import override_settings
+    from invoice_extractor.services import InvoiceExtractionService
+
+    path = str(ctx['documents']['pdf_1p'])
+    # Without network latency there is nothing to overlap
+    backend = {**settings.LLM_BACKEND, 'FAKE_LATENCY': max(latency, settings.LLM_BACKEND['FAKE_LATENCY'])}
+
+    results = {}
+    with override_settings(EXTRACTION_CACHE={}, LLM_BACKEND=backend):
+        service = InvoiceExtractionService()
+
+        def threaded(i):
+            with ThreadPoolExecutor(threads) as pool:
+                return all(result['success'] for result in pool.map(service.extract_invoice_data, [path] * extractions))
+
+        async def gather():
+            results = await asyncio.gather(*(service.aextract_invoice_data(path) for _ in range(extractions)))
+            return all(result['success'] for result in results)
+
+        for name, fn in ((f'{threads} threads', threaded), ('event loop', lambda i: asyncio.run(gather()))):
+            metrics = measure(fn, max(1, iterations // 4), count_queries=False)
+            metrics['documents_per_second'] = round(extractions / (metrics['p50_ms'] / 1000), 2)
+            results[f'extract_invoice_data[{extractions} at once, {name}]'] = metrics
+    return results
+
+
+def bench_events(ctx, iterations, latency=0.2):
+    """Time until the first fields are reported to progress (and streamed), against the whole extraction"""
+    import statistics
+    from django.conf import settings
+    from django.test import override_settings
+    from invoice_extractor.services import InvoiceExtractionService
+
+    backend = {**settings.LLM_BACKEND, 'FAKE_LATENCY': max(latency, settings.LLM_BACKEND['FAKE_LATENCY'])}
+    names = [name for name in ('pdf_1p', 'png') if name in ctx['documents']]
+
+    results = {}
+    with override_settings(EXTRACTION_CACHE={}, LLM_BACKEND=backend):
+        service = InvoiceExtractionService()
+        for name in names:
+            path = str(ctx['documents'][name])
+            first_fields = []
+
+            def extract(i, path=path):
+                started = time.perf_counter()
+                reported = []
+
+                def progress(stage, data):
+                    if not reported and data.get('fields'):
+                        reported.append(time.perf_counter() - started)
+
+                success = service.extract_invoice_data(path, use_cache=False, progress=progress)['success']
+                first_fields.extend(reported)
+                return success
+
+            metrics = measure(extract, iterations, count_queries=False)
+            metrics['first_fields_ms'] = round(statistics.median(first_fields) * 1000, 3) if first_fields else None
+            results[f'extract_invoice_data[{name}, progress]'] = metrics
+    return results
+
+
+STARTUP_SCRIPTS = {
+    'startup[django + urls]': 'import django; django.setup(); import invoice_extractor.urls',
+    'startup[django + urls + first extraction]': (
+        'import sys, django; django.setup(); import invoice_extractor.urls; '
+        'from invoice_extractor.services import get_extraction_service; '
+        'get_extraction_service().extract_invoice_data(sys.argv[1], use_cache=False)'
+    ),
+}
+
+
+def bench_startup(ctx, iterations):
+    """Cold start of a Django process, and the setup cost paid per extraction"""
+    from invoice_extractor.services import InvoiceExtractionService, get_extraction_service
+
+    root = Path(__file__).resolve().parent.parent
+    document = str(ctx['documents']['pdf_1p'])
+    results = {}
+    for name, script in STARTUP_SCRIPTS.items():
+        rss = []
+
+        def start(i, script=script):
+            # Report the peak RSS of the child process on the last line
+            output = subprocess.run(
+                [sys.executable, '-c', script + '; import resource; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)', document],
+                cwd=root, capture_output=True, text=True, check=True,
+            ).stdout
+            rss.append(int(output.split()[-1]))
+
+        metrics = measure(start, max(1, iterations // 4), warmup=0, count_queries=False)
+        metrics['child_peak_rss_mb'] = round(max(rss) / 1024, 1) if rss else None
+        results[name] = metrics
+
+    results['service_setup[new InvoiceExtractionService]'] = measure(
+        lambda i: InvoiceExtractionService(), iterations, count_queries=False,
+    )
+    results['service_setup[get_extraction_service]'] = measure(
+        lambda i: get_extraction_service(), iterations, count_queries=False,
+    )
+    return results
+
+
+STAGES = {
+    'parsers': bench_parsers,
+    'extraction': bench_extraction,
+    'upload': bench_upload,
+    'serializer': bench_serializer,
+    'filters': bench_filters,
+    'export': bench_export,
+    'preprocessing': bench_preprocessing,
+    'pruning': bench_pruning,
+    'loader': bench_loader,
+    'startup': bench_startup,
+    'concurrency': bench_concurrency,
+    'events': bench_events,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--llm-latency', type=float, default=0.0, help='Latency of the fake LLM, in seconds')
+    parser.add_argument('--stages', default=','.join(STAGES), help='Comma separated stages to run')
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args(argv)
+
+    setup_django(LLM_BACKEND='fake', LLM_FAKE_LATENCY=str(args.llm_latency))
+    # Failed extractions are reported in the 'errors' column instead
+    logging.disable(logging.CRITICAL)
+    from django.test import override_settings
+
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+    results = {
+        'meta': {
+            'commit': _git_commit(),
+            'date': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'iterations': args.iterations,
+            'llm_latency': args.llm_latency,
+        },
+        'stages': {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_dir = Path(tmp)
+        ctx = {'tmp_dir': tmp_dir, 'documents': _write_documents(tmp_dir)}
+        with benchmark_database(), override_settings(MEDIA_ROOT=str(tmp_dir / 'media')):
+            for stage in stages:
+                started = time.perf_counter()
+                stage_results = STAGES[stage](ctx, args.iterations)
+                results['stages'].update(stage_results)
+                for name, metrics in stage_results.items():
+                    print(
+                        f"{name:40} p50 {metrics['p50_ms']:>10.3f} ms  p95 {metrics['p95_ms']:>10.3f} ms  "
+                        f"p99 {metrics['p99_ms']:>10.3f} ms  {metrics['throughput_ops'] or 0:>10.2f} ops/s  "
+                        f"queries {metrics['db_queries_per_op'] if metrics['db_queries_per_op'] is not None else '-':>6}  "
+                        f"errors {metrics['errors']}"
+                    )
+                    if 'image_tokens' in metrics:
+                        print(f"    image: {metrics['image_size']}  ~{metrics['image_tokens']} vision tokens")
+                    if 'context_tokens' in metrics:
+                        print(f"    pages: {metrics['pages']}  ~{metrics['context_tokens']} context tokens")
+                    if 'documents_per_second' in metrics:
+                        print(f"    {metrics['documents_per_second']} documents/s")
+                    if metrics.get('first_fields_ms'):
+                        print(f"    first fields reported after {metrics['first_fields_ms']} ms")
+                    if metrics.get('child_peak_rss_mb'):
+                        print(f"    peak RSS of the process: {metrics['child_peak_rss_mb']} MB")
+                    if 'query_plan' in metrics:
+                        print(f"    index used: {metrics['uses_index']}  plan: {' | '.join(metrics['query_plan'].splitlines())}")
+                print(f"-- {stage} done in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+Synthetic Argentine invoice documents for benchmarks
+
+Every generator returns the document bytes. Page 1 always holds an AFIP
+style invoice; extra pages are filled with terms and conditions.
+"""
+import base64
+import json
+import random
+from io import BytesIO
+from typing import List
+
+try:
+    from PIL import Image, ImageDraw
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+try:
+    import docx
+    DOCX_AVAILABLE = True
+except ImportError:
+    DOCX_AVAILABLE = False
+
+try:
+    import qrcode
+    QRCODE_AVAILABLE = True
+except ImportError:
+    QRCODE_AVAILABLE = False
+
+CUIT_WEIGHTS = (5, 4, 3, 2, 7, 6, 5, 4, 3, 2)
+
+TERMS_LINE = (
+    'Condiciones generales: la mercaderia viaja por cuenta y riesgo del comprador. '
+    'Los precios pueden modificarse sin previo aviso.'
+)
+
+
+def make_cuit(rng: random.Random, prefix: str = '30') -> str:
+    """Return a random CUIT with a valid verification digit"""
+    while True:
+        base = prefix + ''.join(str(rng.randint(0, 9)) for _ in range(8))
+        total = sum(int(digit) * weight for digit, weight in zip(base, CUIT_WEIGHTS))
+        check = 11 - total % 11
+        if check == 10:
+            continue
+        return base + str(0 if check == 11 else check)
+
+
+def format_amount(amount: float) -> str:
+    """Format an amount the Argentine way, e.g. 12.100,00"""
+    return f'{amount:,.2f}'.replace(',', 'X').replace('.', ',').replace('X', '.')
+
+
+def invoice_data(seed: int = 0, items: int = 5) -> dict:
+    """Return the values of a random but consistent invoice"""
+    rng = random.Random(seed)
+    lines = []
+    for i in range(items):
+        quantity = rng.randint(1, 10)
+        unit_price = round(rng.uniform(100, 5000), 2)
+        lines.append({
+            'description': f'Producto {i + 1}',
+            'quantity': quantity,
+            'unit_price': unit_price,
+            'total_price': round(quantity * unit_price, 2),
+        })
+    subtotal = round(sum(line['total_price'] for line in lines), 2)
+    tax = round(subtotal * 0.21, 2)
+    return {
+        'punto_de_venta': rng.randint(1, 20),
+        'numero': rng.randint(1, 99999),
+        'fecha': f'{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2024',
+        'vendor_cuit': make_cuit(rng, '30'),
+        'customer_cuit': make_cuit(rng, '20'),
+        'items': lines,
+        'subtotal': subtotal,
+        'tax': tax,
+        'total': round(subtotal + tax, 2),
+    }
+
+
+def invoice_lines(data: dict) -> List[str]:
+    """Text lines of an AFIP layout invoice"""
+    lines = [
+        'ORIGINAL',
+        'FACTURA A',
+        f"Punto de Venta: {data['punto_de_venta']:05d} Comp. Nro: {data['numero']:08d}",
+        f"Fecha de Emisión: {data['fecha']}",
+        'Razón Social: EMPRESA EJEMPLO S.A.',
+        'Domicilio Comercial: Av. Siempreviva 742 - CABA',
+        f"CUIT: {data['vendor_cuit']}",
+        'Condición frente al IVA: IVA Responsable Inscripto',
+        f"CUIT: {data['customer_cuit']}",
+        'Apellido y Nombre / Razón Social: CLIENTE EJEMPLO SRL',
+        'Domicilio: Calle Falsa 123 - Rosario',
+        'Condición de venta: Contado',
+        'Código Producto / Servicio Cantidad Precio Unit. Subtotal',
+    ]
+    for item in data['items']:
+        lines.append(
+            f"{item['description']} {item['quantity']},00 "
+            f"{format_amount(item['unit_price'])} {format_amount(item['total_price'])}"
+        )
+    lines += [
+        f"Importe Neto Gravado: $ {format_amount(data['subtotal'])}",
+        f"IVA 21%: $ {format_amount(data['tax'])}",
+        'Importe Otros Tributos: $ 0,00',
+        f"Importe Total: $ {format_amount(data['total'])}",
+        'CAE N°: 74123456789012',
+    ]
+    return lines
+
+
+def afip_qr_url(data: dict) -> str:
+    """Return the AFIP QR code URL of an invoice"""
+    payload = {
+        'ver': 1, 'fecha': '-'.join(reversed(data['fecha'].split('/'))),
+        'cuit': int(data['vendor_cuit']), 'ptoVta': data['punto_de_venta'], 'tipoCmp': 1,
+        'nroCmp': data['numero'], 'importe': data['total'], 'moneda': 'PES', 'ctz': 1,
+        'tipoDocRec': 80, 'nroDocRec': int(data['customer_cuit']),
+        'tipoCodAut': 'E', 'codAut': 74123456789012,
+    }
+    encoded = base64.b64encode(json.dumps(payload).encode()).decode()
+    return f'https://www.afip.gob.ar/fe/qr/?p={encoded}'
+
+
+def _pdf_escape(line: str) -> str:
+    return line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def make_pdf(pages: int = 1, seed: int = 0) -> bytes:
+    """Build a PDF with a text layer: the invoice on page 1, terms on the rest"""
+    data = invoice_data(seed)
+    page_lines = [invoice_lines(data)] + [[TERMS_LINE] * 40 for _ in range(pages - 1)]
+
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None]
+    font_number = 3
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    page_numbers = []
+    for lines in page_lines:
+        text = ''.join(f"({_pdf_escape(line)}) Tj T* " for line in lines)
+        stream = f"BT /F1 9 Tf 11 TL 30 810 Td {text}ET".encode('cp1252')
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_number = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (font_number, content_number)
+        )
+        page_numbers.append(len(objects))
+    kids = b' '.join(b"%d 0 R" % number for number in page_numbers)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_numbers))
+
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return pdf
+
+
+def make_image(width: int = 1240, height: int = 1754, seed: int = 0, fmt: str = 'PNG', with_qr: bool = True) -> bytes:
+    """Render the invoice as an image (A4 at 150 dpi by default, or a phone photo size)"""
+    if not PIL_AVAILABLE:
+        raise RuntimeError('Pillow is required to generate images')
+
+    data = invoice_data(seed)
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    scale = width / 1240
+    for i, line in enumerate(invoice_lines(data)):
+        draw.text((60 * scale, (60 + i * 28) * scale), line, fill='black')
+
+    if with_qr and QRCODE_AVAILABLE:
+        qr = qrcode.make(afip_qr_url(data)).get_image().convert('RGB')
+        size = int(300 * scale)
+        image.paste(qr.resize((size, size)), (int(60 * scale), height - size - int(60 * scale)))
+
+    buffer = BytesIO()
+    image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def make_docx(pages: int = 1, seed: int = 0) -> bytes:
+    """Build a DOCX invoice, with page breaks before each terms page"""
+    if not DOCX_AVAILABLE:
+        raise RuntimeError('python-docx is required to generate DOCX files')
+
+    document = docx.Document()
+    for line in invoice_lines(invoice_data(seed)):
+        document.add_paragraph(line)
+    for _ in range(pages - 1):
+        document.add_page_break()
+        for _ in range(40):
+            document.add_paragraph(TERMS_LINE)
+
+    buffer = BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
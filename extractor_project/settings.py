@@ -145,6 +145,12 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10,
 }
 
+# Largest ?page_size= accepted by the invoice list (cursor paginated)
+INVOICE_MAX_PAGE_SIZE = int(os.getenv('INVOICE_MAX_PAGE_SIZE', '500'))
+
+# Rows fetched and written per chunk by GET /api/invoices/export/
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '2000'))
+
 # CORS Configuration
 CORS_ALLOW_ALL_ORIGINS = os.getenv('CORS_ALLOW_ALL_ORIGINS', 'True') == 'True'
 CORS_ALLOWED_ORIGINS = os.getenv('CORS_ALLOWED_ORIGINS', '').split(',') if os.getenv('CORS_ALLOWED_ORIGINS') else []
@@ -156,3 +162,97 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # Llamaindex Configuration
 LLAMAINDEX_MODEL = os.getenv('LLAMAINDEX_MODEL', 'gpt-3.5-turbo')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
+
+# LLM backend used by the extraction service:
+# 'openai' (OpenAI API), 'openai_like' (any OpenAI-compatible server at
+# API_BASE) or 'fake' (in-process stand-in with canned answers, for
+# benchmarks and load tests)
+LLM_BACKEND = {
+    'BACKEND': os.getenv('LLM_BACKEND', 'openai'),
+    'MODEL': LLAMAINDEX_MODEL,
+    'API_KEY': OPENAI_API_KEY,
+    'API_BASE': os.getenv('LLM_API_BASE', ''),
+    'FAKE_LATENCY': float(os.getenv('LLM_FAKE_LATENCY', '0')),
+    'FAKE_RESPONSES': None,
+    # Keep-alive connections of the process-wide HTTP client (OpenAI backends)
+    'MAX_CONNECTIONS': int(os.getenv('LLM_MAX_CONNECTIONS', '20')),
+}
+
+# 'structured' extracts every field in one schema-constrained call,
+# 'per_field' queries each field separately
+LLAMAINDEX_EXTRACTION_MODE = os.getenv('LLAMAINDEX_EXTRACTION_MODE', 'structured')
+# Documents up to this many (estimated) tokens are sent to the LLM directly,
+# larger ones are embedded into a vector index. 0 always builds the index.
+LLAMAINDEX_DIRECT_CONTEXT_MAX_TOKENS = int(os.getenv('LLAMAINDEX_DIRECT_CONTEXT_MAX_TOKENS', '6000'))
+# Per-field queries in flight at once (1 sends them one after another) and
+# seconds before a single query is abandoned
+LLAMAINDEX_QUERY_CONCURRENCY = int(os.getenv('LLAMAINDEX_QUERY_CONCURRENCY', '8'))
+LLAMAINDEX_QUERY_TIMEOUT = float(os.getenv('LLAMAINDEX_QUERY_TIMEOUT', '60'))
+# Read AFIP-layout PDF fields with regular expressions before calling the LLM.
+# Only fields found with at least FAST_PATH_MIN_CONFIDENCE (0-1) are kept.
+FAST_PATH_ENABLED = os.getenv('FAST_PATH_ENABLED', 'True') == 'True'
+FAST_PATH_MIN_CONFIDENCE = float(os.getenv('FAST_PATH_MIN_CONFIDENCE', '0.8'))
+# Decode the AFIP QR code (RG 4892) of PDFs and images before calling the LLM
+AFIP_QR_ENABLED = os.getenv('AFIP_QR_ENABLED', 'True') == 'True'
+# Only pass the pages of PDFs longer than PAGE_PRUNING_MAX_PAGES that look
+# like the invoice (keyword density of Factura, CUIT, Total and IVA)
+PAGE_PRUNING_ENABLED = os.getenv('PAGE_PRUNING_ENABLED', 'True') == 'True'
+PAGE_PRUNING_MAX_PAGES = int(os.getenv('PAGE_PRUNING_MAX_PAGES', '3'))
+# Auto-orient, crop, grayscale and downsample JPG/PNG documents before
+# loading them (faster readers, but not fewer vision tokens: cropped tickets
+# are billed as more tiles). IMAGE_PREPROCESSING_DPI is applied to an A4
+# page (200 dpi: long side up to 2340px); results are cached by content
+# hash in IMAGE_PREPROCESSING_CACHE_DIR (default MEDIA_ROOT/preprocessed).
+IMAGE_PREPROCESSING_ENABLED = os.getenv('IMAGE_PREPROCESSING_ENABLED', 'False') == 'True'
+IMAGE_PREPROCESSING_DPI = int(os.getenv('IMAGE_PREPROCESSING_DPI', '200'))
+IMAGE_PREPROCESSING_CACHE_DIR = os.getenv('IMAGE_PREPROCESSING_CACHE_DIR', '')
+# Worker processes that parse documents (PDF/DOCX parsing and image decoding
+# are CPU-bound), shared by all threads of a process; 0 parses in the calling
+# thread. A document taking longer than DOCUMENT_LOADER_TIMEOUT seconds fails.
+DOCUMENT_LOADER_WORKERS = int(os.getenv('DOCUMENT_LOADER_WORKERS', '0'))
+DOCUMENT_LOADER_TIMEOUT = float(os.getenv('DOCUMENT_LOADER_TIMEOUT', '120'))
+
+# Extraction result cache, keyed by document SHA-256, model and prompt version.
+# BACKEND: 'django' (a CACHES alias given in LOCATION), 'disk' (a directory
+# given in LOCATION), 'db' (the ExtractionCacheEntry table) or '' to disable.
+EXTRACTION_CACHE = {
+    'BACKEND': os.getenv('EXTRACTION_CACHE_BACKEND', 'django'),
+    'LOCATION': os.getenv('EXTRACTION_CACHE_LOCATION', 'default'),
+    'TTL': int(os.getenv('EXTRACTION_CACHE_TTL', str(60 * 60 * 24 * 30))),
+    'MAX_ENTRIES': int(os.getenv('EXTRACTION_CACHE_MAX_ENTRIES', '10000')),
+}
+
+# Extraction job queue
+# Uploads are queued and processed by `manage.py run_extraction_worker`.
+# Set INVOICE_PROCESSING_ASYNC=False to process them inside the request.
+INVOICE_PROCESSING_ASYNC = os.getenv('INVOICE_PROCESSING_ASYNC', 'True') == 'True'
+EXTRACTION_WORKER_CONCURRENCY = int(os.getenv('EXTRACTION_WORKER_CONCURRENCY', '4'))
+EXTRACTION_WORKER_POLL_INTERVAL = float(os.getenv('EXTRACTION_WORKER_POLL_INTERVAL', '1.0'))
+EXTRACTION_JOB_MAX_ATTEMPTS = int(os.getenv('EXTRACTION_JOB_MAX_ATTEMPTS', '3'))
+EXTRACTION_JOB_TIMEOUT = int(os.getenv('EXTRACTION_JOB_TIMEOUT', '600'))
+# /api/invoices/{id}/events/: seconds between checks for new events, and
+# longest a stream stays open before the client has to reconnect
+EXTRACTION_EVENTS_POLL_INTERVAL = float(os.getenv('EXTRACTION_EVENTS_POLL_INTERVAL', '0.25'))
+EXTRACTION_EVENTS_TIMEOUT = int(os.getenv('EXTRACTION_EVENTS_TIMEOUT', '300'))
+# Seconds the events of a finished run are kept (see manage.py prune_invoice_events)
+EXTRACTION_EVENTS_RETENTION = int(os.getenv('EXTRACTION_EVENTS_RETENTION', '86400'))
+# Maximum number of documents accepted by /api/invoices/batch/
+INVOICE_BATCH_MAX_FILES = int(os.getenv('INVOICE_BATCH_MAX_FILES', '500'))
+DATA_UPLOAD_MAX_NUMBER_FILES = INVOICE_BATCH_MAX_FILES
+
+# Uploads are hashed, sniffed and streamed next to the stored documents in
+# one pass (see invoice_extractor.uploads)
+FILE_UPLOAD_HANDLERS = ['invoice_extractor.uploads.HashingUploadHandler']
+# Where uploads are written while they are received. Must be on the same file
+# system as MEDIA_ROOT and not served; defaults to <MEDIA_ROOT>-incoming
+INVOICE_UPLOAD_INCOMING_DIR = os.getenv('INVOICE_UPLOAD_INCOMING_DIR') or None
+# Largest ZIP archive accepted by /api/invoices/batch/ (documents: 10MB)
+INVOICE_ARCHIVE_MAX_SIZE = int(os.getenv('INVOICE_ARCHIVE_MAX_SIZE', str(100 * 1024 * 1024)))
+# Largest total uncompressed size of the documents of a batch upload, checked
+# against the ZIP listings before any member is decompressed
+INVOICE_BATCH_MAX_UNCOMPRESSED_SIZE = int(os.getenv('INVOICE_BATCH_MAX_UNCOMPRESSED_SIZE', str(1024 * 1024 * 1024)))
+
+# Documents are stored once per SHA-256. When enabled, uploading a document
+# that already has a completed invoice copies its extraction instead of
+# queueing a new one.
+INVOICE_REUSE_DUPLICATE_EXTRACTION = os.getenv('INVOICE_REUSE_DUPLICATE_EXTRACTION', 'False') == 'True'
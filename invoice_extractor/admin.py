@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Invoice, InvoiceItem
+from .analytics import summary_key, update_invoice_summary
+from .models import ExtractionJob, Invoice, InvoiceItem, VendorMonthlySummary
 
 
 class InvoiceItemInline(admin.TabularInline):
@@ -46,6 +47,24 @@ class InvoiceAdmin(admin.ModelAdmin):
     )
     
     inlines = [InvoiceItemInline]
+    
+    def save_model(self, request, obj, form, change):
+        """Move the invoice between vendor summaries if its totals changed"""
+        previous = Invoice.objects.filter(pk=obj.pk).first() if change else None
+        super().save_model(request, obj, form, change)
+        update_invoice_summary(obj, summary_key(previous) if previous else None)
+    
+    def delete_model(self, request, obj):
+        """Remove the deleted invoice from its vendor summary"""
+        super().delete_model(request, obj)
+        update_invoice_summary(obj)
+    
+    def delete_queryset(self, request, queryset):
+        """Remove the deleted invoices from their vendor summaries"""
+        invoices = list(queryset)
+        super().delete_queryset(request, queryset)
+        for invoice in invoices:
+            update_invoice_summary(invoice)
 
 
 @admin.register(InvoiceItem)
@@ -57,3 +76,32 @@ class InvoiceItemAdmin(admin.ModelAdmin):
     ]
     list_filter = ['invoice__status']
     search_fields = ['description', 'product_code', 'invoice__invoice_number']
+
+
+@admin.register(ExtractionJob)
+class ExtractionJobAdmin(admin.ModelAdmin):
+    """Admin interface for ExtractionJob model"""
+    list_display = [
+        'id', 'invoice', 'status', 'attempts', 'worker',
+        'created_at', 'started_at', 'finished_at'
+    ]
+    list_filter = ['status']
+    search_fields = ['invoice__invoice_number', 'invoice__original_filename']
+    readonly_fields = ['created_at', 'started_at', 'finished_at']
+
+
+@admin.register(VendorMonthlySummary)
+class VendorMonthlySummaryAdmin(admin.ModelAdmin):
+    """Admin interface for VendorMonthlySummary model (read only, rebuilt from invoices)"""
+    list_display = [
+        'vendor_cuit', 'month', 'currency', 'invoice_count',
+        'subtotal', 'tax_amount', 'total_amount', 'updated_at'
+    ]
+    list_filter = ['currency', 'month']
+    search_fields = ['vendor_cuit']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
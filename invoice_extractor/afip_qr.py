@@ -0,0 +1,193 @@
+"""
+Decoding of the AFIP QR code printed on electronic invoices
+
+Since RG 4892 every Argentine electronic invoice carries a QR code pointing
+to https://www.afip.gob.ar/fe/qr/?p=<base64 JSON>. The JSON payload holds
+the issuer CUIT, punto de venta, comprobante number, date, amount, currency
+and CAE, so when the code can be read those fields need no extraction at all.
+"""
+import base64
+import binascii
+import importlib.util
+import json
+import logging
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+from .fast_path import FieldMatch
+from .validators import format_invoice_number
+
+# OpenCV and numpy take a quarter of a second to import, so they are only
+# looked up here and imported when a QR code is decoded: processes that
+# never extract (migrate, the admin, list requests) do not pay for them
+QR_DECODER_AVAILABLE = all(importlib.util.find_spec(name) is not None for name in ('cv2', 'numpy'))
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+try:
+    from pypdf import PdfReader
+    PYPDF_AVAILABLE = True
+except ImportError:
+    PYPDF_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+AFIP_QR_HOSTS = ('afip.gob.ar', 'arca.gob.ar')
+
+# AFIP currency codes (FEParamGetTiposMonedas) to ISO 4217
+AFIP_CURRENCIES = {
+    'PES': 'ARS',
+    'DOL': 'USD',
+    '060': 'EUR',
+}
+
+# tipoDocRec value for a CUIT
+DOC_TYPE_CUIT = 80
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def parse_afip_qr_url(url: str) -> Optional[Dict[str, Any]]:
+    """
+    Decode the JSON payload of an AFIP QR code URL
+
+    Args:
+        url: Text of the QR code
+
+    Returns:
+        The payload dictionary, or None if this is not an AFIP invoice QR
+    """
+    if not url:
+        return None
+
+    parsed = urlparse(url.strip())
+    host = parsed.hostname or ''
+    if not any(host == allowed or host.endswith('.' + allowed) for allowed in AFIP_QR_HOSTS):
+        return None
+
+    params = parse_qs(parsed.query)
+    encoded = (params.get('p') or params.get('data') or [None])[0]
+    if not encoded:
+        return None
+
+    try:
+        padded = encoded + '=' * (-len(encoded) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.replace('+', '-').replace('/', '_')))
+    except (binascii.Error, ValueError):
+        return None
+
+    return payload if isinstance(payload, dict) else None
+
+
+def payload_to_fields(payload: Dict[str, Any]) -> Dict[str, FieldMatch]:
+    """
+    Map an AFIP QR payload to invoice fields
+
+    Values are formatted like the text extracted from the document so that
+    parse_currency and parse_date handle them the same way.
+    """
+    fields = {}
+
+    if payload.get('cuit'):
+        fields['vendor_cuit'] = FieldMatch(str(payload['cuit']), 1.0)
+
+    if payload.get('ptoVta') is not None and payload.get('nroCmp') is not None:
+        try:
+            fields['invoice_number'] = FieldMatch(
+                format_invoice_number(payload['ptoVta'], payload['nroCmp']), 1.0
+            )
+        except (TypeError, ValueError):
+            pass
+
+    if payload.get('fecha'):
+        fields['invoice_date'] = FieldMatch(str(payload['fecha']), 1.0)
+
+    if payload.get('importe') is not None:
+        try:
+            fields['total_amount'] = FieldMatch(
+                f"{float(payload['importe']):.2f}".replace('.', ','), 1.0
+            )
+        except (TypeError, ValueError):
+            pass
+
+    if payload.get('moneda'):
+        currency = str(payload['moneda'])
+        fields['currency'] = FieldMatch(AFIP_CURRENCIES.get(currency, currency), 1.0)
+
+    if payload.get('tipoDocRec') == DOC_TYPE_CUIT and payload.get('nroDocRec'):
+        fields['customer_cuit'] = FieldMatch(str(payload['nroDocRec']), 1.0)
+
+    return fields
+
+
+def _decode_image(image) -> Optional[str]:
+    """Return the text of the first QR code found in a PIL image"""
+    if not QR_DECODER_AVAILABLE:
+        return None
+
+    import cv2
+    import numpy as np
+
+    array = np.array(image.convert('L'))
+    detector = cv2.QRCodeDetector()
+    found, texts, _, _ = detector.detectAndDecodeMulti(array)
+    if found:
+        for text in texts:
+            if text:
+                return text
+    return None
+
+
+def _pdf_qr_urls(file_path: str):
+    """Yield candidate QR URLs from a PDF: link annotations first, then embedded images"""
+    reader = PdfReader(file_path)
+
+    # Many billing systems also add the QR URL as a clickable link
+    for page in reader.pages:
+        for annotation in page.get('/Annots') or []:
+            action = annotation.get_object().get('/A') or {}
+            uri = action.get('/URI')
+            if uri:
+                yield str(uri)
+
+    if not PIL_AVAILABLE:
+        return
+    for page in reader.pages:
+        for image in page.images:
+            try:
+                text = _decode_image(image.image)
+            except Exception:
+                continue
+            if text:
+                yield text
+
+
+def find_afip_qr(file_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Find and decode the AFIP QR code of a PDF or image document
+
+    Args:
+        file_path: Path to the invoice document
+
+    Returns:
+        The QR payload dictionary, or None if no AFIP QR code was found
+    """
+    lower_path = file_path.lower()
+
+    try:
+        if lower_path.endswith('.pdf') and PYPDF_AVAILABLE:
+            for url in _pdf_qr_urls(file_path):
+                payload = parse_afip_qr_url(url)
+                if payload:
+                    return payload
+        elif lower_path.endswith(IMAGE_EXTENSIONS) and PIL_AVAILABLE:
+            with Image.open(file_path) as image:
+                return parse_afip_qr_url(_decode_image(image))
+    except Exception:
+        logger.warning("Could not read the AFIP QR code of %s", file_path, exc_info=True)
+
+    return None
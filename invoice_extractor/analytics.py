@@ -0,0 +1,146 @@
+"""
+Per vendor, month and currency totals of completed invoices
+
+VendorMonthlySummary rows are refreshed bucket by bucket: when an invoice
+completes, is reprocessed, fails, or is edited or deleted through the API
+or the admin, only the buckets it left and entered are aggregated again (through the vendor CUIT / invoice date index), so
+dashboards read one row per vendor and month instead of every invoice.
+"""
+import logging
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Iterable, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+
+from .filters import cuit_variants
+from .models import Invoice, VendorMonthlySummary
+from .validators import normalize_cuit
+
+logger = logging.getLogger(__name__)
+
+SummaryKey = Tuple[str, date, str]
+
+AMOUNT_FIELDS = ('subtotal', 'tax_amount', 'total_amount')
+
+
+def _month_start(value) -> Optional[date]:
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        value = value.date()
+    elif isinstance(value, str):
+        try:
+            value = date.fromisoformat(value[:10])
+        except ValueError:
+            return None
+    return value.replace(day=1)
+
+
+def _next_month(month: date) -> date:
+    return month.replace(year=month.year + 1, month=1) if month.month == 12 else month.replace(month=month.month + 1)
+
+
+def summary_key(invoice: Invoice) -> Optional[SummaryKey]:
+    """
+    Return the (vendor CUIT, month, currency) bucket of an invoice
+
+    Invoices without a valid vendor CUIT or an invoice date are not
+    summarized and return None.
+    """
+    vendor_cuit = normalize_cuit(invoice.vendor_cuit)
+    month = _month_start(invoice.invoice_date)
+    if vendor_cuit is None or month is None:
+        return None
+    return vendor_cuit, month, invoice.currency or 'ARS'
+
+
+def _aggregates():
+    zero = Value(Decimal('0'), output_field=DecimalField(max_digits=16, decimal_places=2))
+    aggregates = {'invoice_count': Count('id')}
+    for field in AMOUNT_FIELDS:
+        aggregates[field] = Coalesce(Sum(field), zero)
+    return aggregates
+
+
+def refresh_summaries(keys: Iterable[SummaryKey]) -> None:
+    """
+    Recompute the given buckets from the completed invoices
+
+    Empty buckets are deleted.
+    """
+    for vendor_cuit, month, currency in set(keys):
+        totals = Invoice.objects.filter(
+            status='completed',
+            vendor_cuit__in=cuit_variants(vendor_cuit),
+            invoice_date__gte=month,
+            invoice_date__lt=_next_month(month),
+            currency=currency,
+        ).aggregate(**_aggregates())
+        lookup = {'vendor_cuit': vendor_cuit, 'month': month, 'currency': currency}
+        if totals['invoice_count']:
+            VendorMonthlySummary.objects.update_or_create(defaults=totals, **lookup)
+        else:
+            VendorMonthlySummary.objects.filter(**lookup).delete()
+
+
+def update_invoice_summary(invoice: Invoice, previous_key: Optional[SummaryKey] = None) -> None:
+    """
+    Refresh the buckets an invoice was in and is now in, once the current
+    transaction commits
+
+    Running after the commit means concurrent workers completing invoices
+    of the same bucket always see each other's rows. A failed refresh
+    (e.g. two workers creating the same bucket) is logged and does not
+    fail the extraction, which is already saved; the next change to the
+    bucket or rebuild_summaries fixes it.
+
+    Args:
+        invoice: Invoice that completed, was reprocessed, failed, was edited
+            or was deleted
+        previous_key: Bucket of the invoice before the change, if any
+    """
+    keys = {key for key in (previous_key, summary_key(invoice)) if key}
+    if keys:
+        transaction.on_commit(lambda: refresh_summaries(keys), robust=True)
+
+
+def rebuild_summaries() -> int:
+    """
+    Recompute the whole summary table from the completed invoices
+
+    Returns:
+        Number of summary rows written
+    """
+    rows = (
+        Invoice.objects
+        .filter(status='completed', vendor_cuit__isnull=False, invoice_date__isnull=False)
+        .annotate(month=TruncMonth('invoice_date'))
+        .values('vendor_cuit', 'month', 'currency')
+        .annotate(**_aggregates())
+        .order_by()
+    )
+
+    # CUITs edited in the admin may be spelled differently, so spellings of
+    # the same CUIT are merged
+    summaries = {}
+    for row in rows.iterator():
+        vendor_cuit = normalize_cuit(row['vendor_cuit'])
+        if vendor_cuit is None:
+            continue
+        key = (vendor_cuit, _month_start(row['month']), row['currency'] or 'ARS')
+        summary = summaries.setdefault(key, VendorMonthlySummary(
+            vendor_cuit=key[0], month=key[1], currency=key[2],
+            subtotal=Decimal('0'), tax_amount=Decimal('0'), total_amount=Decimal('0'),
+        ))
+        summary.invoice_count += row['invoice_count']
+        for field in AMOUNT_FIELDS:
+            setattr(summary, field, getattr(summary, field) + row[field])
+
+    with transaction.atomic():
+        VendorMonthlySummary.objects.all().delete()
+        VendorMonthlySummary.objects.bulk_create(summaries.values(), batch_size=1000)
+    logger.info(f"Rebuilt {len(summaries)} vendor monthly summaries")
+    return len(summaries)
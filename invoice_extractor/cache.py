@@ -0,0 +1,288 @@
+"""
+Extraction result cache keyed by document content hash
+
+Suppliers often send the same document more than once. Caching the result
+of InvoiceExtractionService.extract_invoice_data by the SHA-256 of the file
+contents (plus the model and prompt version) lets duplicate uploads skip the
+Llamaindex pipeline entirely.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+# Fraction (1 / CULL_FREQUENCY) of the disk entries evicted once there are
+# more than max_entries, as in Django's file-based cache
+CULL_FREQUENCY = 3
+
+
+def file_sha256(file_path: str) -> str:
+    """Return the hex SHA-256 digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_cache_key(content_hash: str, *parts: str) -> str:
+    """Build a cache key from the document hash and the extraction parameters"""
+    return ':'.join(['extraction', content_hash, *(str(part) for part in parts)])
+
+
+class BaseExtractionCache:
+    """
+    Base class for extraction cache backends
+
+    Subclasses implement _get, _set and clear. Hit and miss counters are
+    kept per process.
+    """
+
+    def __init__(self, ttl: Optional[int] = None, max_entries: Optional[int] = None, **options):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.options = options
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached result for key, or None"""
+        value = self._get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        """Store a result under key"""
+        self._set(key, value)
+
+    def stats(self) -> Dict[str, int]:
+        """Return the hit/miss counters for this process"""
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def _set(self, key: str, value: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+
+class DjangoExtractionCache(BaseExtractionCache):
+    """
+    Cache backend using one of the Django CACHES aliases
+
+    Expiry uses the TTL as the cache timeout. Entry limits and culling are
+    handled by the Django cache backend itself (its MAX_ENTRIES option).
+    """
+
+    def __init__(self, location: str = 'default', **kwargs):
+        super().__init__(**kwargs)
+        self.cache = caches[location]
+
+    def _get(self, key):
+        return self.cache.get(key)
+
+    def _set(self, key, value):
+        self.cache.set(key, value, timeout=self.ttl)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class DiskExtractionCache(BaseExtractionCache):
+    """
+    Cache backend storing one JSON file per entry on local disk
+
+    Files are spread over 256 subdirectories by hash prefix. Entries older
+    than the TTL are ignored and removed. The number of entries is tracked
+    per process, and once there are more than max_entries the directory is
+    scanned and the least recently used third of them evicted.
+    """
+
+    def __init__(self, location: str, **kwargs):
+        super().__init__(**kwargs)
+        self.location = Path(location)
+        self._entry_count = None
+
+    def _path(self, key: str) -> Path:
+        name = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return self.location / name[:2] / f'{name}.json'
+
+    def _get(self, key):
+        path = self._path(key)
+        try:
+            stat = path.stat()
+            if self.ttl is not None and time.time() - stat.st_mtime > self.ttl:
+                path.unlink(missing_ok=True)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+            # Record the access time for LRU eviction
+            os.utime(path, (time.time(), stat.st_mtime))
+        except (OSError, ValueError):
+            # Also covers an entry evicted or expired by another process
+            return None
+        return value
+
+    def _set(self, key, value):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        is_new = not path.exists()
+        # A unique temporary file, so concurrent writers of the same key
+        # never write into each other's file
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        if self.max_entries and is_new:
+            self._added_entry()
+
+    def _entries(self):
+        return list(self.location.glob('*/*.json'))
+
+    def _added_entry(self):
+        with self._lock:
+            if self._entry_count is None:
+                self._entry_count = len(self._entries())
+            else:
+                self._entry_count += 1
+            if self._entry_count > self.max_entries:
+                self._cull()
+
+    def _cull(self):
+        entries = self._entries()
+        excess = len(entries) - self.max_entries
+        if excess > 0:
+            entries.sort(key=self._last_access)
+            culled = max(excess, len(entries) // CULL_FREQUENCY)
+            for entry in entries[:culled]:
+                entry.unlink(missing_ok=True)
+            entries = entries[culled:]
+        self._entry_count = len(entries)
+
+    @staticmethod
+    def _last_access(entry):
+        try:
+            return entry.stat().st_atime
+        except OSError:
+            return 0
+
+    def clear(self):
+        for entry in self._entries():
+            entry.unlink(missing_ok=True)
+        with self._lock:
+            self._entry_count = None
+
+
+class DatabaseExtractionCache(BaseExtractionCache):
+    """
+    Cache backend storing entries in the ExtractionCacheEntry table
+
+    Shared by every process using the same database.
+    """
+
+    def _get(self, key):
+        from .models import ExtractionCacheEntry
+
+        entry = ExtractionCacheEntry.objects.filter(key=key).first()
+        if entry is None:
+            return None
+        if self.ttl is not None and entry.created_at < timezone.now() - timedelta(seconds=self.ttl):
+            entry.delete()
+            return None
+
+        # Record the access time for LRU eviction
+        ExtractionCacheEntry.objects.filter(pk=entry.pk).update(last_accessed_at=timezone.now())
+        return entry.result
+
+    def _set(self, key, value):
+        from .models import ExtractionCacheEntry
+
+        ExtractionCacheEntry.objects.update_or_create(
+            key=key,
+            defaults={'result': value, 'created_at': timezone.now()},
+        )
+        self._cull()
+
+    def _cull(self):
+        from .models import ExtractionCacheEntry
+
+        if self.ttl is not None:
+            ExtractionCacheEntry.objects.filter(
+                created_at__lt=timezone.now() - timedelta(seconds=self.ttl)
+            ).delete()
+        if self.max_entries:
+            stale = ExtractionCacheEntry.objects.order_by('-last_accessed_at', '-pk').values_list(
+                'pk', flat=True
+            )[self.max_entries:]
+            ExtractionCacheEntry.objects.filter(pk__in=list(stale)).delete()
+
+    def clear(self):
+        from .models import ExtractionCacheEntry
+
+        ExtractionCacheEntry.objects.all().delete()
+
+
+CACHE_BACKENDS = {
+    'django': DjangoExtractionCache,
+    'disk': DiskExtractionCache,
+    'db': DatabaseExtractionCache,
+}
+
+
+@lru_cache(maxsize=None)
+def get_extraction_cache() -> Optional[BaseExtractionCache]:
+    """
+    Return the extraction cache configured in settings.EXTRACTION_CACHE
+
+    Returns None when caching is disabled.
+    """
+    config = dict(getattr(settings, 'EXTRACTION_CACHE', None) or {})
+    backend = config.pop('BACKEND', None)
+    if not backend:
+        return None
+
+    try:
+        backend_class = CACHE_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(
+            f"Unknown extraction cache backend '{backend}'. "
+            f"Available backends: {', '.join(CACHE_BACKENDS)}"
+        )
+
+    options = {key.lower(): value for key, value in config.items()}
+    return backend_class(**options)
+
+
+@receiver(setting_changed)
+def _reset_extraction_cache(setting, **kwargs):
+    if setting == 'EXTRACTION_CACHE':
+        get_extraction_cache.cache_clear()
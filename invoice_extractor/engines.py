@@ -0,0 +1,82 @@
+"""
+Query engines used by the invoice extraction service
+"""
+from typing import Any, Optional, Type
+
+
+DIRECT_CONTEXT_TEMPLATE = (
+    "Below is the full text of an invoice document.\n"
+    "---------------------\n"
+    "{context_str}\n"
+    "---------------------\n"
+    "Using only the document above, answer the query.\n"
+    "Query: {query_str}\n"
+    "Answer: "
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token count estimate (about 4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def _prompt_template():
+    from llama_index.core import PromptTemplate
+    return PromptTemplate(DIRECT_CONTEXT_TEMPLATE)
+
+
+class DirectContextQueryEngine:
+    """
+    Query engine that sends the whole document text to the LLM
+
+    Small invoices fit in a single prompt, so there is no need to chunk,
+    embed and index them before querying. This engine exposes the same
+    query() interface as a Llamaindex query engine.
+    """
+
+    def __init__(self, context: str, llm=None, output_cls: Optional[Type] = None):
+        self.context = context
+        self.output_cls = output_cls
+        self._llm = llm
+
+    @property
+    def llm(self):
+        if self._llm is not None:
+            return self._llm
+        from llama_index.core import Settings
+        return Settings.llm
+
+    def query(self, query_str: str) -> Any:
+        """
+        Answer a query against the document text
+
+        Returns:
+            An instance of output_cls if one was given, otherwise the LLM
+            completion response
+        """
+        if self.output_cls is not None:
+            return self.llm.structured_predict(
+                self.output_cls,
+                _prompt_template(),
+                context_str=self.context,
+                query_str=query_str,
+            )
+
+        return self.llm.complete(self._format_prompt(query_str))
+
+    async def aquery(self, query_str: str) -> Any:
+        """Async version of query()"""
+        if self.output_cls is not None:
+            return await self.llm.astructured_predict(
+                self.output_cls,
+                _prompt_template(),
+                context_str=self.context,
+                query_str=query_str,
+            )
+
+        return await self.llm.acomplete(self._format_prompt(query_str))
+
+    def _format_prompt(self, query_str: str) -> str:
+        return DIRECT_CONTEXT_TEMPLATE.format(
+            context_str=self.context, query_str=query_str
+        )
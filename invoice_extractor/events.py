@@ -0,0 +1,214 @@
+"""
+Progress events of invoice extractions, streamed over Server-Sent Events
+
+Uploads and extractions record an InvoiceEvent row at each stage (uploaded,
+processing, parsed, fast_path_fields, llm_fields, items_saved, then
+completed or failed), with the fields in the event as soon as they are
+extracted. GET /api/invoices/{id}/events/ follows the table and streams the
+new rows, so clients see partial results without polling the API. Like the
+job queue, the table is shared by the web and worker processes, so no
+broker is needed. Runs that finished more than EXTRACTION_EVENTS_RETENTION
+seconds ago are deleted by `manage.py prune_invoice_events`.
+"""
+import asyncio
+import json
+import logging
+import time
+from datetime import timedelta
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import Invoice, InvoiceEvent
+
+logger = logging.getLogger(__name__)
+
+# Stages after which nothing more happens until the invoice is reprocessed
+FINAL_STAGES = ('completed', 'failed')
+
+HEARTBEAT_INTERVAL = 15
+
+# Reconnection delay suggested to clients, in milliseconds
+RETRY_DELAY = 2000
+
+
+def record_event(invoice_id: int, stage: str, data: Optional[Dict[str, Any]] = None) -> Optional[InvoiceEvent]:
+    """
+    Record that the extraction of an invoice reached a stage
+
+    Events are best effort: a failure to record one is logged and never
+    fails the extraction.
+
+    Args:
+        invoice_id: Invoice the event belongs to
+        stage: One of InvoiceEvent.STAGE_CHOICES
+        data: JSON serializable details, e.g. {'fields': {...}}
+    """
+    try:
+        return InvoiceEvent.objects.create(invoice_id=invoice_id, stage=stage, data=data or {})
+    except Exception:
+        logger.warning("Could not record the %s event of invoice %s", stage, invoice_id, exc_info=True)
+        return None
+
+
+class AsyncEventRecorder:
+    """
+    Progress callback for the async extraction pipeline
+
+    Calls return immediately; the events are written in order through
+    sync_to_async. Await flush() before the request ends.
+    """
+
+    def __init__(self, invoice_id: int):
+        self.invoice_id = invoice_id
+        self._pending = []
+
+    def __call__(self, stage: str, data: Optional[Dict[str, Any]] = None) -> None:
+        self._pending.append(asyncio.ensure_future(sync_to_async(record_event)(self.invoice_id, stage, data)))
+
+    async def flush(self) -> None:
+        pending, self._pending = self._pending, []
+        await asyncio.gather(*pending)
+
+
+def format_event(event: InvoiceEvent) -> str:
+    """Format an event as an SSE message; error details are only sent in DEBUG"""
+    data = dict(event.data)
+    if event.stage == 'failed' and not settings.DEBUG:
+        data.pop('error', None)
+    data['stage'] = event.stage
+    return f"id: {event.id}\nevent: {event.stage}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+def is_final(event: InvoiceEvent) -> bool:
+    # A failed attempt that will be retried does not end the stream
+    return event.stage in FINAL_STAGES and not event.data.get('retrying')
+
+
+def _final_events(events):
+    """
+    Final events among events, leaving out the failed attempts that are retried
+
+    The key is checked too: a missing key compares as NULL, which a plain
+    exclude(data__retrying=True) would also leave out.
+    """
+    return events.filter(stage__in=FINAL_STAGES).exclude(data__has_key='retrying', data__retrying=True)
+
+
+def _stream_start(invoice: Invoice, last_event_id: Optional[int]) -> int:
+    """Id after which to stream: the last event the client got, or the end of the previous run"""
+    if last_event_id is not None:
+        return last_event_id
+    events = InvoiceEvent.objects.filter(invoice=invoice)
+    latest = events.order_by('-id').values_list('id', flat=True).first()
+    finals = list(_final_events(events).order_by('-id').values_list('id', flat=True)[:2])
+    if finals and finals[0] == latest:
+        finals = finals[1:]
+    return finals[0] if finals else 0
+
+
+def _events_after(invoice: Invoice, last_id: int) -> list:
+    return list(InvoiceEvent.objects.filter(invoice=invoice, id__gt=last_id).order_by('id'))
+
+
+def _untracked_final_event(invoice: Invoice) -> Optional[InvoiceEvent]:
+    """Final event of an invoice that finished before it had any events"""
+    invoice.refresh_from_db(fields=['status'])
+    if invoice.status not in FINAL_STAGES or invoice.events.exists():
+        return None
+    return InvoiceEvent(id=0, invoice=invoice, stage=invoice.status)
+
+
+def event_stream(invoice: Invoice, last_event_id: Optional[int] = None) -> Iterator[str]:
+    """
+    Yield the SSE messages of an invoice until its extraction finishes
+
+    The table is polled every EXTRACTION_EVENTS_POLL_INTERVAL seconds, and
+    the stream ends after EXTRACTION_EVENTS_TIMEOUT seconds regardless (the
+    client reconnects with Last-Event-ID). Used under WSGI, where each open
+    stream holds a thread; see aevent_stream.
+
+    Args:
+        invoice: Invoice to follow
+        last_event_id: Last event the client received, from the
+            Last-Event-ID header. Without it the current run is replayed.
+    """
+    poll_interval = getattr(settings, 'EXTRACTION_EVENTS_POLL_INTERVAL', 0.25)
+    deadline = time.monotonic() + getattr(settings, 'EXTRACTION_EVENTS_TIMEOUT', 300)
+    heartbeat = time.monotonic() + HEARTBEAT_INTERVAL
+
+    last_id = _stream_start(invoice, last_event_id)
+    yield f"retry: {RETRY_DELAY}\n\n"
+
+    final = _untracked_final_event(invoice)
+    if final is not None:
+        yield format_event(final)
+        return
+
+    while time.monotonic() < deadline:
+        for event in _events_after(invoice, last_id):
+            last_id = event.id
+            yield format_event(event)
+            if is_final(event):
+                return
+        if time.monotonic() >= heartbeat:
+            heartbeat = time.monotonic() + HEARTBEAT_INTERVAL
+            yield ": keepalive\n\n"
+        time.sleep(poll_interval)
+
+
+def prune_events(retention: Optional[int] = None) -> int:
+    """
+    Delete the events of extraction runs that finished a while ago
+
+    An event is deleted when a final event of the same invoice at or after
+    it is older than the retention, so runs in progress and recently
+    finished ones (which clients may still be replaying) are kept. The
+    stream of an invoice without events sends its final status.
+
+    Args:
+        retention: Seconds a finished run is kept, by default
+            settings.EXTRACTION_EVENTS_RETENTION
+
+    Returns:
+        Number of events deleted
+    """
+    if retention is None:
+        retention = getattr(settings, 'EXTRACTION_EVENTS_RETENTION', 86400)
+    finished = _final_events(InvoiceEvent.objects).filter(
+        created_at__lt=timezone.now() - timedelta(seconds=retention)
+    )
+    deleted, _ = InvoiceEvent.objects.filter(
+        Exists(finished.filter(invoice=OuterRef('invoice'), id__gte=OuterRef('id')))
+    ).delete()
+    return deleted
+
+
+async def aevent_stream(invoice: Invoice, last_event_id: Optional[int] = None) -> AsyncIterator[str]:
+    """Async version of event_stream, used under ASGI where an open stream holds no thread"""
+    poll_interval = getattr(settings, 'EXTRACTION_EVENTS_POLL_INTERVAL', 0.25)
+    deadline = time.monotonic() + getattr(settings, 'EXTRACTION_EVENTS_TIMEOUT', 300)
+    heartbeat = time.monotonic() + HEARTBEAT_INTERVAL
+
+    last_id = await sync_to_async(_stream_start)(invoice, last_event_id)
+    yield f"retry: {RETRY_DELAY}\n\n"
+
+    final = await sync_to_async(_untracked_final_event)(invoice)
+    if final is not None:
+        yield format_event(final)
+        return
+
+    while time.monotonic() < deadline:
+        for event in await sync_to_async(_events_after)(invoice, last_id):
+            last_id = event.id
+            yield format_event(event)
+            if is_final(event):
+                return
+        if time.monotonic() >= heartbeat:
+            heartbeat = time.monotonic() + HEARTBEAT_INTERVAL
+            yield ": keepalive\n\n"
+        await asyncio.sleep(poll_interval)
@@ -0,0 +1,189 @@
+"""
+Streaming export of invoices and line items
+
+Rows are read with values_list() and .iterator(chunk_size=...) and written
+out one chunk at a time, so memory stays flat whatever the number of rows.
+"""
+import csv
+import json
+import logging
+from itertools import islice
+from typing import Iterable, Iterator, List
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.http import StreamingHttpResponse
+
+from .models import Invoice, InvoiceItem
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+INVOICE_EXPORT_FIELDS = [
+    'id', 'status', 'uploaded_at', 'processed_at',
+    'invoice_number', 'invoice_date',
+    'vendor_name', 'vendor_cuit', 'customer_name', 'customer_cuit',
+    'subtotal', 'tax_amount', 'total_amount', 'currency',
+    'payment_terms', 'original_filename',
+]
+
+ITEM_EXPORT_FIELDS = [
+    'invoice_id', 'invoice__invoice_number', 'invoice__invoice_date', 'invoice__vendor_cuit',
+    'id', 'description', 'quantity', 'unit_price', 'total_price', 'tax_rate', 'product_code',
+]
+
+
+class _ChunkBuffer:
+    """Write-only file object whose content is taken out after each chunk"""
+
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def write(self, data):
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        if self.parts and isinstance(self.parts[0], str):
+            data = ''.join(self.parts).encode('utf-8')
+        else:
+            data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def _column_name(lookup: str) -> str:
+    return lookup.replace('__', '_')
+
+
+def _model_field(model, lookup: str) -> models.Field:
+    """Resolve a values_list() lookup such as invoice__invoice_date to its field"""
+    *relations, name = lookup.split('__')
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    if name.endswith('_id') and name != 'id':
+        name = name[:-3]
+    return model._meta.get_field(name)
+
+
+def _chunks(rows: Iterable, size: int) -> Iterator[List]:
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _csv_stream(columns, rows, chunk_size):
+    buffer = _ChunkBuffer()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for chunk in _chunks(rows, chunk_size):
+        writer.writerows(chunk)
+        yield buffer.take()
+    yield buffer.take()
+
+
+def _ndjson_stream(columns, rows, chunk_size):
+    for chunk in _chunks(rows, chunk_size):
+        yield ''.join(
+            json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+            for row in chunk
+        ).encode('utf-8')
+
+
+def _arrow_type(field: models.Field):
+    internal_type = field.get_internal_type()
+    if field.is_relation or internal_type in ('AutoField', 'BigAutoField', 'IntegerField', 'BigIntegerField'):
+        return pa.int64()
+    if internal_type == 'DecimalField':
+        return pa.decimal128(field.max_digits, field.decimal_places)
+    if internal_type == 'DateTimeField':
+        return pa.timestamp('us', tz='UTC' if settings.USE_TZ else None)
+    if internal_type == 'DateField':
+        return pa.date32()
+    return pa.string()
+
+
+def _parquet_stream(model, lookups, rows, chunk_size):
+    """Write one Parquet row group per chunk and yield the bytes written so far"""
+    schema = pa.schema([
+        (_column_name(lookup), _arrow_type(_model_field(model, lookup))) for lookup in lookups
+    ])
+    buffer = _ChunkBuffer()
+    writer = pq.ParquetWriter(pa.PythonFile(buffer, mode='w'), schema)
+    try:
+        for chunk in _chunks(rows, chunk_size):
+            columns = list(zip(*chunk))
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(values, type=column.type) for values, column in zip(columns, schema)],
+                schema=schema,
+            ))
+            yield buffer.take()
+    finally:
+        writer.close()
+    yield buffer.take()
+
+
+def export_response(queryset, export_format: str, rows: str = 'invoices') -> StreamingHttpResponse:
+    """
+    Stream the invoices of a queryset, or their line items, as a file
+
+    Args:
+        queryset: Filtered Invoice queryset
+        export_format: One of EXPORT_FORMATS
+        rows: 'invoices' for one row per invoice, 'items' for one row per
+            line item (with the invoice number, date and vendor CUIT)
+
+    Returns:
+        StreamingHttpResponse with the file as an attachment
+    """
+    chunk_size = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+    if rows == 'items':
+        model, lookups = InvoiceItem, ITEM_EXPORT_FIELDS
+        values = InvoiceItem.objects.filter(
+            invoice__in=queryset.order_by().values('pk')
+        ).order_by('invoice_id', 'id')
+    else:
+        model, lookups = Invoice, INVOICE_EXPORT_FIELDS
+        values = queryset
+    values = values.values_list(*lookups).iterator(chunk_size=chunk_size)
+    columns = [_column_name(lookup) for lookup in lookups]
+
+    if export_format == 'parquet':
+        stream = _parquet_stream(model, lookups, values, chunk_size)
+    elif export_format == 'ndjson':
+        stream = _ndjson_stream(columns, values, chunk_size)
+    else:
+        stream = _csv_stream(columns, values, chunk_size)
+
+    response = StreamingHttpResponse(stream, content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{rows}.{export_format}"'
+    return response
@@ -0,0 +1,63 @@
+"""
+In-process fake LLM used by the 'fake' backend (see llm_backends)
+
+Kept apart from llm_backends because it needs Llamaindex at import time.
+"""
+import asyncio
+import json
+import time
+from typing import Any, Dict
+
+from llama_index.core.llms import CompletionResponse, CustomLLM, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+
+from .llm_backends import BACKEND_FAKE
+
+
+class FakeLLM(CustomLLM):
+    """
+    Deterministic in-process LLM
+
+    Every call waits `latency` seconds and answers from `responses`:
+    structured calls return the whole canned invoice, per-field queries
+    the value of the field whose query appears in the prompt.
+    """
+
+    latency: float = 0.0
+    responses: Dict[str, Any] = {}
+    field_queries: Dict[str, str] = {}
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name=BACKEND_FAKE)
+
+    def _answer(self, prompt: str) -> str:
+        for field, query in self.field_queries.items():
+            if query in prompt:
+                value = self.responses.get(field)
+                if field == 'items' and isinstance(value, list):
+                    return json.dumps(value, ensure_ascii=False)
+                return '' if value is None else str(value)
+        return ''
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        time.sleep(self.latency)
+        return CompletionResponse(text=self._answer(prompt))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        response = self.complete(prompt, formatted=formatted, **kwargs)
+        yield CompletionResponse(text=response.text, delta=response.text)
+
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        await asyncio.sleep(self.latency)
+        return CompletionResponse(text=self._answer(prompt))
+
+    def structured_predict(self, output_cls, prompt, llm_kwargs=None, **prompt_args):
+        time.sleep(self.latency)
+        return output_cls.model_validate(self.responses)
+
+    async def astructured_predict(self, output_cls, prompt, llm_kwargs=None, **prompt_args):
+        await asyncio.sleep(self.latency)
+        return output_cls.model_validate(self.responses)
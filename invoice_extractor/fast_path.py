@@ -0,0 +1,153 @@
+"""
+Deterministic extraction of AFIP electronic invoice fields
+
+Invoices generated by AFIP (and by most billing software following the
+same layout) are PDFs with a clean text layer and fixed labels such as
+"Punto de Venta", "Comp. Nro", "CUIT" or "Importe Total". Reading those
+fields with regular expressions takes milliseconds, so the LLM only has
+to be asked for the fields this fast path could not fill confidently.
+"""
+import re
+from typing import Dict, List, NamedTuple, Optional
+
+from .validators import format_invoice_number, is_valid_cuit
+
+try:
+    from pypdf import PdfReader
+    PYPDF_AVAILABLE = True
+except ImportError:
+    PYPDF_AVAILABLE = False
+
+
+class FieldMatch(NamedTuple):
+    """Value found by the fast path and how much it can be trusted (0 to 1)"""
+    value: str
+    confidence: float
+
+
+AMOUNT = r'\$?\s*(\d[\d.]*(?:,\d{1,2})?)'
+
+PUNTO_DE_VENTA_RE = re.compile(r'Punto\s+de\s+Venta:?\s*(\d{1,5})', re.IGNORECASE)
+COMPROBANTE_NRO_RE = re.compile(r'Comp\.?\s*N(?:ro|°|º)\.?:?\s*(\d{1,8})', re.IGNORECASE)
+FECHA_EMISION_RE = re.compile(r'Fecha\s+de\s+Emisi[oó]n:?\s*(\d{2}/\d{2}/\d{4})', re.IGNORECASE)
+CUIT_RE = re.compile(r'CUIT:?\s*(\d{2}-?\d{8}-?\d)\b', re.IGNORECASE)
+VENDOR_NAME_RE = re.compile(r'^\s*Raz[oó]n\s+Social:\s*(.+?)\s*$', re.IGNORECASE | re.MULTILINE)
+CUSTOMER_NAME_RE = re.compile(
+    r'Apellido\s+y\s+Nombre\s*/\s*Raz[oó]n\s+Social:\s*(.+?)\s*$', re.IGNORECASE | re.MULTILINE
+)
+VENDOR_ADDRESS_RE = re.compile(r'^\s*Domicilio\s+Comercial:\s*(.+?)\s*$', re.IGNORECASE | re.MULTILINE)
+CUSTOMER_ADDRESS_RE = re.compile(r'^\s*Domicilio:\s*(.+?)\s*$', re.IGNORECASE | re.MULTILINE)
+PAYMENT_TERMS_RE = re.compile(r'Condici[oó]n\s+de\s+venta:\s*(.+?)\s*$', re.IGNORECASE | re.MULTILINE)
+SUBTOTAL_RE = re.compile(r'(?:Importe\s+Neto\s+Gravado|Subtotal):\s*' + AMOUNT, re.IGNORECASE)
+IVA_RE = re.compile(r'IVA\s+\d+(?:[.,]\d+)?\s*%:\s*' + AMOUNT, re.IGNORECASE)
+OTROS_TRIBUTOS_RE = re.compile(r'Importe\s+Otros\s+Tributos:\s*' + AMOUNT, re.IGNORECASE)
+TOTAL_RE = re.compile(r'Importe\s+Total:\s*' + AMOUNT, re.IGNORECASE)
+CAE_RE = re.compile(r'\bCAE\b', re.IGNORECASE)
+MONEDA_RE = re.compile(r'^\s*Moneda:\s*(.+?)\s*$', re.IGNORECASE | re.MULTILINE)
+FOREIGN_CURRENCY_RE = re.compile(r'(?:\bUSD\b|U\$S|\bD[oó]lar(?:es)?\b)', re.IGNORECASE)
+PESOS_RE = re.compile(r'\b(?:ARS|PES|Pesos?)\b', re.IGNORECASE)
+
+
+def extract_pdf_pages(file_path: str) -> List[str]:
+    """Return the text layer of each page of a PDF, or an empty list if unreadable"""
+    if not PYPDF_AVAILABLE:
+        return []
+    try:
+        reader = PdfReader(file_path)
+        return [page.extract_text() or '' for page in reader.pages]
+    except Exception:
+        return []
+
+
+def extract_pdf_text(file_path: str) -> str:
+    """Return the text layer of a PDF, or an empty string if there is none"""
+    return '\n'.join(extract_pdf_pages(file_path))
+
+
+def _parse_amount(amount: str) -> Optional[float]:
+    try:
+        return float(amount.replace('.', '').replace(',', '.'))
+    except ValueError:
+        return None
+
+
+def _format_amount(amount: float) -> str:
+    return f'{amount:.2f}'.replace('.', ',')
+
+
+def extract_fields(text: str) -> Dict[str, FieldMatch]:
+    """
+    Extract invoice fields from the text of an AFIP-style invoice
+
+    Args:
+        text: Text layer of the document
+
+    Returns:
+        Dictionary of field name to FieldMatch, only for the fields found
+    """
+    fields = {}
+    if not text:
+        return fields
+
+    punto_de_venta = PUNTO_DE_VENTA_RE.search(text)
+    comprobante = COMPROBANTE_NRO_RE.search(text)
+    if punto_de_venta and comprobante:
+        fields['invoice_number'] = FieldMatch(
+            format_invoice_number(punto_de_venta.group(1), comprobante.group(1)), 0.95
+        )
+
+    fecha = FECHA_EMISION_RE.search(text)
+    if fecha:
+        fields['invoice_date'] = FieldMatch(fecha.group(1), 0.95)
+
+    # The issuer's CUIT comes first in the AFIP layout, the customer's second
+    cuits = CUIT_RE.findall(text)
+    for field, cuit in zip(('vendor_cuit', 'customer_cuit'), cuits):
+        fields[field] = FieldMatch(cuit, 0.95 if is_valid_cuit(cuit) else 0.5)
+
+    for field, pattern in (
+        ('vendor_name', VENDOR_NAME_RE),
+        ('customer_name', CUSTOMER_NAME_RE),
+        ('vendor_address', VENDOR_ADDRESS_RE),
+        ('customer_address', CUSTOMER_ADDRESS_RE),
+        ('payment_terms', PAYMENT_TERMS_RE),
+    ):
+        match = pattern.search(text)
+        if match and match.group(1):
+            fields[field] = FieldMatch(match.group(1), 0.9)
+
+    for field, pattern in (('subtotal', SUBTOTAL_RE), ('total_amount', TOTAL_RE)):
+        match = pattern.search(text)
+        if match and _parse_amount(match.group(1)) is not None:
+            fields[field] = FieldMatch(match.group(1), 0.95)
+
+    # Invoices with several IVA rates list one line per rate
+    iva_amounts = [_parse_amount(amount) for amount in IVA_RE.findall(text)]
+    iva_amounts = [amount for amount in iva_amounts if amount is not None]
+    if iva_amounts:
+        fields['tax_amount'] = FieldMatch(_format_amount(sum(iva_amounts)), 0.9)
+
+    # Lower the confidence of amounts that don't add up
+    subtotal = fields.get('subtotal')
+    total = fields.get('total_amount')
+    if subtotal and total and iva_amounts:
+        otros_tributos = OTROS_TRIBUTOS_RE.search(text)
+        other_taxes = _parse_amount(otros_tributos.group(1)) if otros_tributos else 0
+        expected_total = _parse_amount(subtotal.value) + sum(iva_amounts) + (other_taxes or 0)
+        difference = abs(expected_total - _parse_amount(total.value))
+        if difference > 0.05:
+            for field in ('subtotal', 'tax_amount', 'total_amount'):
+                fields[field] = fields[field]._replace(confidence=0.6)
+
+    # Only the "Moneda:" field sets a foreign currency: dollars are also
+    # mentioned in exchange rate notes or product descriptions
+    moneda = MONEDA_RE.search(text)
+    if moneda:
+        if FOREIGN_CURRENCY_RE.search(moneda.group(1)):
+            fields['currency'] = FieldMatch('USD', 0.9)
+        elif PESOS_RE.search(moneda.group(1)):
+            fields['currency'] = FieldMatch('ARS', 0.9)
+    elif CAE_RE.search(text) and not FOREIGN_CURRENCY_RE.search(text):
+        fields['currency'] = FieldMatch('ARS', 0.85)
+
+    return fields
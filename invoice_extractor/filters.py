@@ -0,0 +1,65 @@
+"""
+Filtering of the invoice list
+"""
+from rest_framework.filters import BaseFilterBackend
+
+from .serializers import InvoiceFilterSerializer
+
+
+def cuit_variants(digits):
+    """
+    Return the ways a CUIT may be stored: plain digits and XX-XXXXXXXX-X
+
+    Extracted CUITs are saved as XX-XXXXXXXX-X, but ones entered in the
+    admin may not be, so an exact match on both spellings keeps the lookup
+    on the index.
+    """
+    return [digits, f"{digits[:2]}-{digits[2:10]}-{digits[10]}"]
+
+
+def filter_invoices(queryset, query_params):
+    """
+    Apply the ?status=, ?vendor_cuit=, ?customer_cuit=, ?invoice_number=,
+    ?date_from=, ?date_to=, ?total_min= and ?total_max= filters
+
+    Args:
+        queryset: Invoice queryset
+        query_params: Request query parameters
+
+    Returns:
+        Filtered queryset
+
+    Raises:
+        ValidationError: If a parameter is invalid (a 400 response)
+    """
+    serializer = InvoiceFilterSerializer(data=query_params)
+    serializer.is_valid(raise_exception=True)
+    params = serializer.validated_data
+
+    if 'status' in params:
+        queryset = queryset.filter(status=params['status'])
+    if 'vendor_cuit' in params:
+        queryset = queryset.filter(vendor_cuit__in=cuit_variants(params['vendor_cuit']))
+    if 'customer_cuit' in params:
+        queryset = queryset.filter(customer_cuit__in=cuit_variants(params['customer_cuit']))
+    if 'invoice_number' in params:
+        queryset = queryset.filter(invoice_number=params['invoice_number'])
+    if 'date_from' in params:
+        queryset = queryset.filter(invoice_date__gte=params['date_from'])
+    if 'date_to' in params:
+        queryset = queryset.filter(invoice_date__lte=params['date_to'])
+    if 'total_min' in params:
+        queryset = queryset.filter(total_amount__gte=params['total_min'])
+    if 'total_max' in params:
+        queryset = queryset.filter(total_amount__lte=params['total_max'])
+    return queryset
+
+
+class InvoiceFilterBackend(BaseFilterBackend):
+    """Filter backend applying filter_invoices to list endpoints"""
+
+    def filter_queryset(self, request, queryset, view):
+        # Detail lookups (retrieve, reprocess, ...) ignore the list filters
+        if getattr(view, 'detail', False):
+            return queryset
+        return filter_invoices(queryset, request.query_params)
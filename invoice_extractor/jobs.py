@@ -0,0 +1,537 @@
+"""
+Database-backed job queue for invoice extraction
+
+Uploads only persist the invoice and enqueue an ExtractionJob. Jobs are
+claimed by the extraction workers (see the run_extraction_worker management
+command) with SELECT ... FOR UPDATE SKIP LOCKED, so any number of worker
+processes can share the queue without an external broker.
+"""
+import logging
+import os
+import socket
+import threading
+from datetime import timedelta
+from functools import partial
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import Any, Dict, List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .analytics import summary_key, update_invoice_summary
+from .events import AsyncEventRecorder, record_event
+from .models import ExtractionJob, Invoice, InvoiceItem
+from .services import InvoiceExtractionService, get_extraction_service
+from .validators import format_cuit
+
+logger = logging.getLogger(__name__)
+
+
+def default_worker_id() -> str:
+    """Identify the current worker thread in job records"""
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def enqueue_extraction(invoice: Invoice, **options) -> ExtractionJob:
+    """
+    Queue an invoice for extraction
+
+    Args:
+        invoice: Invoice whose document should be processed
+        **options: Extraction options stored on the job (e.g. use_cache=False)
+
+    Returns:
+        The queued ExtractionJob
+    """
+    return ExtractionJob.objects.create(invoice=invoice, options=options)
+
+
+def create_running_job(invoice: Invoice, worker_id: Optional[str] = None, **options) -> ExtractionJob:
+    """
+    Create a job already claimed by this worker, for an extraction run
+    inside a request
+
+    The job is never queued, so the extraction workers cannot take it.
+
+    Args:
+        invoice: Invoice whose document should be processed
+        worker_id: Worker identifier stored on the job
+        **options: Extraction options stored on the job (e.g. use_cache=False)
+
+    Returns:
+        The running ExtractionJob
+    """
+    return ExtractionJob.objects.create(
+        invoice=invoice,
+        options=options,
+        status='running',
+        worker=worker_id or default_worker_id(),
+        started_at=timezone.now(),
+        attempts=1,
+    )
+
+
+def enqueue_extractions(invoices, **options) -> list:
+    """
+    Queue many invoices for extraction with a single INSERT
+
+    Returns:
+        The queued ExtractionJob objects
+    """
+    return ExtractionJob.objects.bulk_create(
+        [ExtractionJob(invoice=invoice, options=options) for invoice in invoices]
+    )
+
+
+def claim_next_job(worker_id: Optional[str] = None) -> Optional[ExtractionJob]:
+    """
+    Claim the oldest queued job for this worker
+
+    Rows locked by other workers are skipped. The conditional update also
+    keeps the claim safe on databases without SELECT ... FOR UPDATE support
+    (such as SQLite).
+
+    Returns:
+        The claimed job, or None if the queue is empty
+    """
+    with transaction.atomic():
+        job = (
+            ExtractionJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(status='queued')
+            .order_by('created_at', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+
+        if not start_job(job, worker_id):
+            return None
+
+    return job
+
+
+def start_job(job: ExtractionJob, worker_id: Optional[str] = None) -> bool:
+    """
+    Mark a queued job as running for this worker
+
+    Returns:
+        False if the job was no longer queued (e.g. another worker took it)
+    """
+    claimed = ExtractionJob.objects.filter(pk=job.pk, status='queued').update(
+        status='running',
+        worker=worker_id or default_worker_id(),
+        started_at=timezone.now(),
+        attempts=job.attempts + 1,
+    )
+    if claimed:
+        job.refresh_from_db()
+    return bool(claimed)
+
+
+def requeue_stale_jobs(timeout: Optional[int] = None) -> int:
+    """
+    Put back jobs whose worker died while running them
+
+    Jobs that already had settings.EXTRACTION_JOB_MAX_ATTEMPTS attempts
+    (e.g. a document that makes its worker run out of memory every time)
+    fail instead, and so do their invoices.
+
+    Args:
+        timeout: Seconds after which a running job is considered stale
+            (defaults to settings.EXTRACTION_JOB_TIMEOUT)
+
+    Returns:
+        Number of jobs requeued
+    """
+    timeout = timeout or getattr(settings, 'EXTRACTION_JOB_TIMEOUT', 600)
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    stale = ExtractionJob.objects.filter(status='running', started_at__lt=cutoff)
+
+    for job in stale.filter(attempts__gte=_max_attempts()).select_related('invoice'):
+        error_detail = f"The worker stopped while running attempt {job.attempts} of {_max_attempts()}"
+        with transaction.atomic():
+            # Unless its worker finished it in the meantime
+            failed = ExtractionJob.objects.filter(pk=job.pk, status='running', started_at=job.started_at).update(
+                status='failed', error_message=error_detail, finished_at=timezone.now()
+            )
+            if failed:
+                _mark_failed(job.invoice, error_detail)
+        if failed:
+            logger.error(f"Invoice {job.invoice_id} processing failed: {error_detail}")
+            record_event(job.invoice_id, 'failed', {'error': error_detail, 'retrying': False})
+
+    return stale.filter(attempts__lt=_max_attempts()).update(status='queued', worker=None)
+
+
+def run_job(
+    job: ExtractionJob,
+    extraction_service: Optional[InvoiceExtractionService] = None,
+    retry: bool = True,
+) -> ExtractionJob:
+    """
+    Process a claimed job and record the outcome
+
+    Failed jobs are queued again until settings.EXTRACTION_JOB_MAX_ATTEMPTS
+    is reached.
+
+    Args:
+        job: Job claimed by this worker
+        extraction_service: Service to use (the process-wide one by default)
+        retry: Requeue the job if it fails (False for jobs run inside a
+            request, which report the failure instead)
+
+    Returns:
+        The updated job
+    """
+    invoice = job.invoice
+    result = process_invoice(
+        invoice,
+        extraction_service=extraction_service,
+        use_cache=job.options.get('use_cache', True),
+        will_retry=_will_retry(job, retry),
+    )
+    return _record_job_result(job, invoice, result, retry)
+
+
+async def arun_job(
+    job: ExtractionJob,
+    extraction_service: Optional[InvoiceExtractionService] = None,
+    retry: bool = True,
+) -> ExtractionJob:
+    """Async version of run_job"""
+    invoice = await Invoice.objects.aget(pk=job.invoice_id)
+    result = await aprocess_invoice(
+        invoice,
+        extraction_service=extraction_service,
+        use_cache=job.options.get('use_cache', True),
+        will_retry=_will_retry(job, retry),
+    )
+    return await sync_to_async(_record_job_result)(job, invoice, result, retry)
+
+
+def _will_retry(job: ExtractionJob, retry: bool) -> bool:
+    return retry and job.attempts < _max_attempts()
+
+
+def _record_job_result(
+    job: ExtractionJob,
+    invoice: Invoice,
+    result: Dict[str, Any],
+    retry: bool = True,
+) -> ExtractionJob:
+    """
+    Finish a job with the result of process_invoice, requeueing it on failure
+
+    Nothing is recorded if the job no longer belongs to this run, e.g. it
+    ran past EXTRACTION_JOB_TIMEOUT and was requeued and claimed again.
+    """
+    finished_at = timezone.now()
+    if result['success']:
+        job_status, error_message = 'completed', None
+    else:
+        job_status = 'queued' if _will_retry(job, retry) else 'failed'
+        error_message = result.get('error')
+
+    recorded = ExtractionJob.objects.filter(
+        pk=job.pk, status='running', worker=job.worker, started_at=job.started_at
+    ).update(status=job_status, error_message=error_message, finished_at=finished_at)
+    if not recorded:
+        logger.warning(f"Job {job.pk} was taken over by another run, not recording this one")
+        job.refresh_from_db()
+        return job
+
+    job.status, job.error_message, job.finished_at = job_status, error_message, finished_at
+    if job_status == 'queued':
+        invoice.status = 'pending'
+        invoice.save(update_fields=['status'])
+
+    return job
+
+
+def _max_attempts() -> int:
+    return getattr(settings, 'EXTRACTION_JOB_MAX_ATTEMPTS', 3)
+
+
+def run_next_job(worker_id: Optional[str] = None, extraction_service=None) -> Optional[ExtractionJob]:
+    """Claim and process the next queued job, if there is one"""
+    job = claim_next_job(worker_id)
+    if job is not None:
+        run_job(job, extraction_service=extraction_service)
+    return job
+
+
+def build_invoice_items(invoice: Invoice, items_data) -> List[InvoiceItem]:
+    """
+    Build (unsaved) InvoiceItem rows from the extracted line items
+
+    Args:
+        invoice: Invoice the items belong to
+        items_data: The 'items' list of an extraction result
+
+    Returns:
+        List of InvoiceItem instances, ready for bulk_create
+    """
+    def decimal(value):
+        try:
+            return Decimal(str(value)).quantize(Decimal('0.01'), ROUND_HALF_UP) if value is not None else None
+        except InvalidOperation:
+            return None
+
+    items = []
+    for item_data in items_data or []:
+        if not isinstance(item_data, dict) or not item_data.get('description'):
+            continue
+        items.append(InvoiceItem(
+            invoice=invoice,
+            description=item_data['description'],
+            quantity=decimal(item_data.get('quantity')) or Decimal('0'),
+            unit_price=decimal(item_data.get('unit_price')) or Decimal('0'),
+            total_price=decimal(item_data.get('total_price')) or Decimal('0'),
+            tax_rate=decimal(item_data.get('tax_rate')),
+            product_code=(item_data.get('product_code') or None),
+        ))
+    return items
+
+
+def save_extraction(
+    invoice: Invoice,
+    extracted: Dict[str, Any],
+    extraction_service: InvoiceExtractionService,
+) -> int:
+    """
+    Save an extraction result on the invoice and replace its line items
+
+    The invoice update and the items are written in one transaction, the
+    items with a single bulk INSERT.
+
+    Args:
+        invoice: Invoice to update
+        extracted: The 'data' of a successful extraction result
+        extraction_service: Service used to parse amounts and dates
+
+    Returns:
+        Number of line items saved
+    """
+    previous_summary_key = summary_key(invoice)
+
+    invoice.invoice_number = extracted.get('invoice_number')
+    # CUITs are stored as XX-XXXXXXXX-X whatever the LLM answered (e.g.
+    # 'CUIT 30712345671'), so the CUIT filters and summaries find them
+    invoice.vendor_name = extracted.get('vendor_name')
+    invoice.vendor_cuit = format_cuit(extracted.get('vendor_cuit'))
+    invoice.vendor_address = extracted.get('vendor_address')
+    invoice.customer_name = extracted.get('customer_name')
+    invoice.customer_cuit = format_cuit(extracted.get('customer_cuit'))
+    invoice.customer_address = extracted.get('customer_address')
+    invoice.payment_terms = extracted.get('payment_terms')
+    invoice.currency = extracted.get('currency') or 'ARS'
+    invoice.raw_extraction = extracted
+
+    # Parse and set financial data
+    for field in ('subtotal', 'tax_amount', 'total_amount'):
+        if extracted.get(field):
+            setattr(invoice, field, extraction_service.parse_currency(extracted[field]))
+
+    # Parse and set date
+    if extracted.get('invoice_date'):
+        parsed_date = extraction_service.parse_date(extracted['invoice_date'])
+        if parsed_date:
+            invoice.invoice_date = parsed_date
+
+    invoice.status = 'completed'
+    invoice.error_message = None
+    invoice.processed_at = timezone.now()
+
+    items = build_invoice_items(invoice, extracted.get('items'))
+    with transaction.atomic():
+        invoice.save()
+        # Reprocessing replaces the items of the previous extraction
+        invoice.items.all().delete()
+        InvoiceItem.objects.bulk_create(items)
+        update_invoice_summary(invoice, previous_summary_key)
+    return len(items)
+
+
+def find_reusable_extractions(content_hashes) -> Dict[str, Invoice]:
+    """
+    Return the latest completed invoice of each document hash, when
+    INVOICE_REUSE_DUPLICATE_EXTRACTION is enabled
+
+    Args:
+        content_hashes: SHA-256 digests of uploaded documents
+
+    Returns:
+        Dictionary mapping each hash that has a completed invoice to it
+    """
+    if not getattr(settings, 'INVOICE_REUSE_DUPLICATE_EXTRACTION', False):
+        return {}
+    sources = {}
+    invoices = Invoice.objects.filter(
+        content_hash__in=set(content_hashes), status='completed', raw_extraction__isnull=False
+    ).order_by('content_hash', '-processed_at', '-id')
+    for invoice in invoices:
+        sources.setdefault(invoice.content_hash, invoice)
+    return sources
+
+
+def reuse_extraction(invoice: Invoice, source: Invoice) -> None:
+    """
+    Complete an invoice with the extraction of another invoice of the same
+    document, instead of running the extraction again
+
+    Args:
+        invoice: Newly uploaded invoice
+        source: Completed invoice with the same content_hash
+    """
+    save_extraction(invoice, dict(source.raw_extraction), get_extraction_service())
+    record_event(invoice.id, 'completed', {'duplicate_of': source.id})
+    logger.info(f"Invoice {invoice.id} reused the extraction of invoice {source.id}")
+
+
+def process_invoice(
+    invoice: Invoice,
+    extraction_service: Optional[InvoiceExtractionService] = None,
+    use_cache: bool = True,
+    will_retry: bool = False,
+    incremental: bool = False,
+) -> Dict[str, Any]:
+    """
+    Extract the data of an invoice document and save it on the invoice
+
+    Each stage is recorded as an InvoiceEvent (see events).
+
+    Args:
+        invoice: Invoice with an uploaded document
+        extraction_service: Service to use (the process-wide one by default)
+        use_cache: Whether to reuse a cached extraction result
+        will_retry: A failure will be retried, so its event does not end
+            the event stream
+        incremental: Only re-extract the missing or invalid fields of the
+            invoice's previous extraction, if it has one
+
+    Returns:
+        Dictionary with 'success' and, on failure, 'error'
+    """
+    invoice.status = 'processing'
+    invoice.save(update_fields=['status'])
+    record_event(invoice.id, 'processing')
+
+    try:
+        # Process the document using Llamaindex
+        extraction_service = extraction_service or get_extraction_service()
+        file_path = invoice.document.path
+
+        progress = partial(record_event, invoice.id)
+
+        if incremental and invoice.raw_extraction:
+            result = extraction_service.repair_invoice_data(
+                file_path, invoice.raw_extraction, content_hash=invoice.content_hash, progress=progress,
+            )
+        else:
+            result = extraction_service.extract_invoice_data(
+                file_path, use_cache=use_cache, content_hash=invoice.content_hash, progress=progress,
+            )
+
+        if not result['success']:
+            # Processing failed
+            error_detail = result.get('error', 'Unknown error')
+            invoice.status = 'failed'
+            invoice.error_message = error_detail
+            invoice.save()
+            update_invoice_summary(invoice)
+            record_event(invoice.id, 'failed', {'error': error_detail, 'retrying': will_retry})
+
+            # Log the error for debugging
+            logger.error(f"Invoice {invoice.id} processing failed: {error_detail}")
+            return {'success': False, 'error': error_detail}
+
+        items_saved = save_extraction(invoice, result['data'], extraction_service)
+        record_event(invoice.id, 'items_saved', {'count': items_saved})
+        record_event(invoice.id, 'completed')
+        return _processed_result(result)
+
+    except Exception as e:
+        # Handle unexpected errors
+        error_detail = str(e)
+        invoice.status = 'failed'
+        invoice.error_message = error_detail
+        invoice.save()
+        update_invoice_summary(invoice)
+        record_event(invoice.id, 'failed', {'error': error_detail, 'retrying': will_retry})
+
+        # Log the error for debugging
+        logger.exception(f"Unexpected error processing invoice {invoice.id}")
+        return {'success': False, 'error': error_detail}
+
+
+def _processed_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    processed = {'success': True}
+    if 'repaired_fields' in result:
+        processed['repaired_fields'] = result['repaired_fields']
+    return processed
+
+
+async def aprocess_invoice(
+    invoice: Invoice,
+    extraction_service: Optional[InvoiceExtractionService] = None,
+    use_cache: bool = True,
+    will_retry: bool = False,
+    incremental: bool = False,
+) -> Dict[str, Any]:
+    """
+    Async version of process_invoice
+
+    The extraction awaits the LLM instead of holding a thread. Saving the
+    result needs a transaction, which the async ORM does not support, so
+    it runs through sync_to_async.
+    """
+    invoice.status = 'processing'
+    await invoice.asave(update_fields=['status'])
+    progress = AsyncEventRecorder(invoice.id)
+    progress('processing')
+
+    try:
+        extraction_service = extraction_service or get_extraction_service()
+
+        if incremental and invoice.raw_extraction:
+            result = await extraction_service.arepair_invoice_data(
+                invoice.document.path, invoice.raw_extraction, content_hash=invoice.content_hash,
+                progress=progress,
+            )
+        else:
+            result = await extraction_service.aextract_invoice_data(
+                invoice.document.path, use_cache=use_cache, content_hash=invoice.content_hash,
+                progress=progress,
+            )
+
+        if not result['success']:
+            error_detail = result.get('error', 'Unknown error')
+            await sync_to_async(_mark_failed)(invoice, error_detail)
+            progress('failed', {'error': error_detail, 'retrying': will_retry})
+            logger.error(f"Invoice {invoice.id} processing failed: {error_detail}")
+            return {'success': False, 'error': error_detail}
+
+        items_saved = await sync_to_async(save_extraction)(invoice, result['data'], extraction_service)
+        progress('items_saved', {'count': items_saved})
+        progress('completed')
+        return _processed_result(result)
+
+    except Exception as e:
+        error_detail = str(e)
+        await sync_to_async(_mark_failed)(invoice, error_detail)
+        progress('failed', {'error': error_detail, 'retrying': will_retry})
+        logger.exception(f"Unexpected error processing invoice {invoice.id}")
+        return {'success': False, 'error': error_detail}
+
+    finally:
+        await progress.flush()
+
+
+def _mark_failed(invoice: Invoice, error_detail: str) -> None:
+    invoice.status = 'failed'
+    invoice.error_message = error_detail
+    invoice.save()
+    update_invoice_summary(invoice)
@@ -0,0 +1,172 @@
+"""
+LLM backends for the invoice extraction service
+
+The backend is selected with settings.LLM_BACKEND:
+
+- 'openai': the OpenAI API
+- 'openai_like': any server exposing the OpenAI API (vLLM, llama.cpp,
+  Ollama, LM Studio...), at LLM_BACKEND['API_BASE']
+- 'fake': an in-process stand-in with configurable latency and canned
+  answers, to benchmark and load test the rest of the pipeline without
+  network access
+"""
+import importlib.util
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+def _module_available(name: str) -> bool:
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ModuleNotFoundError:
+        return False
+
+
+# Llamaindex takes seconds to import, so it is only looked up here and
+# imported on first use: processes that never extract (migrate, the admin,
+# list and retrieve requests) do not pay for it
+LLAMAINDEX_AVAILABLE = _module_available('llama_index.core')
+
+BACKEND_OPENAI = 'openai'
+BACKEND_OPENAI_LIKE = 'openai_like'
+BACKEND_FAKE = 'fake'
+
+# Answers of the fake backend unless LLM_BACKEND['FAKE_RESPONSES'] overrides them
+DEFAULT_FAKE_RESPONSES = {
+    'invoice_number': '00002-00000123',
+    'invoice_date': '15/01/2024',
+    'vendor_name': 'EMPRESA EJEMPLO S.A.',
+    'vendor_cuit': '30-71234567-1',
+    'vendor_address': 'Av. Siempreviva 742 - CABA',
+    'customer_name': 'CLIENTE EJEMPLO SRL',
+    'customer_cuit': '20-12345678-6',
+    'customer_address': 'Calle Falsa 123 - Rosario',
+    'subtotal': '$10.000,00',
+    'tax_amount': '$2.100,00',
+    'total_amount': '$12.100,00',
+    'currency': 'ARS',
+    'payment_terms': 'Contado',
+    'items': [
+        {'description': 'Servicio de consultoría', 'quantity': 1, 'unit_price': 10000, 'total_price': 10000,
+         'tax_rate': 21, 'product_code': 'SRV-01'},
+    ],
+}
+
+
+def get_backend_config() -> Dict[str, Any]:
+    """Return settings.LLM_BACKEND with defaults filled in"""
+    config = {
+        'BACKEND': BACKEND_OPENAI,
+        'MODEL': getattr(settings, 'LLAMAINDEX_MODEL', 'gpt-3.5-turbo'),
+        'API_KEY': getattr(settings, 'OPENAI_API_KEY', ''),
+        'API_BASE': '',
+        'FAKE_LATENCY': 0.0,
+        'FAKE_RESPONSES': None,
+        'MAX_CONNECTIONS': 20,
+    }
+    config.update(getattr(settings, 'LLM_BACKEND', None) or {})
+    return config
+
+
+@lru_cache(maxsize=None)
+def _http_client(max_connections: int):
+    """
+    Return the process-wide HTTP client of the OpenAI backends
+
+    Keeps up to max_connections connections alive, so successive
+    extractions reuse them instead of opening a TLS connection each. The
+    LLMs are built with reuse_client=False: every sync call gets a fresh
+    (cheap) OpenAI client wrapping this pool, and async calls get their own
+    client, since an async connection pool cannot be shared between the
+    event loops of different asyncio.run() calls.
+    """
+    import httpx
+
+    return httpx.Client(
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        timeout=httpx.Timeout(60.0, connect=10.0),
+    )
+
+
+def build_llm(config: Optional[Dict[str, Any]] = None, field_queries: Optional[Dict[str, str]] = None):
+    """
+    Build the LLM described by an LLM_BACKEND configuration
+
+    Args:
+        config: Backend configuration (defaults to settings.LLM_BACKEND)
+        field_queries: Field name to query text, used by the fake backend
+            to pick its answers
+
+    Returns:
+        A Llamaindex LLM, or None if the backend has no credentials
+    """
+    config = config or get_backend_config()
+    backend = config['BACKEND']
+
+    if backend == BACKEND_FAKE:
+        from .fake_llm import FakeLLM
+
+        return FakeLLM(
+            latency=config['FAKE_LATENCY'],
+            responses=config['FAKE_RESPONSES'] or DEFAULT_FAKE_RESPONSES,
+            field_queries=field_queries or {},
+        )
+
+    if backend == BACKEND_OPENAI:
+        if not config['API_KEY']:
+            return None
+        try:
+            from llama_index.llms.openai import OpenAI
+        except ImportError:
+            raise ImproperlyConfigured(
+                "The 'openai' LLM backend needs llama-index-llms-openai"
+            )
+        return OpenAI(
+            model=config['MODEL'],
+            api_key=config['API_KEY'],
+            http_client=_http_client(config['MAX_CONNECTIONS']),
+            reuse_client=False,
+        )
+
+    if backend == BACKEND_OPENAI_LIKE:
+        if not config['API_BASE']:
+            raise ImproperlyConfigured("The 'openai_like' LLM backend needs LLM_BACKEND['API_BASE']")
+        try:
+            from llama_index.llms.openai_like import OpenAILike
+        except ImportError:
+            raise ImproperlyConfigured(
+                "The 'openai_like' LLM backend needs llama-index-llms-openai-like"
+            )
+        return OpenAILike(
+            model=config['MODEL'],
+            api_base=config['API_BASE'],
+            api_key=config['API_KEY'] or 'not-needed',
+            is_chat_model=True,
+            http_client=_http_client(config['MAX_CONNECTIONS']),
+            reuse_client=False,
+        )
+
+    raise ImproperlyConfigured(
+        f"Unknown LLM backend '{backend}'. "
+        f"Available backends: {BACKEND_OPENAI}, {BACKEND_OPENAI_LIKE}, {BACKEND_FAKE}"
+    )
+
+
+def configure_llm(config: Optional[Dict[str, Any]] = None, field_queries: Optional[Dict[str, str]] = None) -> None:
+    """Set the Llamaindex global LLM (and, for the fake backend, embeddings)"""
+    if not LLAMAINDEX_AVAILABLE:
+        return
+
+    from llama_index.core import Settings
+    from llama_index.core.embeddings import MockEmbedding
+
+    config = config or get_backend_config()
+    llm = build_llm(config, field_queries=field_queries)
+    if llm is not None:
+        Settings.llm = llm
+    if config['BACKEND'] == BACKEND_FAKE:
+        # Large documents still go through a vector index: keep it offline too
+        Settings.embed_model = MockEmbedding(embed_dim=8)
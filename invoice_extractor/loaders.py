@@ -0,0 +1,278 @@
+"""
+Loading of invoice documents in a pool of worker processes
+
+Parsing PDFs and DOCX files and decoding images is CPU-bound and holds the
+GIL, so however many extractions a process runs concurrently, loading their
+documents only ever uses one core. With DOCUMENT_LOADER_WORKERS above 0 the
+loading stage runs in a pool of worker processes shared by every thread of the
+process, and only its result (Llamaindex documents, page texts and AFIP QR
+payload) is handed back to the I/O-bound LLM stage.
+"""
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import django
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .afip_qr import find_afip_qr
+from .fast_path import extract_pdf_pages
+from .page_pruning import select_pages
+from .preprocessing import preprocess_image
+
+logger = logging.getLogger(__name__)
+
+
+# How often aload() checks for a free worker process, in seconds
+SLOT_POLL_INTERVAL = 0.01
+
+
+class DocumentLoadTimeout(Exception):
+    """Loading a document took longer than DOCUMENT_LOADER_TIMEOUT"""
+
+
+class LoadedDocument(NamedTuple):
+    """Output of the loading stage"""
+    documents: list
+    page_texts: List[str]
+    afip_qr: Optional[Dict[str, Any]]
+
+
+def load_document(
+    file_path: str,
+    content_hash: Optional[str] = None,
+    afip_qr: bool = True,
+    text_layer: bool = True,
+    max_pages: Optional[int] = None,
+) -> LoadedDocument:
+    """
+    Parse a document into what the extraction service needs
+
+    PDFs with a text layer are turned into one Llamaindex document per page
+    from the text read by pypdf, keeping only the invoice pages (at most
+    max_pages) when max_pages is given (see page_pruning). Other documents are loaded by
+    SimpleDirectoryReader, photos and scans once normalized (see
+    preprocessing).
+
+    Args:
+        file_path: Path to the invoice document
+        content_hash: SHA-256 of the document if already known
+        afip_qr: Decode the AFIP QR code
+        text_layer: Read the text layer of PDFs
+        max_pages: Maximum number of invoice pages to keep, or None to keep
+            every page
+
+    Returns:
+        LoadedDocument
+    """
+    from llama_index.core import Document, SimpleDirectoryReader
+
+    qr_payload = find_afip_qr(file_path) if afip_qr else None
+    page_texts = extract_pdf_pages(file_path) if text_layer and file_path.lower().endswith('.pdf') else []
+
+    if any(text.strip() for text in page_texts):
+        pages = range(len(page_texts))
+        if max_pages and len(page_texts) > max_pages:
+            pages = select_pages(page_texts, max_pages)
+            if len(pages) < len(page_texts):
+                logger.info(
+                    "Extracting pages %s of %d", ', '.join(str(page + 1) for page in pages), len(page_texts)
+                )
+        file_name = os.path.basename(file_path)
+        documents = [
+            Document(text=page_texts[page], metadata={'file_name': file_name, 'page_label': str(page + 1)})
+            for page in pages
+        ]
+    else:
+        documents = SimpleDirectoryReader(
+            input_files=[preprocess_image(file_path, content_hash)]
+        ).load_data()
+
+    return LoadedDocument(documents, page_texts, qr_payload)
+
+
+def _init_worker():
+    # Spawned workers start without the app registry or logging configured
+    django.setup()
+
+
+class _LoaderProcess:
+    """
+    A single worker process of a DocumentLoader
+
+    Each process is its own one-worker executor, so that a stuck load can
+    be killed without breaking the loads running in the other processes.
+    """
+
+    def __init__(self):
+        self.executor = ProcessPoolExecutor(max_workers=1, initializer=_init_worker)
+        # Started right away, so that the timeout of the first load does not
+        # count the process start and django.setup()
+        self.ready = self.executor.submit(os.getpid)
+
+    def terminate(self) -> None:
+        terminate_workers = getattr(self.executor, 'terminate_workers', None)
+        if terminate_workers is not None:
+            terminate_workers()
+        else:
+            for process in list((self.executor._processes or {}).values()):
+                process.terminate()
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class DocumentLoader:
+    """
+    Runs load_document in a pool of worker processes
+
+    The processes are started on first use and shared by every thread. At
+    most one document is handed to each process at a time; the others wait
+    for a free process, so the timeout only counts the time spent parsing.
+    A document taking longer than the timeout fails with
+    DocumentLoadTimeout and, since a busy process cannot be interrupted,
+    its process is killed and replaced. Documents loading in the other
+    processes are not affected.
+
+    With workers=0 documents are loaded in the calling thread and the
+    timeout is not enforced.
+    """
+
+    def __init__(self, workers: int = 0, timeout: Optional[float] = None):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(workers, 1))
+        self._idle = []
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    def load(self, file_path: str, **options) -> LoadedDocument:
+        """
+        Load a document (see load_document for the options)
+
+        Raises:
+            DocumentLoadTimeout: If loading takes longer than the timeout
+        """
+        if self.workers <= 0:
+            return load_document(file_path, **options)
+
+        self._slots.acquire()
+        process = self._checkout()
+        future = self._submit(process, file_path, options)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            self._kill(process)
+            raise DocumentLoadTimeout(
+                f"Loading {os.path.basename(file_path)} took more than {self.timeout}s"
+            )
+
+    async def aload(self, file_path: str, **options) -> LoadedDocument:
+        """
+        Async version of load()
+
+        The event loop awaits the worker process instead of blocking a
+        thread on it. With workers=0 the document is loaded in a thread of
+        the default executor.
+        """
+        if self.workers <= 0:
+            return await asyncio.to_thread(load_document, file_path, **options)
+
+        while not self._slots.acquire(blocking=False):
+            await asyncio.sleep(SLOT_POLL_INTERVAL)
+        process = self._checkout()
+        try:
+            await asyncio.wrap_future(process.ready)
+        except BaseException:
+            self._release(process, broken=True)
+            raise
+        future = self._submit(process, file_path, options)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self._kill(process)
+            raise DocumentLoadTimeout(
+                f"Loading {os.path.basename(file_path)} took more than {self.timeout}s"
+            )
+
+    def shutdown(self) -> None:
+        """Stop the worker processes"""
+        with self._lock:
+            processes, self._processes, self._idle = self._processes, set(), []
+        for process in processes:
+            process.executor.shutdown(wait=True, cancel_futures=True)
+
+    def _checkout(self) -> _LoaderProcess:
+        """Return an idle process, or start one; the caller holds a slot"""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+            try:
+                process = _LoaderProcess()
+            except BaseException:
+                self._slots.release()
+                raise
+            self._processes.add(process)
+            return process
+
+    def _submit(self, process: _LoaderProcess, file_path: str, options: Dict[str, Any]):
+        """
+        Submit a load to a checked out process
+
+        The process and the slot are given back when the load finishes,
+        whether or not anyone is still waiting for it.
+        """
+        try:
+            process.ready.result()
+            future = process.executor.submit(load_document, file_path, **options)
+        except BaseException:
+            self._release(process, broken=True)
+            raise
+        future.add_done_callback(
+            lambda done: self._release(
+                process, broken=not done.cancelled() and isinstance(done.exception(), BrokenProcessPool)
+            )
+        )
+        return future
+
+    def _release(self, process: _LoaderProcess, broken: bool = False) -> None:
+        with self._lock:
+            if broken or process not in self._processes:
+                self._processes.discard(process)
+                process.shutdown()
+            else:
+                self._idle.append(process)
+        self._slots.release()
+
+    def _kill(self, process: _LoaderProcess) -> None:
+        """Kill a process stuck on a document; its load then fails and releases it"""
+        with self._lock:
+            self._processes.discard(process)
+            if process in self._idle:
+                # The load finished just after the timeout
+                self._idle.remove(process)
+        process.terminate()
+
+
+@lru_cache(maxsize=None)
+def get_document_loader() -> DocumentLoader:
+    """Return the process-wide loader configured by DOCUMENT_LOADER_WORKERS and DOCUMENT_LOADER_TIMEOUT"""
+    return DocumentLoader(
+        workers=getattr(settings, 'DOCUMENT_LOADER_WORKERS', 0),
+        timeout=getattr(settings, 'DOCUMENT_LOADER_TIMEOUT', 120) or None,
+    )
+
+
+@receiver(setting_changed)
+def _reset_document_loader(setting, **kwargs):
+    if setting in ('DOCUMENT_LOADER_WORKERS', 'DOCUMENT_LOADER_TIMEOUT'):
+        get_document_loader().shutdown()
+        get_document_loader.cache_clear()
@@ -0,0 +1,20 @@
+"""
+Delete the progress events of extractions that finished a while ago
+"""
+from django.core.management.base import BaseCommand
+
+from invoice_extractor.events import prune_events
+
+
+class Command(BaseCommand):
+    help = 'Delete the InvoiceEvent rows of extraction runs that finished more than the retention ago'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retention', type=int, default=None,
+            help='Seconds a finished run is kept (default: EXTRACTION_EVENTS_RETENTION)',
+        )
+
+    def handle(self, *args, **options):
+        count = prune_events(options['retention'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {count} invoice events"))
@@ -0,0 +1,14 @@
+"""
+Rebuild the per vendor and month invoice totals from scratch
+"""
+from django.core.management.base import BaseCommand
+
+from invoice_extractor.analytics import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = 'Recompute the VendorMonthlySummary table from the completed invoices'
+
+    def handle(self, *args, **options):
+        count = rebuild_summaries()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} vendor monthly summaries"))
@@ -0,0 +1,105 @@
+"""
+Run a pool of extraction workers that process the ExtractionJob queue
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from invoice_extractor.jobs import default_worker_id, requeue_stale_jobs, run_next_job
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks for jobs left running by a worker that died
+STALE_JOBS_CHECK_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = 'Process queued invoice extraction jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=getattr(settings, 'EXTRACTION_WORKER_CONCURRENCY', 4),
+            help='Number of worker threads (extraction is I/O bound on the LLM)',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=getattr(settings, 'EXTRACTION_WORKER_POLL_INTERVAL', 1.0),
+            help='Seconds to wait before polling again when the queue is empty',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit as soon as the queue is empty',
+        )
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        self._requeue_stale_jobs()
+
+        threads = [
+            threading.Thread(
+                target=self._work,
+                args=(stop, options['poll_interval'], options['once']),
+                name=f'extraction-worker-{i}',
+                daemon=True,
+            )
+            for i in range(max(1, options['concurrency']))
+        ]
+        for thread in threads:
+            thread.start()
+
+        self.stdout.write(f"Started {len(threads)} extraction worker(s)")
+        try:
+            # Other workers may die while this one keeps running
+            next_check = time.monotonic() + STALE_JOBS_CHECK_INTERVAL
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=1)
+                if time.monotonic() >= next_check:
+                    next_check = time.monotonic() + STALE_JOBS_CHECK_INTERVAL
+                    self._requeue_stale_jobs()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping after the running jobs finish...")
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def _requeue_stale_jobs(self):
+        close_old_connections()
+        try:
+            requeued = requeue_stale_jobs()
+        except Exception as e:
+            self.stderr.write(f"Could not requeue stale jobs: {e}")
+            return
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s)")
+
+    def _work(self, stop, poll_interval, once):
+        worker_id = default_worker_id()
+        try:
+            while not stop.is_set():
+                close_old_connections()
+                try:
+                    job = run_next_job(worker_id)
+                except Exception:
+                    # e.g. the database went away: drop the connection and
+                    # keep polling; the job, if claimed, is requeued once stale
+                    logger.exception(f"{worker_id}: could not run the next job")
+                    connection.close()
+                    stop.wait(poll_interval)
+                    continue
+                if job is not None:
+                    self.stdout.write(f"{worker_id}: {job}")
+                    continue
+                if once:
+                    break
+                stop.wait(poll_interval)
+        finally:
+            connection.close()
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoice_extractor', '0003_extractionjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Invoice Batch',
+                'verbose_name_plural': 'Invoice Batches',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='batch',
+            field=models.ForeignKey(blank=True, help_text='Batch upload this invoice belongs to', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='invoices', to='invoice_extractor.invoicebatch'),
+        ),
+    ]
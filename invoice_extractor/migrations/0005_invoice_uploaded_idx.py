@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoice_extractor', '0004_invoicebatch'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='invoice',
+            options={'ordering': ['-uploaded_at', '-id'], 'verbose_name': 'Invoice', 'verbose_name_plural': 'Invoices'},
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['-uploaded_at', '-id'], name='invoice_uploaded_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoice_extractor', '0005_invoice_uploaded_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['status', '-uploaded_at', '-id'], name='invoice_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(condition=models.Q(('vendor_cuit__isnull', False)), fields=['vendor_cuit', 'invoice_date'], name='invoice_vendor_cuit_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(condition=models.Q(('customer_cuit__isnull', False)), fields=['customer_cuit', 'invoice_date'], name='invoice_customer_cuit_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(condition=models.Q(('invoice_number__isnull', False)), fields=['invoice_number'], name='invoice_number_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(condition=models.Q(('invoice_date__isnull', False)), fields=['invoice_date'], name='invoice_date_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoice_extractor', '0006_invoice_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendorMonthlySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vendor_cuit', models.CharField(help_text='CUIT digits, without separators', max_length=11)),
+                ('month', models.DateField(help_text='First day of the month')),
+                ('currency', models.CharField(max_length=10)),
+                ('invoice_count', models.PositiveIntegerField(default=0)),
+                ('subtotal', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('tax_amount', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Vendor Monthly Summary',
+                'verbose_name_plural': 'Vendor Monthly Summaries',
+                'ordering': ['-month', 'vendor_cuit', 'currency'],
+                'indexes': [models.Index(fields=['month'], name='vendor_summary_month_idx')],
+                'constraints': [models.UniqueConstraint(fields=('vendor_cuit', 'month', 'currency'), name='vendor_monthly_summary_unique')],
+            },
+        ),
+    ]
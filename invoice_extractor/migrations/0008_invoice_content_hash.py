@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:46
+
+import django.core.validators
+import invoice_extractor.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoice_extractor', '0007_vendormonthlysummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, help_text='SHA-256 of the document, used to detect duplicate uploads', max_length=64, null=True),
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='document',
+            field=models.FileField(help_text='Invoice document (PDF, JPG, PNG, or DOCX)', max_length=255, storage=invoice_extractor.storage.ContentAddressedStorage(), upload_to=invoice_extractor.storage.document_upload_to, validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['pdf', 'jpg', 'jpeg', 'png', 'docx'])]),
+        ),
+    ]
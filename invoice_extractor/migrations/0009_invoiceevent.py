@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoice_extractor', '0008_invoice_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stage', models.CharField(choices=[('uploaded', 'Uploaded'), ('processing', 'Processing'), ('parsed', 'Parsed'), ('fast_path_fields', 'Fast path fields'), ('llm_fields', 'LLM fields'), ('items_saved', 'Items saved'), ('completed', 'Completed'), ('failed', 'Failed')], max_length=20)),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='invoice_extractor.invoice')),
+            ],
+            options={
+                'verbose_name': 'Invoice Event',
+                'verbose_name_plural': 'Invoice Events',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['invoice', 'id'], name='invoice_event_stream_idx')],
+            },
+        ),
+    ]
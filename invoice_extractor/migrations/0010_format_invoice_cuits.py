@@ -0,0 +1,30 @@
+import re
+
+from django.db import migrations
+
+
+def format_cuits(apps, schema_editor):
+    """Store the CUITs saved before they were formatted as XX-XXXXXXXX-X"""
+    Invoice = apps.get_model('invoice_extractor', 'Invoice')
+    for field in ('vendor_cuit', 'customer_cuit'):
+        invoices = (
+            Invoice.objects.filter(**{f'{field}__isnull': False})
+            .exclude(**{f'{field}__regex': r'^\d{2}-\d{8}-\d$'})
+            .only('id', field)
+        )
+        for invoice in invoices.iterator():
+            digits = re.sub(r'\D', '', getattr(invoice, field))
+            if len(digits) == 11:
+                setattr(invoice, field, f"{digits[:2]}-{digits[2:10]}-{digits[10]}")
+                invoice.save(update_fields=[field])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoice_extractor', '0009_invoiceevent'),
+    ]
+
+    operations = [
+        migrations.RunPython(format_cuits, migrations.RunPython.noop),
+    ]
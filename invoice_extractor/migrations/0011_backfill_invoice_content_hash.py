@@ -0,0 +1,30 @@
+import hashlib
+
+from django.db import migrations
+
+
+def backfill_content_hashes(apps, schema_editor):
+    """Hash the documents uploaded before content_hash existed, skipping missing files"""
+    Invoice = apps.get_model('invoice_extractor', 'Invoice')
+    invoices = Invoice.objects.filter(content_hash__isnull=True).exclude(document='').only('id', 'document')
+    for invoice in invoices.iterator():
+        digest = hashlib.sha256()
+        try:
+            with invoice.document.storage.open(invoice.document.name, 'rb') as f:
+                for chunk in iter(lambda: f.read(64 * 1024), b''):
+                    digest.update(chunk)
+        except OSError:
+            continue
+        invoice.content_hash = digest.hexdigest()
+        invoice.save(update_fields=['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoice_extractor', '0010_format_invoice_cuits'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_content_hashes, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,22 @@
 from django.db import models
 from django.core.validators import FileExtensionValidator
 
+from .storage import ContentAddressedStorage, document_upload_to
+
+
+class InvoiceBatch(models.Model):
+    """Group of invoice documents uploaded together"""
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Invoice Batch'
+        verbose_name_plural = 'Invoice Batches'
+    
+    def __str__(self):
+        return f"Batch {self.id}"
+
 
 class Invoice(models.Model):
     """Model to store invoice documents and extracted data"""
@@ -14,11 +30,25 @@ class Invoice(models.Model):
     
     # File information
     document = models.FileField(
-        upload_to='invoices/%Y/%m/%d/',
+        upload_to=document_upload_to,
+        storage=ContentAddressedStorage(),
+        max_length=255,
         validators=[FileExtensionValidator(allowed_extensions=['pdf', 'jpg', 'jpeg', 'png', 'docx'])],
         help_text='Invoice document (PDF, JPG, PNG, or DOCX)'
     )
     original_filename = models.CharField(max_length=255)
+    content_hash = models.CharField(
+        max_length=64, blank=True, null=True, db_index=True,
+        help_text='SHA-256 of the document, used to detect duplicate uploads'
+    )
+    batch = models.ForeignKey(
+        InvoiceBatch,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='invoices',
+        help_text='Batch upload this invoice belongs to'
+    )
     
     # Processing status
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
@@ -56,7 +86,29 @@ class Invoice(models.Model):
     error_message = models.TextField(blank=True, null=True)
     
     class Meta:
-        ordering = ['-uploaded_at']
+        ordering = ['-uploaded_at', '-id']
+        indexes = [
+            models.Index(fields=['-uploaded_at', '-id'], name='invoice_uploaded_idx'),
+            # Status filter keeps the list's keyset order
+            models.Index(fields=['status', '-uploaded_at', '-id'], name='invoice_status_idx'),
+            # Reconciliation lookups; most rows have these fields set once extracted
+            models.Index(
+                fields=['vendor_cuit', 'invoice_date'], name='invoice_vendor_cuit_idx',
+                condition=models.Q(vendor_cuit__isnull=False),
+            ),
+            models.Index(
+                fields=['customer_cuit', 'invoice_date'], name='invoice_customer_cuit_idx',
+                condition=models.Q(customer_cuit__isnull=False),
+            ),
+            models.Index(
+                fields=['invoice_number'], name='invoice_number_idx',
+                condition=models.Q(invoice_number__isnull=False),
+            ),
+            models.Index(
+                fields=['invoice_date'], name='invoice_date_idx',
+                condition=models.Q(invoice_date__isnull=False),
+            ),
+        ]
         verbose_name = 'Invoice'
         verbose_name_plural = 'Invoices'
     
@@ -89,3 +141,116 @@ class InvoiceItem(models.Model):
     
     def __str__(self):
         return f"{self.description[:50]} - {self.quantity} x {self.unit_price}"
+
+
+class ExtractionCacheEntry(models.Model):
+    """Cached extraction result, keyed by document content hash, model and prompt version"""
+    
+    key = models.CharField(max_length=255, unique=True)
+    result = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    last_accessed_at = models.DateTimeField(auto_now=True, db_index=True)
+    
+    class Meta:
+        verbose_name = 'Extraction Cache Entry'
+        verbose_name_plural = 'Extraction Cache Entries'
+    
+    def __str__(self):
+        return self.key
+
+
+class ExtractionJob(models.Model):
+    """Queued extraction of an invoice document, processed by the extraction workers"""
+    
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    options = models.JSONField(default=dict, blank=True, help_text='Extraction options, e.g. use_cache')
+    attempts = models.PositiveIntegerField(default=0)
+    worker = models.CharField(max_length=255, blank=True, null=True)
+    error_message = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='extraction_job_queue_idx'),
+        ]
+        verbose_name = 'Extraction Job'
+        verbose_name_plural = 'Extraction Jobs'
+    
+    def __str__(self):
+        return f"Job {self.id} for invoice {self.invoice_id} - {self.status}"
+
+
+class InvoiceEvent(models.Model):
+    """Stage reached by the extraction of an invoice, streamed by the events endpoint"""
+    
+    STAGE_CHOICES = [
+        ('uploaded', 'Uploaded'),
+        ('processing', 'Processing'),
+        ('parsed', 'Parsed'),
+        ('fast_path_fields', 'Fast path fields'),
+        ('llm_fields', 'LLM fields'),
+        ('items_saved', 'Items saved'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='events')
+    stage = models.CharField(max_length=20, choices=STAGE_CHOICES)
+    data = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['invoice', 'id'], name='invoice_event_stream_idx'),
+        ]
+        verbose_name = 'Invoice Event'
+        verbose_name_plural = 'Invoice Events'
+    
+    def __str__(self):
+        return f"Invoice {self.invoice_id} {self.stage}"
+
+
+class VendorMonthlySummary(models.Model):
+    """
+    Totals of the completed invoices of a vendor in a month and currency
+
+    Kept up to date by invoice_extractor.analytics as invoices complete or
+    are reprocessed; rebuild with manage.py rebuild_vendor_summaries.
+    """
+    
+    vendor_cuit = models.CharField(max_length=11, help_text='CUIT digits, without separators')
+    month = models.DateField(help_text='First day of the month')
+    currency = models.CharField(max_length=10)
+    invoice_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    tax_amount = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    total_amount = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-month', 'vendor_cuit', 'currency']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['vendor_cuit', 'month', 'currency'], name='vendor_monthly_summary_unique'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['month'], name='vendor_summary_month_idx'),
+        ]
+        verbose_name = 'Vendor Monthly Summary'
+        verbose_name_plural = 'Vendor Monthly Summaries'
+    
+    def __str__(self):
+        return f"{self.vendor_cuit} {self.month:%Y-%m} {self.currency}"
@@ -0,0 +1,57 @@
+"""
+Selection of the invoice pages of long PDFs
+
+Some vendors send PDFs, from 2 to 20 pages, where the invoice is page 1 and
+the rest are terms and conditions or remitos. Pages are scored by the density of invoice
+keywords in their text layer, and when there are more than
+PAGE_PRUNING_MAX_PAGES only the relevant ones are passed on to the query
+engines, so the tokens sent to the LLM do not grow with the attachments.
+"""
+import re
+from typing import List, Sequence, Tuple
+
+PAGE_KEYWORDS_RE = re.compile(r'\b(factura|cuit|total|iva)\b', re.IGNORECASE)
+WORD_RE = re.compile(r'\w+')
+
+# Distinct keywords a page needs to count as part of the invoice
+MIN_PAGE_KEYWORDS = 2
+
+
+def page_score(text: str) -> Tuple[int, float]:
+    """
+    Score the text of a page
+
+    Returns:
+        Tuple of (distinct keywords found, keyword hits per word)
+    """
+    hits = [match.lower() for match in PAGE_KEYWORDS_RE.findall(text)]
+    if not hits:
+        return 0, 0.0
+    return len(set(hits)), len(hits) / len(WORD_RE.findall(text))
+
+
+def select_pages(page_texts: Sequence[str], max_pages: int) -> List[int]:
+    """
+    Return the indexes of the pages worth extracting, in document order
+
+    Documents of at most max_pages pages are kept whole, since the scores
+    can't tell a continuation page of the invoice (e.g. one with only the
+    last items and the subtotal) from an attachment. In longer ones, pages
+    with at least MIN_PAGE_KEYWORDS distinct keywords are kept, the highest
+    scoring ones when there are more than max_pages. When no page qualifies
+    (e.g. a scan without a text layer) the first max_pages pages are kept.
+
+    Args:
+        page_texts: Text layer of each page
+        max_pages: Maximum number of pages to keep
+    """
+    if len(page_texts) <= max_pages:
+        return list(range(len(page_texts)))
+
+    scores = [page_score(text) for text in page_texts]
+    relevant = [index for index, (keywords, _) in enumerate(scores) if keywords >= MIN_PAGE_KEYWORDS]
+    if not relevant:
+        return list(range(min(max_pages, len(page_texts))))
+
+    relevant.sort(key=lambda index: (-scores[index][0], -scores[index][1], index))
+    return sorted(relevant[:max_pages])
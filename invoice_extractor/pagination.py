@@ -0,0 +1,23 @@
+"""
+Pagination for the invoice endpoints
+"""
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class InvoiceCursorPagination(CursorPagination):
+    """
+    Keyset pagination on (-uploaded_at, -id)
+
+    Every page is a single indexed range scan, however deep, and there is
+    no COUNT(*) over the whole table. Clients follow the next/previous
+    links and can ask for up to INVOICE_MAX_PAGE_SIZE rows with
+    ?page_size=.
+    """
+
+    ordering = ('-uploaded_at', '-id')
+    page_size_query_param = 'page_size'
+
+    @property
+    def max_page_size(self):
+        return getattr(settings, 'INVOICE_MAX_PAGE_SIZE', 500)
@@ -0,0 +1,177 @@
+"""
+Preprocessing of photographed and scanned invoices before extraction
+
+Most image uploads are phone photos of tickets: 12 megapixels, rotated
+through EXIF, in color and with the table around the paper in frame. They
+can be normalized once per document (EXIF orientation applied, borders
+cropped, grayscale, downsampled to IMAGE_PREPROCESSING_DPI) and the result
+cached on disk by content hash, which makes the document readers several
+times faster. It does not lower the vision tokens billed for the image:
+cropping a ticket leaves a tall, narrow page, which the tiling of vision
+models bills as more tiles than the original photo. It is therefore off by
+default (IMAGE_PREPROCESSING_ENABLED).
+"""
+import logging
+import math
+import os
+import tempfile
+from typing import Optional, Tuple
+
+from django.conf import settings
+
+from .cache import file_sha256
+
+try:
+    from PIL import Image, ImageChops, ImageOps
+    PILLOW_AVAILABLE = True
+except ImportError:
+    PILLOW_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Photos carry no reliable DPI, so the target DPI is applied to the long
+# side of an A4 page
+PAGE_LONG_SIDE_INCHES = 11.7
+
+# Border detection runs on a thumbnail of at most this many pixels per side
+BORDER_SAMPLE_SIZE = 512
+BORDER_THRESHOLD = 40
+BORDER_MARGIN = 0.01
+
+
+def max_image_side(dpi: int) -> int:
+    """Return the longest side, in pixels, of a page scanned at dpi"""
+    return int(round(dpi * PAGE_LONG_SIDE_INCHES))
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """
+    Estimate the tokens a vision model bills for an image
+
+    Uses the OpenAI high detail rule: fit in 2048x2048, scale the short
+    side down to 768, then 170 tokens per 512px tile plus 85.
+    """
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def _content_box(image: 'Image.Image') -> Optional[Tuple[int, int, int, int]]:
+    """
+    Return the box of a grayscale image that differs from its border color
+
+    The box is found on a thumbnail, which is fast and smooths out sensor
+    noise, then scaled back up with a small margin. Returns None when the
+    whole image is content or there is no content at all.
+    """
+    sample = image.copy()
+    sample.thumbnail((BORDER_SAMPLE_SIZE, BORDER_SAMPLE_SIZE), Image.Resampling.BOX)
+    width, height = sample.size
+    corners = sorted(
+        sample.getpixel(point) for point in ((0, 0), (width - 1, 0), (0, height - 1), (width - 1, height - 1))
+    )
+    background = (corners[1] + corners[2]) // 2
+
+    difference = ImageChops.difference(sample, Image.new('L', sample.size, background))
+    box = difference.point(lambda value: 255 if value > BORDER_THRESHOLD else 0).getbbox()
+    if box is None or box == (0, 0, width, height):
+        return None
+
+    scale_x, scale_y = image.width / width, image.height / height
+    margin_x, margin_y = image.width * BORDER_MARGIN, image.height * BORDER_MARGIN
+    return (
+        max(0, int(box[0] * scale_x - margin_x)),
+        max(0, int(box[1] * scale_y - margin_y)),
+        min(image.width, int(math.ceil(box[2] * scale_x + margin_x))),
+        min(image.height, int(math.ceil(box[3] * scale_y + margin_y))),
+    )
+
+
+def normalize_image(image: 'Image.Image', dpi: int) -> 'Image.Image':
+    """
+    Auto-orient, crop, convert to grayscale and downsample an image
+
+    Args:
+        image: Image as opened by Image.open (not loaded yet, so that JPEGs
+            can be decoded at reduced scale)
+        dpi: Target resolution, see max_image_side
+
+    Returns:
+        Grayscale ('L') image whose long side is at most max_image_side(dpi)
+    """
+    max_side = max_image_side(dpi)
+    scale = max_side / max(image.size)
+    if scale < 1:
+        # JPEG only: decode straight to grayscale at 1/2, 1/4 or 1/8 scale
+        image.draft('L', (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+
+    image = ImageOps.exif_transpose(image)
+    image = image.convert('L')
+
+    box = _content_box(image)
+    if box is not None:
+        image = image.crop(box)
+
+    image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    return image
+
+
+def preprocess_image(file_path: str, content_hash: Optional[str] = None) -> str:
+    """
+    Return the path of the normalized copy of an image document
+
+    The copy is stored in IMAGE_PREPROCESSING_CACHE_DIR under the document
+    hash and the target DPI, and reused on later calls. Other documents,
+    and every document when IMAGE_PREPROCESSING_ENABLED is off or Pillow
+    is missing, are returned unchanged, as are images that fail to open.
+
+    Args:
+        file_path: Path to the invoice document
+        content_hash: SHA-256 of the document if already known
+
+    Returns:
+        Path of the file to hand to the document readers
+    """
+    if (not PILLOW_AVAILABLE
+            or not getattr(settings, 'IMAGE_PREPROCESSING_ENABLED', False)
+            or not file_path.lower().endswith(IMAGE_EXTENSIONS)):
+        return file_path
+
+    dpi = getattr(settings, 'IMAGE_PREPROCESSING_DPI', 200)
+    cache_dir = getattr(settings, 'IMAGE_PREPROCESSING_CACHE_DIR', None) or os.path.join(
+        settings.MEDIA_ROOT, 'preprocessed'
+    )
+
+    try:
+        content_hash = content_hash or file_sha256(file_path)
+        path = os.path.join(cache_dir, content_hash[:2], f'{content_hash}-{dpi}dpi.png')
+        if os.path.exists(path):
+            return path
+
+        with Image.open(file_path) as image:
+            original_size = image.size
+            normalized = normalize_image(image, dpi)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.png', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                normalized.save(f, format='PNG')
+            os.replace(tmp_path, path)
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logger.warning("Could not preprocess %s, using the original", file_path, exc_info=True)
+        return file_path
+
+    logger.info(
+        "Preprocessed %s: %dx%d -> %dx%d (~%d -> ~%d image tokens)",
+        file_path, *original_size, *normalized.size,
+        estimate_image_tokens(*original_size), estimate_image_tokens(*normalized.size),
+    )
+    return path
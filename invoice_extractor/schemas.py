@@ -0,0 +1,51 @@
+"""
+Structured output schemas for invoice extraction
+"""
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+
+class InvoiceLineItem(BaseModel):
+    """A single line item of an Argentine invoice"""
+
+    description: str = Field(description='Item description (Descripción / Detalle)')
+    quantity: Optional[float] = Field(default=None, description='Quantity (Cantidad)')
+    unit_price: Optional[float] = Field(default=None, description='Unit price (Precio Unitario)')
+    total_price: Optional[float] = Field(default=None, description='Line total (Subtotal del ítem)')
+    tax_rate: Optional[float] = Field(default=None, description='IVA rate in percent (Alícuota IVA), e.g. 21')
+    product_code: Optional[str] = Field(default=None, description='Product or service code (Código)')
+
+
+class ArgentineInvoice(BaseModel):
+    """
+    Every field extracted from an Argentine invoice in a single call
+
+    Text fields are kept exactly as printed on the document so that the
+    existing parse_currency/parse_date helpers can normalize them.
+    """
+
+    invoice_number: Optional[str] = Field(default=None, description='Invoice number (Número de Factura), e.g. 0001-00001234')
+    invoice_date: Optional[str] = Field(default=None, description='Invoice date (Fecha de Factura) as printed, e.g. 15/01/2024')
+    vendor_name: Optional[str] = Field(default=None, description='Vendor/seller name (Razón Social)')
+    vendor_cuit: Optional[str] = Field(default=None, description='Vendor CUIT number')
+    vendor_address: Optional[str] = Field(default=None, description='Vendor address (Domicilio Comercial)')
+    customer_name: Optional[str] = Field(default=None, description='Customer/buyer name')
+    customer_cuit: Optional[str] = Field(default=None, description='Customer CUIT number')
+    customer_address: Optional[str] = Field(default=None, description='Customer address')
+    subtotal: Optional[str] = Field(default=None, description='Subtotal amount as printed, e.g. $10.000,00')
+    tax_amount: Optional[str] = Field(default=None, description='IVA/VAT tax amount as printed')
+    total_amount: Optional[str] = Field(default=None, description='Total amount (Total) as printed')
+    currency: Optional[str] = Field(default=None, description='Currency code, e.g. ARS or USD')
+    payment_terms: Optional[str] = Field(default=None, description='Payment terms (Condiciones de Pago)')
+    items: List[InvoiceLineItem] = Field(default_factory=list, description='Invoice line items')
+
+    def to_extraction_dict(self) -> Dict[str, Any]:
+        """Return the fields in the same shape as the per-field extraction"""
+        data = self.model_dump(exclude={'items'})
+        data = {
+            field: value.strip() if isinstance(value, str) else value
+            for field, value in data.items()
+        }
+        data['items'] = [item.model_dump(exclude_none=True) for item in self.items]
+        return data
@@ -1,5 +1,11 @@
+import os
+import zipfile
+
+from django.conf import settings
 from rest_framework import serializers
-from .models import Invoice, InvoiceItem
+from .models import Invoice, InvoiceItem, VendorMonthlySummary
+from .uploads import EXTENSION_TYPES, MAX_DOCUMENT_SIZE, ArchiveMemberFile, detect_document_type
+from .validators import normalize_cuit
 
 
 class InvoiceItemSerializer(serializers.ModelSerializer):
@@ -33,6 +39,113 @@ class InvoiceSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'uploaded_at', 'processed_at', 'status']
 
 
+class InvoiceListSerializer(InvoiceSerializer):
+    """
+    Lightweight serializer for listing invoices
+
+    Leaves out raw_extraction and the line items unless asked for:
+    ?fields=id,status,total_amount returns only those fields and
+    ?expand=items adds the line items to the default fields.
+    """
+    
+    DEFAULT_FIELDS = [
+        'id', 'document', 'original_filename', 'status',
+        'uploaded_at', 'processed_at',
+        'invoice_number', 'invoice_date',
+        'vendor_name', 'vendor_cuit', 'customer_name', 'customer_cuit',
+        'subtotal', 'tax_amount', 'total_amount', 'currency',
+        'error_message'
+    ]
+    EXPANDABLE_FIELDS = ['items']
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        selected = self.selected_fields(request.query_params if request else {})
+        for name in set(self.fields) - selected:
+            self.fields.pop(name)
+    
+    @classmethod
+    def selected_fields(cls, query_params):
+        """
+        Return the names of the fields requested with ?fields= and ?expand=
+
+        Args:
+            query_params: Request query parameters
+
+        Returns:
+            Set of field names; unknown names are ignored
+        """
+        def split(name):
+            value = query_params.get(name) or ''
+            return {field.strip() for field in value.split(',') if field.strip()}
+
+        available = set(InvoiceSerializer.Meta.fields)
+        requested = split('fields') & available
+        selected = requested or set(cls.DEFAULT_FIELDS)
+        return selected | (split('expand') & set(cls.EXPANDABLE_FIELDS))
+
+
+class InvoiceFilterSerializer(serializers.Serializer):
+    """Query parameters accepted to filter the invoice list"""
+    
+    status = serializers.ChoiceField(choices=Invoice.STATUS_CHOICES, required=False)
+    vendor_cuit = serializers.CharField(required=False)
+    customer_cuit = serializers.CharField(required=False)
+    invoice_number = serializers.CharField(required=False)
+    date_from = serializers.DateField(required=False, help_text='Invoice date from (inclusive)')
+    date_to = serializers.DateField(required=False, help_text='Invoice date to (inclusive)')
+    total_min = serializers.DecimalField(max_digits=12, decimal_places=2, required=False)
+    total_max = serializers.DecimalField(max_digits=12, decimal_places=2, required=False)
+    
+    def _validate_cuit(self, value):
+        digits = normalize_cuit(value)
+        if digits is None:
+            raise serializers.ValidationError("A CUIT must have 11 digits")
+        return digits
+    
+    def validate_vendor_cuit(self, value):
+        return self._validate_cuit(value)
+    
+    def validate_customer_cuit(self, value):
+        return self._validate_cuit(value)
+    
+    def validate(self, attrs):
+        if attrs.get('date_from') and attrs.get('date_to') and attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError({'date_to': 'Must not be before date_from'})
+        return attrs
+
+
+class VendorMonthlySummarySerializer(serializers.ModelSerializer):
+    """Serializer for the per vendor and month invoice totals"""
+    
+    month = serializers.DateField(format='%Y-%m')
+    
+    class Meta:
+        model = VendorMonthlySummary
+        fields = [
+            'vendor_cuit', 'month', 'currency', 'invoice_count',
+            'subtotal', 'tax_amount', 'total_amount', 'updated_at'
+        ]
+
+
+class VendorSummaryFilterSerializer(serializers.Serializer):
+    """Query parameters accepted to filter the vendor analytics"""
+    
+    MONTH_FORMATS = ['%Y-%m', 'iso-8601']
+    
+    vendor_cuit = serializers.CharField(required=False)
+    currency = serializers.CharField(required=False)
+    month_from = serializers.DateField(input_formats=MONTH_FORMATS, required=False, help_text='YYYY-MM')
+    month_to = serializers.DateField(input_formats=MONTH_FORMATS, required=False, help_text='YYYY-MM')
+    
+    def validate_vendor_cuit(self, value):
+        digits = normalize_cuit(value)
+        if digits is None:
+            raise serializers.ValidationError("A CUIT must have 11 digits")
+        return digits
+
+
 class InvoiceUploadSerializer(serializers.Serializer):
     """Serializer for uploading invoice documents"""
     
@@ -41,7 +154,21 @@ class InvoiceUploadSerializer(serializers.Serializer):
     )
     
     def validate_document(self, value):
-        """Validate file extension and size"""
+        """Validate file extension, size and contents"""
+        self.validate_name_and_size(value)
+        ext = value.name.split('.')[-1].lower()
+        
+        # Check the contents, not only the name
+        detected_type = detect_document_type(value)
+        if detected_type != EXTENSION_TYPES[ext]:
+            raise serializers.ValidationError(
+                f"File content is not a valid {ext.upper()} document"
+            )
+        
+        return value
+    
+    def validate_name_and_size(self, value):
+        """Validate file extension and size, without reading the file"""
         allowed_extensions = ['pdf', 'jpg', 'jpeg', 'png', 'docx']
         ext = value.name.split('.')[-1].lower()
         
@@ -51,7 +178,115 @@ class InvoiceUploadSerializer(serializers.Serializer):
             )
         
         # Limit file size to 10MB
-        if value.size > 10 * 1024 * 1024:
+        if value.size > MAX_DOCUMENT_SIZE:
             raise serializers.ValidationError("File size must not exceed 10MB")
         
         return value
+
+
+class InvoiceBatchUploadSerializer(serializers.Serializer):
+    """Serializer for uploading many invoice documents at once"""
+    
+    documents = serializers.ListField(
+        child=serializers.FileField(),
+        allow_empty=False,
+        help_text='Invoice documents (PDF, JPG, PNG or DOCX) and/or ZIP archives of them'
+    )
+    
+    def validate(self, attrs):
+        """
+        Expand ZIP archives and validate every document
+        
+        The number of documents and their total uncompressed size are
+        checked against the archive listings first, so nothing is
+        decompressed for a batch that is over either limit. Archive members
+        are only read to check their contents and, later, to store them.
+        """
+        document_validator = InvoiceUploadSerializer()
+        max_files = getattr(settings, 'INVOICE_BATCH_MAX_FILES', 500)
+        max_uncompressed_size = getattr(settings, 'INVOICE_BATCH_MAX_UNCOMPRESSED_SIZE', 1024 * 1024 * 1024)
+        documents = []
+        skipped = []
+        uncompressed_size = 0
+        
+        for uploaded in attrs['documents']:
+            if uploaded.name.lower().endswith('.zip'):
+                members, archive_skipped = self._archive_members(uploaded)
+                documents.extend(members)
+                skipped.extend(archive_skipped)
+                uncompressed_size += sum(member.size for member in members)
+                if uncompressed_size > max_uncompressed_size:
+                    raise serializers.ValidationError(
+                        {'documents': f"The documents of a batch can add up to at most "
+                                      f"{max_uncompressed_size // (1024 * 1024)}MB uncompressed"}
+                    )
+            else:
+                try:
+                    documents.append(document_validator.validate_name_and_size(uploaded))
+                except serializers.ValidationError as e:
+                    raise serializers.ValidationError(
+                        {'documents': f"{uploaded.name}: {' '.join(e.detail)}"}
+                    )
+            
+            if len(documents) > max_files:
+                raise serializers.ValidationError(
+                    {'documents': f"A batch can contain at most {max_files} documents"}
+                )
+        
+        valid_documents = []
+        for document in documents:
+            try:
+                valid_documents.append(document_validator.validate_document(document))
+            except serializers.ValidationError as e:
+                if not isinstance(document, ArchiveMemberFile):
+                    raise serializers.ValidationError(
+                        {'documents': f"{document.name}: {' '.join(e.detail)}"}
+                    )
+                skipped.append({'name': document.member.filename, 'error': ' '.join(e.detail)})
+            finally:
+                # Archive members are reopened when stored
+                if isinstance(document, ArchiveMemberFile):
+                    document.close()
+        
+        if not valid_documents:
+            raise serializers.ValidationError(
+                {'documents': "No supported invoice documents found"}
+            )
+        
+        return {'documents': valid_documents, 'skipped': skipped}
+    
+    def _archive_members(self, uploaded):
+        """
+        Return the supported documents inside a ZIP archive, unread
+        
+        Members that are not supported invoice documents (by name or
+        declared size) are skipped and reported by name instead of failing
+        the whole batch.
+        """
+        document_validator = InvoiceUploadSerializer()
+        members = []
+        skipped = []
+        
+        max_size = getattr(settings, 'INVOICE_ARCHIVE_MAX_SIZE', 100 * 1024 * 1024)
+        if uploaded.size > max_size:
+            raise serializers.ValidationError(
+                f"{uploaded.name} exceeds the {max_size // (1024 * 1024)}MB archive limit"
+            )
+        
+        try:
+            archive = zipfile.ZipFile(uploaded)
+        except zipfile.BadZipFile:
+            raise serializers.ValidationError(f"{uploaded.name} is not a valid ZIP archive")
+        
+        for member in archive.infolist():
+            name = os.path.basename(member.filename)
+            if member.is_dir() or not name or member.filename.startswith('__MACOSX/'):
+                continue
+            
+            document = ArchiveMemberFile(archive, member, name)
+            try:
+                members.append(document_validator.validate_name_and_size(document))
+            except serializers.ValidationError as e:
+                skipped.append({'name': member.filename, 'error': ' '.join(e.detail)})
+        
+        return members, skipped
@@ -1,42 +1,284 @@
 """
 Service layer for invoice extraction using Llamaindex
 """
-import os
-from typing import Dict, Any, Optional
+import re
+import json
+import asyncio
+import logging
+from functools import lru_cache
+from typing import Callable, Dict, Any, Iterable, List, Optional
 from datetime import datetime
 from pathlib import Path
 
-try:
-    from llama_index.core import SimpleDirectoryReader, VectorStoreIndex
-    from llama_index.core.llms import OpenAI
-    from llama_index.core import Settings
-    LLAMAINDEX_AVAILABLE = True
-except ImportError:
-    LLAMAINDEX_AVAILABLE = False
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .cache import file_sha256, get_extraction_cache, make_cache_key
+from .afip_qr import payload_to_fields
+from .llm_backends import LLAMAINDEX_AVAILABLE, configure_llm, get_backend_config
+from .loaders import get_document_loader
+from .fast_path import FieldMatch, extract_fields, extract_pdf_pages
+from .engines import DirectContextQueryEngine, estimate_tokens
+from .schemas import ArgentineInvoice
+from .validators import is_valid_cuit
+
+
+logger = logging.getLogger(__name__)
+
+# Part of the extraction cache key: bump it whenever the queries, prompts or
+# output schema change so that stale cached results are not reused
+PROMPT_VERSION = '4'
+
+EXTRACTION_MODE_STRUCTURED = 'structured'
+EXTRACTION_MODE_PER_FIELD = 'per_field'
+
+# Queries for Argentine invoice fields, used by the per-field extraction mode
+FIELD_QUERIES = {
+    'invoice_number': 'What is the invoice number (Número de Factura)?',
+    'invoice_date': 'What is the invoice date (Fecha de Factura)?',
+    'vendor_name': 'What is the vendor/seller name (Razón Social)?',
+    'vendor_cuit': 'What is the vendor CUIT number (CUIT del vendedor)?',
+    'vendor_address': 'What is the vendor address (Domicilio Comercial)?',
+    'customer_name': 'What is the customer/buyer name?',
+    'customer_cuit': 'What is the customer CUIT number?',
+    'customer_address': 'What is the customer address?',
+    'subtotal': 'What is the subtotal amount (Subtotal)?',
+    'tax_amount': 'What is the IVA/VAT tax amount?',
+    'total_amount': 'What is the total amount (Total)?',
+    'currency': 'What is the currency used?',
+    'payment_terms': 'What are the payment terms (Condiciones de Pago)?',
+}
+
+STRUCTURED_EXTRACTION_QUERY = (
+    "Extract all the data from this Argentine invoice (factura): invoice number, "
+    "date, vendor and customer name, CUIT and address, subtotal, IVA amount, total, "
+    "currency, payment terms and every line item. Copy amounts and dates exactly "
+    "as printed and leave a field empty if it does not appear in the document."
+)
+
+LINE_ITEMS_QUERY = (
+    "List all line items from this invoice as a JSON array. "
+    "Each item must be an object with the keys description, quantity, unit_price, "
+    "total_price, tax_rate (the IVA percentage, e.g. 21) and product_code. "
+    "Use null for values that are not printed. Return only the JSON array."
+)
+
+LINE_ITEM_NUMBER_FIELDS = ('quantity', 'unit_price', 'total_price', 'tax_rate')
+
+# Labels the LLM may use when it answers with "key: value" text instead of JSON
+LINE_ITEM_LABELS = {
+    'description': ('description', 'descripcion', 'descripción', 'detalle', 'producto', 'item'),
+    'quantity': ('quantity', 'qty', 'cantidad', 'cant'),
+    'unit_price': ('unit_price', 'unit price', 'precio unitario', 'precio unit', 'p. unit'),
+    'total_price': ('total_price', 'total price', 'total', 'subtotal', 'importe'),
+    'tax_rate': ('tax_rate', 'tax rate', 'iva', '% iva', 'alicuota', 'alícuota'),
+    'product_code': ('product_code', 'product code', 'code', 'codigo', 'código', 'cod'),
+}
+LINE_ITEM_LABEL_FIELDS = {
+    label: field for field, labels in LINE_ITEM_LABELS.items() for label in labels
+}
+LABEL_RE = re.compile(r'(?:^|[,;|]\s*)([^:,;|]+?)\s*:\s*')
+
+CURRENCY_FIELDS = ('subtotal', 'tax_amount', 'total_amount')
+DATE_FIELDS = ('invoice_date',)
+CUIT_FIELDS = ('vendor_cuit', 'customer_cuit')
+
+# Rounding allowed when checking that the total covers subtotal + IVA. The
+# total may be higher: it also includes the other taxes (percepciones de
+# IIBB, impuestos internos), which are not extracted
+TOTALS_ROUNDING_TOLERANCE = 0.05
+
+# Called with (stage, data) as an extraction advances, see events
+ProgressCallback = Callable[[str, Dict[str, Any]], None]
+
+LLAMAINDEX_MISSING_ERROR = 'Llamaindex is not installed. Please install it using: pip install llama-index'
+
+
+def parse_number(value: Any) -> Optional[float]:
+    """
+    Parse a number written either the Argentine way (1.234,56) or the
+    English way (1,234.56); bare numbers are returned as floats
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    
+    text = re.sub(r'[^\d,.\-]', '', str(value))
+    if not re.search(r'\d', text):
+        return None
+    if ',' in text and '.' in text:
+        # Whichever separator comes last is the decimal one
+        if text.rfind(',') > text.rfind('.'):
+            text = text.replace('.', '').replace(',', '.')
+        else:
+            text = text.replace(',', '')
+    elif ',' in text:
+        text = text.replace(',', '') if text.count(',') > 1 else text.replace(',', '.')
+    elif text.count('.') > 1 or re.fullmatch(r'-?\d{1,3}\.\d{3}', text):
+        text = text.replace('.', '')
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def _report(progress: Optional[ProgressCallback], stage: str, data: Dict[str, Any]) -> None:
+    if progress is not None:
+        progress(stage, data)
+
+
+def _answered(fields: Dict[str, Any]) -> Dict[str, Any]:
+    """The fields of a query result that have a value"""
+    return {field: value for field, value in fields.items() if value}
+
+
+def _event_loop_running() -> bool:
+    """Return True if called from a thread that is running an event loop"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
 
 
 class InvoiceExtractionService:
     """Service to extract invoice data from documents using Llamaindex"""
     
-    def __init__(self):
+    def __init__(self, extraction_mode: Optional[str] = None):
         """Initialize Llamaindex with configuration"""
+        self.extraction_mode = extraction_mode or getattr(
+            settings, 'LLAMAINDEX_EXTRACTION_MODE', EXTRACTION_MODE_STRUCTURED
+        )
+        self.llm_config = get_backend_config()
+        self.model_name = f"{self.llm_config['BACKEND']}:{self.llm_config['MODEL']}"
+        self.direct_context_max_tokens = getattr(
+            settings, 'LLAMAINDEX_DIRECT_CONTEXT_MAX_TOKENS', 6000
+        )
+        self.afip_qr_enabled = getattr(settings, 'AFIP_QR_ENABLED', True)
+        self.fast_path_enabled = getattr(settings, 'FAST_PATH_ENABLED', True)
+        self.fast_path_min_confidence = getattr(settings, 'FAST_PATH_MIN_CONFIDENCE', 0.8)
+        self.page_pruning_enabled = getattr(settings, 'PAGE_PRUNING_ENABLED', True)
+        self.page_pruning_max_pages = getattr(settings, 'PAGE_PRUNING_MAX_PAGES', 3)
+        self.query_concurrency = getattr(settings, 'LLAMAINDEX_QUERY_CONCURRENCY', 8)
+        self.query_timeout = getattr(settings, 'LLAMAINDEX_QUERY_TIMEOUT', 60)
+        self.document_loader = get_document_loader()
+        
         if not LLAMAINDEX_AVAILABLE:
             return
         
-        # Configure the LLM
-        api_key = os.getenv('OPENAI_API_KEY')
-        if api_key:
-            Settings.llm = OpenAI(
-                model=os.getenv('LLAMAINDEX_MODEL', 'gpt-3.5-turbo'),
-                api_key=api_key
-            )
+        # Configure the LLM backend (see settings.LLM_BACKEND)
+        configure_llm(
+            self.llm_config,
+            field_queries={**FIELD_QUERIES, 'items': LINE_ITEMS_QUERY},
+        )
     
-    def extract_invoice_data(self, file_path: str) -> Dict[str, Any]:
+    def extract_invoice_data(
+        self,
+        file_path: str,
+        use_cache: bool = True,
+        content_hash: Optional[str] = None,
+        progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
         """
         Extract invoice data from a document file
         
+        Successful results are stored in the extraction cache (see
+        settings.EXTRACTION_CACHE), keyed by the SHA-256 of the document
+        contents, the model name and the prompt version.
+        
+        Args:
+            file_path: Path to the invoice document
+            use_cache: Return a cached result if there is one. The fresh
+                result is stored in the cache either way.
+            content_hash: SHA-256 of the document if already known (e.g.
+                Invoice.content_hash), to avoid reading the file again
+            progress: Called with (stage, data) as the stages of a fresh
+                extraction finish: parsed, fast_path_fields, llm_fields
+            
+        Returns:
+            Dictionary containing extracted invoice data
+        """
+        cache, cache_key = self._cache_key(file_path, content_hash)
+        
+        if cache_key and use_cache:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        result = self._extract_invoice_data(file_path, content_hash=content_hash, progress=progress)
+        
+        if cache_key and result.get('success'):
+            cache.set(cache_key, result)
+        
+        return result
+    
+    async def aextract_invoice_data(
+        self,
+        file_path: str,
+        use_cache: bool = True,
+        content_hash: Optional[str] = None,
+        progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """
+        Async version of extract_invoice_data
+        
+        The LLM calls are awaited (aquery/acomplete) instead of holding a
+        thread while waiting on the network. The document is loaded in the
+        loader processes or a worker thread, and the cache is used through
+        sync_to_async.
+        
+        progress must not block: it is called from the event loop.
+        """
+        cache, cache_key = await sync_to_async(self._cache_key)(file_path, content_hash)
+        
+        if cache_key and use_cache:
+            cached = await sync_to_async(cache.get)(cache_key)
+            if cached is not None:
+                return cached
+        
+        result = await self._aextract_invoice_data(file_path, content_hash=content_hash, progress=progress)
+        
+        if cache_key and result.get('success'):
+            await sync_to_async(cache.set)(cache_key, result)
+        
+        return result
+    
+    def _cache_key(self, file_path: str, content_hash: Optional[str] = None) -> tuple:
+        """
+        Return the extraction cache and the key of a document in it
+        
+        Returns:
+            Tuple of (cache, key); the key is None when the cache is disabled
+            or the document cannot be hashed
+        """
+        cache = get_extraction_cache()
+        if cache is None:
+            return None, None
+        
+        try:
+            return cache, make_cache_key(
+                content_hash or file_sha256(file_path), self.model_name, PROMPT_VERSION, self.extraction_mode
+            )
+        except OSError:
+            logger.warning("Could not hash %s for the extraction cache", file_path, exc_info=True)
+            return cache, None
+    
+    def _extract_invoice_data(
+        self,
+        file_path: str,
+        content_hash: Optional[str] = None,
+        progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """
+        Run the Llamaindex extraction pipeline on a document file
+        
         Args:
             file_path: Path to the invoice document
+            content_hash: SHA-256 of the document if already known
+            progress: Progress callback, see extract_invoice_data
             
         Returns:
             Dictionary containing extracted invoice data
@@ -44,81 +286,632 @@ class InvoiceExtractionService:
         if not LLAMAINDEX_AVAILABLE:
             return {
                 'success': False,
-                'error': 'Llamaindex is not installed. Please install it using: pip install llama-index'
+                'error': LLAMAINDEX_MISSING_ERROR
             }
         
         try:
-            # Load the document
-            documents = SimpleDirectoryReader(
-                input_files=[file_path]
-            ).load_data()
+            # Load the document (in the loader processes, see loaders)
+            loaded = self.document_loader.load(file_path, content_hash=content_hash, **self._load_options())
             
-            if not documents:
+            if not loaded.documents:
                 return {
                     'success': False,
                     'error': 'Failed to load document'
                 }
             
-            # Create an index from the documents
-            index = VectorStoreIndex.from_documents(documents)
+            _report(progress, 'parsed', {'pages': len(loaded.page_texts), 'documents': len(loaded.documents)})
             
-            # Create a query engine
-            query_engine = index.as_query_engine()
+            fast_fields = self._known_fields(file_path, loaded)
+            fast_values = {field: match.value for field, match in fast_fields.items()}
+            if fast_values:
+                _report(progress, 'fast_path_fields', {'fields': fast_values})
+            missing_fields = self.invalid_fields(fast_values)
+            
+            # Create the query engines
+            query_engine, structured_engine = self._build_query_engines(loaded.documents)
             
             # Extract specific fields for Argentine invoices
-            extracted_data = self._query_invoice_fields(query_engine)
+            if not missing_fields:
+                # Only the line items are left for the LLM
+                extracted_data = {'items': self._extract_line_items(query_engine)}
+                _report(progress, 'llm_fields', {'fields': extracted_data})
+            elif self.extraction_mode == EXTRACTION_MODE_STRUCTURED:
+                extracted_data = self._query_structured_fields(
+                    structured_engine, query_engine, known_fields=fast_values, progress=progress
+                )
+            else:
+                extracted_data = self._query_fields(query_engine, field_names=missing_fields, progress=progress)
+            
+            return self._extraction_result(extracted_data, fast_fields, loaded.afip_qr)
+            
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+    
+    async def _aextract_invoice_data(
+        self,
+        file_path: str,
+        content_hash: Optional[str] = None,
+        progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """Async version of _extract_invoice_data"""
+        if not LLAMAINDEX_AVAILABLE:
+            return {
+                'success': False,
+                'error': LLAMAINDEX_MISSING_ERROR
+            }
+        
+        try:
+            loaded = await self.document_loader.aload(file_path, content_hash=content_hash, **self._load_options())
+            
+            if not loaded.documents:
+                return {
+                    'success': False,
+                    'error': 'Failed to load document'
+                }
+            
+            _report(progress, 'parsed', {'pages': len(loaded.page_texts), 'documents': len(loaded.documents)})
+            
+            fast_fields = self._known_fields(file_path, loaded)
+            fast_values = {field: match.value for field, match in fast_fields.items()}
+            if fast_values:
+                _report(progress, 'fast_path_fields', {'fields': fast_values})
+            missing_fields = self.invalid_fields(fast_values)
+            
+            # Indexing larger documents embeds them, which is blocking
+            query_engine, structured_engine = await asyncio.to_thread(
+                self._build_query_engines, loaded.documents
+            )
+            
+            if not missing_fields:
+                extracted_data = {'items': await self._aextract_line_items(query_engine)}
+                _report(progress, 'llm_fields', {'fields': extracted_data})
+            elif self.extraction_mode == EXTRACTION_MODE_STRUCTURED:
+                extracted_data = await self._aquery_structured_fields(
+                    structured_engine, query_engine, known_fields=fast_values, progress=progress
+                )
+            else:
+                extracted_data = await self._aquery_invoice_fields(
+                    query_engine, field_names=missing_fields, progress=progress
+                )
+            
+            return self._extraction_result(extracted_data, fast_fields, loaded.afip_qr)
+            
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+    
+    def repair_invoice_data(
+        self,
+        file_path: str,
+        extracted: Dict[str, Any],
+        content_hash: Optional[str] = None,
+        progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """
+        Re-extract only the fields of a previous extraction that need it
+        
+        The fields returned by fields_to_repair (and the line items, if
+        there are none) are read again, from the AFIP QR code and the PDF
+        text layer when possible and otherwise with one LLM query each. The
+        answers are merged into the previous extraction and the result
+        replaces it in the extraction cache.
+        
+        Args:
+            file_path: Path to the invoice document
+            extracted: The 'data' of the previous extraction (raw_extraction)
+            content_hash: SHA-256 of the document if already known
+            progress: Progress callback, see extract_invoice_data
+            
+        Returns:
+            Extraction result, with the fields that were re-extracted in
+            'repaired_fields'
+        """
+        field_names = self.fields_to_repair(extracted)
+        include_items = not extracted.get('items')
+        if not field_names and not include_items:
+            return self._repair_result(extracted, {}, [], False)
+        
+        if not LLAMAINDEX_AVAILABLE:
+            return {
+                'success': False,
+                'error': LLAMAINDEX_MISSING_ERROR
+            }
+        
+        try:
+            loaded = self.document_loader.load(file_path, content_hash=content_hash, **self._load_options())
+            
+            if not loaded.documents:
+                return {
+                    'success': False,
+                    'error': 'Failed to load document'
+                }
+            
+            _report(progress, 'parsed', {'pages': len(loaded.page_texts), 'documents': len(loaded.documents)})
+            repaired, query_fields = self._repair_known_fields(file_path, loaded, extracted, field_names, progress)
             
+            if query_fields or include_items:
+                query_engine, _ = self._build_query_engines(loaded.documents)
+                answers = self._query_fields(
+                    query_engine, field_names=query_fields, include_items=include_items, progress=progress
+                )
+                repaired.update(_answered(answers))
+            
+            result = self._repair_result(extracted, repaired, field_names, include_items)
+            
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+        
+        cache, cache_key = self._cache_key(file_path, content_hash)
+        if cache_key:
+            cache.set(cache_key, {'success': True, 'data': result['data']})
+        return result
+    
+    async def arepair_invoice_data(
+        self,
+        file_path: str,
+        extracted: Dict[str, Any],
+        content_hash: Optional[str] = None,
+        progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """Async version of repair_invoice_data"""
+        field_names = self.fields_to_repair(extracted)
+        include_items = not extracted.get('items')
+        if not field_names and not include_items:
+            return self._repair_result(extracted, {}, [], False)
+        
+        if not LLAMAINDEX_AVAILABLE:
             return {
-                'success': True,
-                'data': extracted_data
+                'success': False,
+                'error': LLAMAINDEX_MISSING_ERROR
             }
+        
+        try:
+            loaded = await self.document_loader.aload(file_path, content_hash=content_hash, **self._load_options())
+            
+            if not loaded.documents:
+                return {
+                    'success': False,
+                    'error': 'Failed to load document'
+                }
+            
+            _report(progress, 'parsed', {'pages': len(loaded.page_texts), 'documents': len(loaded.documents)})
+            repaired, query_fields = self._repair_known_fields(file_path, loaded, extracted, field_names, progress)
+            
+            if query_fields or include_items:
+                query_engine, _ = await asyncio.to_thread(self._build_query_engines, loaded.documents)
+                answers = await self._aquery_invoice_fields(
+                    query_engine, field_names=query_fields, include_items=include_items, progress=progress
+                )
+                repaired.update(_answered(answers))
+            
+            result = self._repair_result(extracted, repaired, field_names, include_items)
             
         except Exception as e:
             return {
                 'success': False,
                 'error': str(e)
             }
+        
+        cache, cache_key = await sync_to_async(self._cache_key)(file_path, content_hash)
+        if cache_key:
+            await sync_to_async(cache.set)(cache_key, {'success': True, 'data': result['data']})
+        return result
     
-    def _query_invoice_fields(self, query_engine) -> Dict[str, Any]:
+    def _repair_known_fields(
+        self,
+        file_path: str,
+        loaded,
+        extracted: Dict[str, Any],
+        field_names: List[str],
+        progress: Optional[ProgressCallback] = None,
+    ) -> tuple:
+        """
+        Repair what the AFIP QR code and the PDF text layer can
+        
+        Returns:
+            Tuple of (repaired fields, fields still to be queried)
+        """
+        fast_values = {
+            field: match.value for field, match in self._known_fields(file_path, loaded).items()
+            if field in field_names
+        }
+        if fast_values:
+            _report(progress, 'fast_path_fields', {'fields': fast_values})
+        still_invalid = self.fields_to_repair({**extracted, **fast_values})
+        return fast_values, [field for field in field_names if field in still_invalid]
+    
+    def _repair_result(
+        self,
+        extracted: Dict[str, Any],
+        repaired: Dict[str, Any],
+        field_names: List[str],
+        include_items: bool,
+    ) -> Dict[str, Any]:
+        """Merge the repaired fields into the previous extraction"""
+        if include_items:
+            field_names = [*field_names, 'items']
+        logger.info("Repaired %d of %d fields: %s", len(repaired), len(field_names), ', '.join(repaired))
+        return {
+            'success': True,
+            'data': {**extracted, **repaired},
+            'repaired_fields': field_names,
+        }
+    
+    def _load_options(self) -> Dict[str, Any]:
+        """Options of the loading stage (see loaders.load_document)"""
+        return {
+            'afip_qr': self.afip_qr_enabled,
+            'text_layer': self.fast_path_enabled or self.page_pruning_enabled,
+            'max_pages': self.page_pruning_max_pages if self.page_pruning_enabled else None,
+        }
+    
+    def _known_fields(self, file_path: str, loaded) -> Dict[str, FieldMatch]:
+        """
+        Read what we can from the AFIP QR code and the PDF text layer
+        without the LLM. The QR code values take precedence.
+        
+        Args:
+            file_path: Path to the invoice document
+            loaded: LoadedDocument of the invoice
+            
+        Returns:
+            Dictionary of field name to FieldMatch
+        """
+        fast_fields = self._fast_path_fields(file_path, loaded.page_texts)
+        if loaded.afip_qr:
+            fast_fields.update(payload_to_fields(loaded.afip_qr))
+        return fast_fields
+    
+    def _extraction_result(
+        self,
+        extracted_data: Dict[str, Any],
+        fast_fields: Dict[str, FieldMatch],
+        afip_qr: Optional[Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        """Merge the LLM answers with the fields read without the LLM"""
+        extracted_data.update({field: match.value for field, match in fast_fields.items()})
+        if fast_fields:
+            extracted_data['fast_path_confidence'] = {
+                field: match.confidence for field, match in fast_fields.items()
+            }
+        if afip_qr:
+            extracted_data['afip_qr'] = afip_qr
+        
+        return {
+            'success': True,
+            'data': extracted_data
+        }
+    
+    def _fast_path_fields(self, file_path: str, page_texts: Optional[List[str]] = None) -> Dict[str, FieldMatch]:
+        """
+        Extract the fields of AFIP-style PDFs with regular expressions
+        
+        Args:
+            file_path: Path to the invoice document
+            page_texts: Text layer of each page of the PDF, if already read
+            
+        Returns:
+            Dictionary of field name to FieldMatch, only for the fields found
+            with at least FAST_PATH_MIN_CONFIDENCE
+        """
+        if not self.fast_path_enabled or not file_path.lower().endswith('.pdf'):
+            return {}
+        
+        if page_texts is None:
+            page_texts = extract_pdf_pages(file_path)
+        matches = extract_fields('\n'.join(page_texts))
+        return {
+            field: match for field, match in matches.items()
+            if match.confidence >= self.fast_path_min_confidence
+        }
+    
+    def _build_query_engines(self, documents) -> tuple:
+        """
+        Build the per-field and structured query engines for the documents
+        
+        Documents under LLAMAINDEX_DIRECT_CONTEXT_MAX_TOKENS are passed
+        straight to the LLM. Only larger documents are chunked, embedded and
+        indexed in a VectorStoreIndex.
+        
+        Args:
+            documents: Llamaindex documents of the invoice
+            
+        Returns:
+            Tuple of (query_engine, structured_engine)
+        """
+        context = '\n\n'.join(document.text for document in documents)
+        
+        if estimate_tokens(context) <= self.direct_context_max_tokens:
+            return (
+                DirectContextQueryEngine(context),
+                DirectContextQueryEngine(context, output_cls=ArgentineInvoice),
+            )
+        
+        from llama_index.core import VectorStoreIndex
+        
+        # Create an index from the documents
+        index = VectorStoreIndex.from_documents(documents)
+        return (
+            index.as_query_engine(),
+            index.as_query_engine(output_cls=ArgentineInvoice),
+        )
+    
+    def _query_structured_fields(
+        self,
+        structured_engine,
+        query_engine,
+        known_fields: Optional[Dict[str, Any]] = None,
+        progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """
+        Extract every invoice field and the line items in a single call
+        
+        Fields that come back missing or invalid are queried again one by one
+        through the per-field query engine.
+        
+        Args:
+            structured_engine: Llamaindex query engine built with output_cls=ArgentineInvoice
+            query_engine: Llamaindex query engine used for the per-field fallback
+            known_fields: Fields already extracted by other means, which take
+                precedence and are never queried again
+            progress: Progress callback, see extract_invoice_data
+            
+        Returns:
+            Dictionary with extracted fields
+        """
+        fields = {}
+        
+        try:
+            response = structured_engine.query(STRUCTURED_EXTRACTION_QUERY)
+            invoice = getattr(response, 'response', response)
+            if isinstance(invoice, ArgentineInvoice):
+                fields = invoice.to_extraction_dict()
+        except Exception:
+            logger.warning("Structured extraction failed, falling back to per-field queries", exc_info=True)
+        
+        known_fields = known_fields or {}
+        answered = {field: value for field, value in _answered(fields).items() if field not in known_fields}
+        if answered:
+            _report(progress, 'llm_fields', {'fields': answered})
+        fields.update(known_fields)
+        
+        missing_fields = self.invalid_fields(fields)
+        if missing_fields:
+            fallback = self._query_fields(
+                query_engine, field_names=missing_fields, include_items=not fields.get('items'),
+                progress=progress,
+            )
+            fields.update(
+                {field: value for field, value in fallback.items() if value}
+            )
+        
+        return fields
+    
+    async def _aquery_structured_fields(
+        self,
+        structured_engine,
+        query_engine,
+        known_fields: Optional[Dict[str, Any]] = None,
+        progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """Async version of _query_structured_fields"""
+        fields = {}
+        
+        try:
+            response = await asyncio.wait_for(
+                structured_engine.aquery(STRUCTURED_EXTRACTION_QUERY), timeout=self.query_timeout
+            )
+            invoice = getattr(response, 'response', response)
+            if isinstance(invoice, ArgentineInvoice):
+                fields = invoice.to_extraction_dict()
+        except Exception:
+            logger.warning("Structured extraction failed, falling back to per-field queries", exc_info=True)
+        
+        known_fields = known_fields or {}
+        answered = {field: value for field, value in _answered(fields).items() if field not in known_fields}
+        if answered:
+            _report(progress, 'llm_fields', {'fields': answered})
+        fields.update(known_fields)
+        
+        missing_fields = self.invalid_fields(fields)
+        if missing_fields:
+            fallback = await self._aquery_invoice_fields(
+                query_engine, field_names=missing_fields, include_items=not fields.get('items'),
+                progress=progress,
+            )
+            fields.update(
+                {field: value for field, value in fallback.items() if value}
+            )
+        
+        return fields
+    
+    def invalid_fields(self, fields: Dict[str, Any]) -> List[str]:
+        """
+        Return the names of the fields that are missing or cannot be parsed
+        
+        Args:
+            fields: Dictionary with extracted fields
+            
+        Returns:
+            List of field names, in FIELD_QUERIES order
+        """
+        invalid = []
+        for field in FIELD_QUERIES:
+            value = fields.get(field)
+            if not value:
+                invalid.append(field)
+            elif field in CURRENCY_FIELDS and self.parse_currency(value) is None:
+                invalid.append(field)
+            elif field in DATE_FIELDS and self.parse_date(value) is None:
+                invalid.append(field)
+        return invalid
+    
+    def fields_to_repair(self, fields: Dict[str, Any]) -> List[str]:
+        """
+        Return the fields of an extraction that should be extracted again
+        
+        On top of the invalid_fields, a CUIT whose verification digit does
+        not match is rejected, and so are the amounts when the total is
+        less than subtotal + IVA.
+        
+        Args:
+            fields: Dictionary with extracted fields (e.g. raw_extraction)
+            
+        Returns:
+            List of field names, in FIELD_QUERIES order
+        """
+        repair = set(self.invalid_fields(fields))
+        repair.update(
+            field for field in CUIT_FIELDS
+            if fields.get(field) and not is_valid_cuit(fields[field])
+        )
+        
+        subtotal, tax_amount, total_amount = (self.parse_currency(fields.get(field)) for field in CURRENCY_FIELDS)
+        if None not in (subtotal, tax_amount, total_amount):
+            if subtotal + tax_amount - total_amount > TOTALS_ROUNDING_TOLERANCE:
+                repair.update(CURRENCY_FIELDS)
+        
+        return [field for field in FIELD_QUERIES if field in repair]
+    
+    def _query_fields(
+        self,
+        query_engine,
+        field_names: Optional[Iterable[str]] = None,
+        include_items: bool = True,
+        progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """
+        Query the document for specific invoice fields, concurrently if possible
+        
+        The queries are sent concurrently when LLAMAINDEX_QUERY_CONCURRENCY is
+        above 1 and no event loop is already running in this thread. Otherwise
+        they run one after another.
+        
+        Concurrent answers arrive at about the same time and are reported
+        to progress together, after the event loop is done (the callback
+        may write to the database, which is not allowed from the loop).
+        """
+        if self.query_concurrency > 1 and not _event_loop_running():
+            fields = asyncio.run(
+                self._aquery_invoice_fields(query_engine, field_names, include_items)
+            )
+            if _answered(fields):
+                _report(progress, 'llm_fields', {'fields': _answered(fields)})
+            return fields
+        return self._query_invoice_fields(query_engine, field_names, include_items, progress=progress)
+    
+    async def _aquery_invoice_fields(
+        self,
+        query_engine,
+        field_names: Optional[Iterable[str]] = None,
+        include_items: bool = True,
+        progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """
+        Query the document for specific invoice fields concurrently
+        
+        At most LLAMAINDEX_QUERY_CONCURRENCY queries are in flight at once and
+        each one is abandoned after LLAMAINDEX_QUERY_TIMEOUT seconds, so the
+        wall-clock time is about that of the slowest query.
+        
+        Args:
+            query_engine: Llamaindex query engine (must provide aquery)
+            field_names: Fields to query (defaults to all of FIELD_QUERIES)
+            include_items: Whether to also query the line items
+            progress: Progress callback, called as each answer arrives
+            
+        Returns:
+            Dictionary with extracted fields
+        """
+        if field_names is None:
+            field_names = FIELD_QUERIES.keys()
+        field_names = list(field_names)
+        
+        semaphore = asyncio.Semaphore(max(1, self.query_concurrency))
+        
+        async def run_query(field, query):
+            async with semaphore:
+                response = await asyncio.wait_for(
+                    query_engine.aquery(query), timeout=self.query_timeout
+                )
+            if progress is not None:
+                value = self._parse_line_items(response) if field == 'items' else str(response or '').strip()
+                if value:
+                    progress('llm_fields', {'fields': {field: value}})
+            return response
+        
+        queries = [(field, FIELD_QUERIES[field]) for field in field_names]
+        if include_items:
+            queries.append(('items', LINE_ITEMS_QUERY))
+        
+        responses = await asyncio.gather(
+            *(run_query(field, query) for field, query in queries), return_exceptions=True
+        )
+        
+        fields = {}
+        for field, response in zip(field_names, responses):
+            if isinstance(response, BaseException):
+                logger.warning("Query for %s failed: %r", field, response)
+                fields[field] = None
+            elif response and str(response).strip():
+                fields[field] = str(response).strip()
+        
+        if include_items:
+            items_response = responses[-1]
+            if isinstance(items_response, BaseException):
+                fields['items'] = []
+            else:
+                fields['items'] = self._parse_line_items(items_response)
+        
+        return fields
+    
+    def _query_invoice_fields(
+        self,
+        query_engine,
+        field_names: Optional[Iterable[str]] = None,
+        include_items: bool = True,
+        progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
         """
         Query the document for specific invoice fields
         
         Args:
             query_engine: Llamaindex query engine
+            field_names: Fields to query (defaults to all of FIELD_QUERIES)
+            include_items: Whether to also query the line items
+            progress: Progress callback, called after each query
             
         Returns:
             Dictionary with extracted fields
         """
         fields = {}
         
-        # Define queries for Argentine invoice fields
-        queries = {
-            'invoice_number': 'What is the invoice number (Número de Factura)?',
-            'invoice_date': 'What is the invoice date (Fecha de Factura)?',
-            'vendor_name': 'What is the vendor/seller name (Razón Social)?',
-            'vendor_cuit': 'What is the vendor CUIT number (CUIT del vendedor)?',
-            'vendor_address': 'What is the vendor address (Domicilio Comercial)?',
-            'customer_name': 'What is the customer/buyer name?',
-            'customer_cuit': 'What is the customer CUIT number?',
-            'customer_address': 'What is the customer address?',
-            'subtotal': 'What is the subtotal amount (Subtotal)?',
-            'tax_amount': 'What is the IVA/VAT tax amount?',
-            'total_amount': 'What is the total amount (Total)?',
-            'currency': 'What is the currency used?',
-            'payment_terms': 'What are the payment terms (Condiciones de Pago)?',
-        }
+        if field_names is None:
+            field_names = FIELD_QUERIES.keys()
         
         # Query each field
-        for field, query in queries.items():
+        for field in field_names:
             try:
-                response = query_engine.query(query)
+                response = query_engine.query(FIELD_QUERIES[field])
                 if response and str(response).strip():
                     fields[field] = str(response).strip()
+                    _report(progress, 'llm_fields', {'fields': {field: fields[field]}})
             except Exception as e:
                 fields[field] = None
         
         # Extract line items
-        fields['items'] = self._extract_line_items(query_engine)
+        if include_items:
+            fields['items'] = self._extract_line_items(query_engine)
+            if fields['items']:
+                _report(progress, 'llm_fields', {'fields': {'items': fields['items']}})
         
         return fields
     
@@ -133,22 +926,100 @@ class InvoiceExtractionService:
             List of line items
         """
         try:
-            items_query = (
-                "List all line items from this invoice. "
-                "For each item, provide: description, quantity, unit price, and total price. "
-                "Format the response as a structured list."
+            response = query_engine.query(LINE_ITEMS_QUERY)
+            return self._parse_line_items(response)
+        except Exception:
+            return []
+    
+    async def _aextract_line_items(self, query_engine) -> list:
+        """Async version of _extract_line_items"""
+        try:
+            response = await asyncio.wait_for(
+                query_engine.aquery(LINE_ITEMS_QUERY), timeout=self.query_timeout
             )
-            response = query_engine.query(items_query)
-            
-            # This is a simplified extraction - in production, you'd parse the response
-            # into structured data
-            if response and str(response).strip():
-                return [{'description': str(response).strip()}]
-            
+            return self._parse_line_items(response)
         except Exception:
-            pass
+            return []
+    
+    def _parse_line_items(self, response) -> list:
+        """
+        Convert the line items query response into a list of items
         
-        return []
+        The answer is read as a JSON array when possible, then as one
+        "description: ..., quantity: ..., total: ..." line per item. An
+        answer in neither shape is kept as a single item description.
+        
+        Args:
+            response: Llamaindex response to LINE_ITEMS_QUERY
+            
+        Returns:
+            List of dictionaries with description, quantity, unit_price,
+            total_price, tax_rate and product_code
+        """
+        text = str(response).strip() if response else ''
+        if not text:
+            return []
+        
+        rows = self._line_item_rows_from_json(text)
+        if rows is None:
+            rows = self._line_item_rows_from_text(text)
+        items = [item for item in map(self._normalize_line_item, rows) if item]
+        return items or [{'description': text}]
+    
+    def _line_item_rows_from_json(self, text: str) -> Optional[list]:
+        """Return the objects of the JSON array in text, or None"""
+        start, end = text.find('['), text.rfind(']')
+        if start == -1 or end < start:
+            return None
+        try:
+            rows = json.loads(text[start:end + 1])
+        except ValueError:
+            return None
+        if not isinstance(rows, list):
+            return None
+        return [row for row in rows if isinstance(row, dict)]
+    
+    def _line_item_rows_from_text(self, text: str) -> list:
+        """Read one item per line of "label: value" pairs"""
+        rows = []
+        for line in text.splitlines():
+            line = re.sub(r'^\s*(?:[-*•]|\d+[.)])\s*', '', line)
+            labels = list(LABEL_RE.finditer(line))
+            row = {}
+            for i, match in enumerate(labels):
+                field = LINE_ITEM_LABEL_FIELDS.get(match.group(1).strip().lower())
+                value_end = labels[i + 1].start() if i + 1 < len(labels) else len(line)
+                if field:
+                    row[field] = line[match.end():value_end].strip(' ,;|')
+            if row:
+                rows.append(row)
+        return rows
+    
+    def _normalize_line_item(self, row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Coerce a raw item to the InvoiceItem fields
+        
+        A missing quantity, unit price or total is derived from the other
+        two. Items without a description are dropped.
+        """
+        description = str(row.get('description') or '').strip()
+        if not description:
+            return None
+        
+        item = {'description': description}
+        for field in LINE_ITEM_NUMBER_FIELDS:
+            item[field] = parse_number(row.get(field))
+        code = row.get('product_code')
+        item['product_code'] = str(code).strip() if code not in (None, '') else None
+        
+        quantity, unit_price, total_price = item['quantity'], item['unit_price'], item['total_price']
+        if total_price is None and quantity is not None and unit_price is not None:
+            item['total_price'] = round(quantity * unit_price, 2)
+        elif unit_price is None and quantity and total_price is not None:
+            item['unit_price'] = round(total_price / quantity, 2)
+        elif quantity is None and unit_price and total_price is not None:
+            item['quantity'] = round(total_price / unit_price, 2)
+        return item
     
     def parse_currency(self, amount_str: Optional[str]) -> Optional[float]:
         """Parse currency string to float"""
@@ -184,3 +1055,31 @@ class InvoiceExtractionService:
                 continue
         
         return None
+
+
+# Settings read when the service is built
+SERVICE_SETTINGS = (
+    'LLM_BACKEND', 'LLAMAINDEX_MODEL', 'OPENAI_API_KEY',
+    'LLAMAINDEX_EXTRACTION_MODE', 'LLAMAINDEX_DIRECT_CONTEXT_MAX_TOKENS',
+    'LLAMAINDEX_QUERY_CONCURRENCY', 'LLAMAINDEX_QUERY_TIMEOUT',
+    'AFIP_QR_ENABLED', 'FAST_PATH_ENABLED', 'FAST_PATH_MIN_CONFIDENCE',
+    'PAGE_PRUNING_ENABLED', 'PAGE_PRUNING_MAX_PAGES',
+    'DOCUMENT_LOADER_WORKERS', 'DOCUMENT_LOADER_TIMEOUT',
+)
+
+
+@lru_cache(maxsize=None)
+def get_extraction_service() -> InvoiceExtractionService:
+    """
+    Return the process-wide extraction service
+    
+    It is built on first use, so the LLM and its HTTP connection pool are
+    set up once per process instead of once per request.
+    """
+    return InvoiceExtractionService()
+
+
+@receiver(setting_changed)
+def _reset_extraction_service(setting, **kwargs):
+    if setting in SERVICE_SETTINGS:
+        get_extraction_service.cache_clear()
@@ -0,0 +1,85 @@
+"""
+Content-addressed storage for invoice documents
+
+Documents are stored under their SHA-256 digest with a two level fan-out,
+e.g. invoices/3f/a2/3fa2...e1.pdf, so the same file uploaded many times is
+stored once and no directory grows past 256 entries per level.
+"""
+import hashlib
+import logging
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def content_sha256(file) -> str:
+    """
+    Return the hex SHA-256 digest of an open (uploaded) file
+
+    The file is read in chunks and rewound afterwards, unless the upload
+    handler already hashed it while receiving it.
+    """
+    if getattr(file, 'content_hash', None):
+        return file.content_hash
+    digest = hashlib.sha256()
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    if hasattr(file, 'chunks'):
+        chunks = file.chunks(HASH_CHUNK_SIZE)
+    else:
+        chunks = iter(lambda: file.read(HASH_CHUNK_SIZE), b'')
+    for chunk in chunks:
+        digest.update(chunk)
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    return digest.hexdigest()
+
+
+def content_addressed_name(content_hash: str, filename: str, prefix: str = 'invoices') -> str:
+    """Return the storage name of a document: <prefix>/ab/cd/<hash><ext>"""
+    extension = os.path.splitext(filename)[1].lower()
+    return f"{prefix}/{content_hash[:2]}/{content_hash[2:4]}/{content_hash}{extension}"
+
+
+def document_upload_to(instance, filename: str) -> str:
+    """
+    upload_to for Invoice.document
+
+    Uses instance.content_hash when the upload already computed it, and
+    hashes the file (recording the digest on the instance) otherwise.
+    """
+    if not instance.content_hash:
+        instance.content_hash = content_sha256(instance.document.file)
+    return content_addressed_name(instance.content_hash, filename)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage that keeps a single copy of each document
+
+    Names come from document_upload_to, so an existing name means the same
+    content is already stored: saving it again is a no-op that returns the
+    existing name instead of writing a renamed copy.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is not None and self.exists(name):
+            logger.debug(f"Document {name} already stored, reusing it")
+            return name
+        try:
+            return super().save(name, content, max_length=max_length)
+        except FileExistsError:
+            # Stored concurrently by another upload of the same document
+            return name
+
+    def get_available_name(self, name, max_length=None):
+        # Never rename: an existing name already holds this exact content
+        if self.exists(name):
+            raise FileExistsError(name)
+        return name
@@ -1,10 +1,149 @@
-from django.test import TestCase
+import asyncio
+import csv
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import base64
+import hashlib
+import json
+import re
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from importlib import import_module
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.admin import AdminSite
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.core.files.uploadedfile import SimpleUploadedFile
 from rest_framework.test import APITestCase
 from rest_framework import status
 from decimal import Decimal
-from .models import Invoice, InvoiceItem
-from .services import InvoiceExtractionService
+from types import SimpleNamespace
+from .admin import InvoiceAdmin
+from .afip_qr import QR_DECODER_AVAILABLE, find_afip_qr, parse_afip_qr_url, payload_to_fields
+from .analytics import rebuild_summaries
+from .cache import DiskExtractionCache, DatabaseExtractionCache, get_extraction_cache
+from .jobs import claim_next_job, enqueue_extraction, requeue_stale_jobs, run_job, run_next_job, save_extraction
+from .models import ExtractionJob, Invoice, InvoiceEvent, InvoiceItem, VendorMonthlySummary
+from .engines import DirectContextQueryEngine
+from .export import PYARROW_AVAILABLE
+from .llm_backends import LLAMAINDEX_AVAILABLE, build_llm
+from .loaders import DocumentLoader, DocumentLoadTimeout, LoadedDocument, load_document
+from .page_pruning import select_pages
+from .preprocessing import PILLOW_AVAILABLE, normalize_image, preprocess_image
+
+try:
+    import qrcode
+    QRCODE_AVAILABLE = True
+except ImportError:
+    QRCODE_AVAILABLE = False
+from .fast_path import extract_fields
+from .schemas import ArgentineInvoice, InvoiceLineItem
+from .services import InvoiceExtractionService, FIELD_QUERIES, LINE_ITEMS_QUERY, get_extraction_service
+
+
+class FakeResponse:
+    """Minimal stand-in for a Llamaindex response object"""
+    
+    def __init__(self, response):
+        self.response = response
+    
+    def __str__(self):
+        return str(self.response)
+
+
+class FakeQueryEngine:
+    """Query engine returning canned answers and recording every query"""
+    
+    def __init__(self, answers=None, default=''):
+        self.answers = answers or {}
+        self.default = default
+        self.queries = []
+    
+    def query(self, query):
+        self.queries.append(query)
+        return FakeResponse(self.answers.get(query, self.default))
+    
+    async def aquery(self, query):
+        return self.query(query)
+
+
+class SlowQueryEngine:
+    """Async query engine that sleeps before answering, tracking concurrency"""
+    
+    def __init__(self, delay=0.05, slow_queries=(), slow_delay=1.0):
+        self.delay = delay
+        self.slow_queries = slow_queries
+        self.slow_delay = slow_delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+    
+    async def aquery(self, query):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.slow_delay if query in self.slow_queries else self.delay)
+            return FakeResponse('answer')
+        finally:
+            self.in_flight -= 1
+
+
+AFIP_INVOICE_LINES = [
+    'ORIGINAL',
+    'FACTURA A',
+    'Punto de Venta: 00002 Comp. Nro: 00000123',
+    'Fecha de Emisión: 15/01/2024',
+    'Razón Social: EMPRESA EJEMPLO S.A.',
+    'Domicilio Comercial: Av. Siempreviva 742 - CABA',
+    'CUIT: 30712345671',
+    'Condición frente al IVA: IVA Responsable Inscripto',
+    'CUIT: 20123456786',
+    'Apellido y Nombre / Razón Social: CLIENTE EJEMPLO SRL',
+    'Domicilio: Calle Falsa 123 - Rosario',
+    'Condición de venta: Contado',
+    'Importe Neto Gravado: $ 10.000,00',
+    'IVA 21%: $ 2.100,00',
+    'Importe Otros Tributos: $ 0,00',
+    'Importe Total: $ 12.100,00',
+    'CAE N°: 74123456789012',
+]
+
+
+def make_text_pdf(lines):
+    """Build a one-page PDF whose text layer contains the given lines"""
+    def escape(line):
+        return line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+    text = ''.join(f"({escape(line)}) Tj T* " for line in lines)
+    stream = f"BT /F1 10 Tf 12 TL 40 800 Td {text}ET".encode('cp1252')
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+        b"/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+    ]
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return pdf
 
 
 class InvoiceModelTest(TestCase):
@@ -43,8 +182,28 @@ class InvoiceModelTest(TestCase):
         self.assertEqual(item.invoice, invoice)
         self.assertEqual(item.quantity, Decimal('10.00'))
         self.assertEqual(invoice.items.count(), 1)
+    
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_content_hash_backfill(self):
+        """Test that the migration hashes the stored documents and skips missing ones"""
+        from django.apps import apps
+        backfill = import_module('invoice_extractor.migrations.0011_backfill_invoice_content_hash')
+        
+        stored = Invoice.objects.create(
+            original_filename='a.pdf', document=SimpleUploadedFile('a.pdf', b'%PDF-1.4 factura')
+        )
+        missing = Invoice.objects.create(original_filename='b.pdf', document='invoices/missing.pdf')
+        Invoice.objects.update(content_hash=None)
+        
+        backfill.backfill_content_hashes(apps, None)
+        
+        stored.refresh_from_db()
+        missing.refresh_from_db()
+        self.assertEqual(stored.content_hash, hashlib.sha256(b'%PDF-1.4 factura').hexdigest())
+        self.assertIsNone(missing.content_hash)
 
 
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
 class InvoiceAPITest(APITestCase):
     """Test cases for Invoice API endpoints"""
     
@@ -88,6 +247,311 @@ class InvoiceAPITest(APITestCase):
         self.assertEqual(response.data['invoice_number'], '0001-00001234')
 
 
+class InvoiceListAPITest(APITestCase):
+    """Test cases for the lightweight invoice list"""
+    
+    def setUp(self):
+        for i in range(5):
+            invoice = Invoice.objects.create(
+                original_filename=f'factura_{i}.pdf',
+                status='completed',
+                raw_extraction={'invoice_number': f'0001-0000000{i}'}
+            )
+            InvoiceItem.objects.create(
+                invoice=invoice, description='Producto', quantity=1,
+                unit_price=Decimal('100.00'), total_price=Decimal('100.00')
+            )
+    
+    def test_list_leaves_out_raw_extraction_and_items(self):
+        """Test the default list fields"""
+        response = self.client.get('/api/invoices/')
+        invoice = response.data['results'][0]
+        self.assertIn('total_amount', invoice)
+        self.assertNotIn('raw_extraction', invoice)
+        self.assertNotIn('items', invoice)
+    
+    def test_list_query_count_does_not_grow_with_rows(self):
+        """Test the list runs a single select, whatever the page size"""
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/invoices/')
+        self.assertEqual(len(response.data['results']), 5)
+    
+    def test_expand_items_prefetches(self):
+        """Test ?expand=items adds the items with a single extra query"""
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/invoices/?expand=items')
+        self.assertEqual(len(response.data['results'][0]['items']), 1)
+        self.assertNotIn('raw_extraction', response.data['results'][0])
+    
+    def test_sparse_fieldset(self):
+        """Test ?fields= returns only the requested fields"""
+        response = self.client.get('/api/invoices/?fields=id,status,raw_extraction,unknown')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'status', 'raw_extraction'})
+    
+    def test_cursor_pagination(self):
+        """Test walking the list with ?page_size= and the next links"""
+        response = self.client.get('/api/invoices/?page_size=2&fields=id')
+        ids = [invoice['id'] for invoice in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids += [invoice['id'] for invoice in response.data['results']]
+        
+        expected = list(Invoice.objects.order_by('-uploaded_at', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        self.assertNotIn('count', response.data)
+    
+    @override_settings(INVOICE_MAX_PAGE_SIZE=3)
+    def test_page_size_is_capped(self):
+        """Test ?page_size= cannot exceed INVOICE_MAX_PAGE_SIZE"""
+        response = self.client.get('/api/invoices/?page_size=1000')
+        self.assertEqual(len(response.data['results']), 3)
+    
+    def test_retrieve_keeps_full_serializer(self):
+        """Test the detail endpoint still returns items and raw_extraction"""
+        invoice = Invoice.objects.first()
+        response = self.client.get(f'/api/invoices/{invoice.id}/?fields=id')
+        self.assertIn('raw_extraction', response.data)
+        self.assertEqual(len(response.data['items']), 1)
+
+
+class InvoiceFilterAPITest(APITestCase):
+    """Test cases for the invoice list filters"""
+    
+    def setUp(self):
+        self.first = Invoice.objects.create(
+            original_filename='a.pdf', status='completed', vendor_cuit='30-71234567-1',
+            invoice_number='00002-00000123', invoice_date='2024-01-15', total_amount=Decimal('12100.00')
+        )
+        self.second = Invoice.objects.create(
+            original_filename='b.pdf', status='completed', vendor_cuit='20123456786',
+            invoice_date='2024-03-01', total_amount=Decimal('500.00')
+        )
+        self.failed = Invoice.objects.create(original_filename='c.pdf', status='failed')
+    
+    def get_ids(self, query):
+        response = self.client.get(f'/api/invoices/?fields=id&{query}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {invoice['id'] for invoice in response.data['results']}
+    
+    def test_filter_by_status(self):
+        """Test ?status="""
+        self.assertEqual(self.get_ids('status=failed'), {self.failed.id})
+    
+    def test_filter_by_cuit_in_any_format(self):
+        """Test ?vendor_cuit= matches CUITs stored with or without dashes"""
+        self.assertEqual(self.get_ids('vendor_cuit=30712345671'), {self.first.id})
+        self.assertEqual(self.get_ids('vendor_cuit=20-12345678-6'), {self.second.id})
+    
+    def test_filter_by_date_range_and_total(self):
+        """Test ?date_from=, ?date_to= and ?total_min="""
+        self.assertEqual(self.get_ids('date_from=2024-02-01'), {self.second.id})
+        self.assertEqual(self.get_ids('date_from=2024-01-01&date_to=2024-01-31'), {self.first.id})
+        self.assertEqual(self.get_ids('total_min=1000'), {self.first.id})
+        self.assertEqual(self.get_ids('invoice_number=00002-00000123'), {self.first.id})
+    
+    def test_invalid_filters(self):
+        """Test invalid filter values are rejected"""
+        for query in ('status=unknown', 'vendor_cuit=123', 'date_from=yesterday',
+                      'date_from=2024-02-01&date_to=2024-01-01', 'total_min=abc'):
+            response = self.client.get(f'/api/invoices/?{query}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+    
+    def test_filters_do_not_apply_to_detail(self):
+        """Test retrieving an invoice ignores list filters"""
+        response = self.client.get(f'/api/invoices/{self.first.id}/?status=failed')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class InvoiceExportAPITest(APITestCase):
+    """Test cases for the streaming export"""
+    
+    def setUp(self):
+        self.invoice = Invoice.objects.create(
+            original_filename='a.pdf', status='completed', vendor_cuit='30-71234567-1',
+            invoice_number='00002-00000123', invoice_date='2024-01-15', total_amount=Decimal('12100.00')
+        )
+        InvoiceItem.objects.create(
+            invoice=self.invoice, description='Producto, con coma', quantity=2,
+            unit_price=Decimal('50.00'), total_price=Decimal('100.00'), tax_rate=Decimal('21.00')
+        )
+        Invoice.objects.create(original_filename='b.pdf', status='failed')
+    
+    def export(self, query):
+        response = self.client.get(f'/api/invoices/export/?{query}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, b''.join(response.streaming_content)
+    
+    def test_export_csv_with_filters(self):
+        """Test the CSV export honours the list filters"""
+        response, content = self.export('format=csv&status=completed')
+        
+        rows = list(csv.DictReader(content.decode().splitlines()))
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('attachment; filename="invoices.csv"', response['Content-Disposition'])
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['invoice_number'], '00002-00000123')
+        self.assertEqual(rows[0]['total_amount'], '12100.00')
+    
+    def test_export_ndjson_items(self):
+        """Test exporting one NDJSON row per line item"""
+        response, content = self.export('format=ndjson&rows=items')
+        
+        rows = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['invoice_id'], self.invoice.id)
+        self.assertEqual(rows[0]['invoice_invoice_number'], '00002-00000123')
+        self.assertEqual(rows[0]['description'], 'Producto, con coma')
+        self.assertEqual(rows[0]['tax_rate'], '21.00')
+    
+    def test_export_runs_a_single_query(self):
+        """Test the export reads every row with one query, not one per invoice"""
+        for i in range(20):
+            Invoice.objects.create(original_filename=f'{i}.pdf', status='completed')
+        with self.assertNumQueries(1):
+            _, content = self.export('format=csv')
+        self.assertEqual(len(content.decode().splitlines()), 23)
+    
+    @skipUnless(PYARROW_AVAILABLE, 'pyarrow is not installed')
+    def test_export_parquet(self):
+        """Test the Parquet export keeps the column types"""
+        import pyarrow.parquet as pq
+        
+        _, content = self.export('format=parquet&status=completed')
+        
+        table = pq.read_table(BytesIO(content))
+        self.assertEqual(table.num_rows, 1)
+        self.assertEqual(table.column('total_amount')[0].as_py(), Decimal('12100.00'))
+        self.assertEqual(str(table.column('invoice_date')[0].as_py()), '2024-01-15')
+    
+    def test_export_invalid_parameters(self):
+        """Test unsupported formats, row types and filters are rejected"""
+        for query in ('format=xlsx', 'rows=customers', 'status=unknown'):
+            response = self.client.get(f'/api/invoices/export/?{query}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+
+class VendorAnalyticsTest(APITestCase):
+    """Test cases for the per vendor and month totals"""
+    
+    def complete(self, invoice=None, **fields):
+        invoice = invoice or Invoice.objects.create(original_filename='a.pdf', status='processing')
+        extracted = {
+            'vendor_cuit': '30-71234567-1', 'invoice_date': '15/01/2024', 'currency': 'ARS',
+            'subtotal': '$10.000,00', 'tax_amount': '$2.100,00', 'total_amount': '$12.100,00',
+            'items': [],
+        }
+        extracted.update(fields)
+        with self.captureOnCommitCallbacks(execute=True):
+            save_extraction(invoice, extracted, InvoiceExtractionService())
+        return invoice
+    
+    def summaries(self):
+        return list(VendorMonthlySummary.objects.order_by('month').values_list(
+            'vendor_cuit', 'month', 'invoice_count', 'total_amount'
+        ))
+    
+    def test_completed_invoices_update_their_bucket(self):
+        """Test totals accumulate per vendor and month, whatever the CUIT spelling"""
+        self.complete()
+        self.complete(vendor_cuit='30712345671', invoice_date='31/01/2024', total_amount='$100,00')
+        self.complete(invoice_date='01/02/2024')
+        
+        self.assertEqual(self.summaries(), [
+            ('30712345671', date(2024, 1, 1), 2, Decimal('12200.00')),
+            ('30712345671', date(2024, 2, 1), 1, Decimal('12100.00')),
+        ])
+    
+    def test_cuits_are_stored_formatted(self):
+        """Test a CUIT answered with extra text is summarized like the rebuild does"""
+        invoice = self.complete(vendor_cuit='CUIT 30712345671', customer_cuit='CUIT: 20-12345678-6')
+        
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.vendor_cuit, invoice.customer_cuit), ('30-71234567-1', '20-12345678-6'))
+        expected = self.summaries()
+        self.assertEqual(expected, [('30712345671', date(2024, 1, 1), 1, Decimal('12100.00'))])
+        rebuild_summaries()
+        self.assertEqual(self.summaries(), expected)
+    
+    def test_failed_summary_refresh_does_not_fail_the_extraction(self):
+        """Test an error refreshing the summaries is not raised by save_extraction"""
+        with mock.patch('invoice_extractor.analytics.refresh_summaries', side_effect=RuntimeError('race')):
+            invoice = self.complete()
+        
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.status, 'completed')
+    
+    def test_reprocess_moves_invoice_between_buckets(self):
+        """Test a reprocessed invoice leaves its old bucket"""
+        invoice = self.complete()
+        self.complete(invoice=Invoice.objects.get(pk=invoice.pk), invoice_date='10/03/2024')
+        
+        self.assertEqual(self.summaries(), [('30712345671', date(2024, 3, 1), 1, Decimal('12100.00'))])
+    
+    def test_api_edits_update_the_summaries(self):
+        """Test editing or deleting an invoice through the API refreshes its buckets"""
+        invoice = self.complete()
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/invoices/{invoice.pk}/', {'invoice_date': '2024-03-10'},
+                                         format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.summaries(), [('30712345671', date(2024, 3, 1), 1, Decimal('12100.00'))])
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(f'/api/invoices/{invoice.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.summaries(), [])
+    
+    def test_admin_edits_update_the_summaries(self):
+        """Test editing or deleting an invoice in the admin refreshes its buckets"""
+        invoice_admin = InvoiceAdmin(Invoice, AdminSite())
+        invoice = self.complete()
+        self.complete(invoice_date='01/02/2024')
+        
+        invoice.total_amount = Decimal('100.00')
+        invoice.vendor_cuit = '20-12345678-6'
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice_admin.save_model(None, invoice, None, change=True)
+        self.assertEqual(self.summaries(), [
+            ('20123456786', date(2024, 1, 1), 1, Decimal('100.00')),
+            ('30712345671', date(2024, 2, 1), 1, Decimal('12100.00')),
+        ])
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice_admin.delete_model(None, invoice)
+            invoice_admin.delete_queryset(None, Invoice.objects.all())
+        self.assertEqual(self.summaries(), [])
+    
+    def test_rebuild_command(self):
+        """Test the rebuild command recomputes the table from the invoices"""
+        self.complete()
+        self.complete(vendor_cuit='30712345671', currency='USD')
+        expected = self.summaries()
+        VendorMonthlySummary.objects.all().delete()
+        Invoice.objects.create(original_filename='b.pdf', status='failed', vendor_cuit='30712345671',
+                               invoice_date='2024-01-20', total_amount=Decimal('1.00'))
+        
+        call_command('rebuild_vendor_summaries', stdout=StringIO())
+        
+        self.assertEqual(self.summaries(), expected)
+        self.assertEqual(VendorMonthlySummary.objects.count(), 2)
+    
+    def test_analytics_endpoint(self):
+        """Test the analytics endpoint filters by vendor, month and currency"""
+        self.complete()
+        self.complete(invoice_date='01/02/2024')
+        self.complete(vendor_cuit='20123456786')
+        
+        response = self.client.get('/api/invoices/analytics/?vendor_cuit=30-71234567-1&month_from=2024-02')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['month'], '2024-02')
+        self.assertEqual(response.data[0]['total_amount'], '12100.00')
+        self.assertEqual(self.client.get('/api/invoices/analytics/?vendor_cuit=1').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+
 class InvoiceExtractionServiceTest(TestCase):
     """Test cases for InvoiceExtractionService"""
     
@@ -113,3 +577,1098 @@ class InvoiceExtractionServiceTest(TestCase):
         self.assertEqual(service.parse_date('2024-01-15'), '2024-01-15')
         self.assertIsNone(service.parse_date('invalid'))
         self.assertIsNone(service.parse_date(None))
+
+    def test_structured_extraction_single_call(self):
+        """Test that a complete structured answer needs no per-field queries"""
+        service = InvoiceExtractionService(extraction_mode='structured')
+        invoice = ArgentineInvoice(
+            invoice_number='0001-00001234',
+            invoice_date='15/01/2024',
+            vendor_name='Empresa Ejemplo S.A.',
+            vendor_cuit='30-12345678-9',
+            vendor_address='Av. Siempreviva 742',
+            customer_name='Cliente Ejemplo',
+            customer_cuit='20-12345678-6',
+            customer_address='Calle Falsa 123',
+            subtotal='$10.000,00',
+            tax_amount='$2.100,00',
+            total_amount='$12.100,00',
+            currency='ARS',
+            payment_terms='Contado',
+            items=[InvoiceLineItem(description='Producto', quantity=1, total_price=10000)],
+        )
+        structured_engine = FakeQueryEngine(default=invoice)
+        query_engine = FakeQueryEngine()
+        
+        fields = service._query_structured_fields(structured_engine, query_engine)
+        
+        self.assertEqual(len(structured_engine.queries), 1)
+        self.assertEqual(query_engine.queries, [])
+        self.assertEqual(fields['invoice_number'], '0001-00001234')
+        self.assertEqual(fields['items'], [
+            {'description': 'Producto', 'quantity': 1.0, 'total_price': 10000.0}
+        ])
+    
+    def test_structured_extraction_falls_back_for_invalid_fields(self):
+        """Test that missing or unparseable fields are queried one by one"""
+        service = InvoiceExtractionService(extraction_mode='structured')
+        invoice = ArgentineInvoice(
+            invoice_number='0001-00001234',
+            invoice_date='not a date',
+            total_amount='$12.100,00',
+        )
+        structured_engine = FakeQueryEngine(default=invoice)
+        query_engine = FakeQueryEngine(
+            answers={FIELD_QUERIES['invoice_date']: '15/01/2024'}
+        )
+        
+        fields = service._query_structured_fields(structured_engine, query_engine)
+        
+        self.assertNotIn(FIELD_QUERIES['invoice_number'], query_engine.queries)
+        self.assertNotIn(FIELD_QUERIES['total_amount'], query_engine.queries)
+        self.assertIn(FIELD_QUERIES['subtotal'], query_engine.queries)
+        self.assertEqual(fields['invoice_date'], '15/01/2024')
+        self.assertIsNone(fields['subtotal'])
+    
+    def test_fields_to_repair(self):
+        """Test that missing, unparseable, bad CUIT and mismatched total fields are repaired"""
+        service = InvoiceExtractionService()
+        self.assertEqual(service.fields_to_repair(COMPLETE_EXTRACTION), [])
+        
+        fields = dict(COMPLETE_EXTRACTION, invoice_number=None, invoice_date='soon', customer_cuit='20-12345678-0')
+        self.assertEqual(service.fields_to_repair(fields), ['invoice_number', 'invoice_date', 'customer_cuit'])
+        
+        fields = dict(COMPLETE_EXTRACTION, total_amount='$11.000,00')
+        self.assertEqual(service.fields_to_repair(fields), ['subtotal', 'tax_amount', 'total_amount'])
+        
+        # A total above subtotal + IVA includes other taxes, e.g. a 3% percepcion de IIBB
+        fields = dict(COMPLETE_EXTRACTION, total_amount='$12.400,00')
+        self.assertEqual(service.fields_to_repair(fields), [])
+    
+    def test_repair_queries_only_the_invalid_fields(self):
+        """Test that reprocessing re-queries only the invalid fields and keeps the rest"""
+        service = InvoiceExtractionService()
+        extracted = dict(COMPLETE_EXTRACTION, vendor_cuit='30-71234567-0', invoice_date='soon')
+        query_engine = FakeQueryEngine(answers={
+            FIELD_QUERIES['invoice_date']: '15/01/2024',
+            FIELD_QUERIES['vendor_cuit']: '30-71234567-1',
+        })
+        loaded = LoadedDocument([SimpleNamespace(text='FACTURA A')], [], None)
+        
+        with mock.patch('invoice_extractor.services.LLAMAINDEX_AVAILABLE', True), \
+                mock.patch.object(service.document_loader, 'load', return_value=loaded), \
+                mock.patch.object(service, '_build_query_engines', return_value=(query_engine, None)):
+            result = service.repair_invoice_data('factura.pdf', extracted, content_hash='0' * 64)
+        
+        self.assertTrue(result['success'])
+        self.assertEqual(result['repaired_fields'], ['invoice_date', 'vendor_cuit'])
+        self.assertCountEqual(query_engine.queries, [FIELD_QUERIES['vendor_cuit'], FIELD_QUERIES['invoice_date']])
+        self.assertEqual(result['data'], dict(extracted, vendor_cuit='30-71234567-1', invoice_date='15/01/2024'))
+        self.assertEqual(service.repair_invoice_data('factura.pdf', result['data'])['repaired_fields'], [])
+    
+    def test_small_documents_skip_the_vector_index(self):
+        """Test that short documents are queried with the direct context engine"""
+        service = InvoiceExtractionService()
+        documents = [
+            SimpleNamespace(text='FACTURA A Nro 0001-00001234'),
+            SimpleNamespace(text='Total: $12.100,00'),
+        ]
+        
+        query_engine, structured_engine = service._build_query_engines(documents)
+        
+        self.assertIsInstance(query_engine, DirectContextQueryEngine)
+        self.assertIsInstance(structured_engine, DirectContextQueryEngine)
+        self.assertIs(structured_engine.output_cls, ArgentineInvoice)
+        self.assertIn('Total: $12.100,00', query_engine.context)
+    
+    def test_direct_context_query_sends_document_text(self):
+        """Test that the direct context engine prompts with the document text"""
+        prompts = []
+        llm = SimpleNamespace(complete=lambda prompt: prompts.append(prompt) or '0001-00001234')
+        engine = DirectContextQueryEngine('FACTURA A Nro 0001-00001234', llm=llm)
+        
+        response = engine.query(FIELD_QUERIES['invoice_number'])
+        
+        self.assertEqual(response, '0001-00001234')
+        self.assertIn('FACTURA A Nro 0001-00001234', prompts[0])
+        self.assertIn(FIELD_QUERIES['invoice_number'], prompts[0])
+    
+    @override_settings(LLAMAINDEX_QUERY_CONCURRENCY=4, LLAMAINDEX_QUERY_TIMEOUT=5)
+    def test_per_field_queries_run_concurrently(self):
+        """Test that per-field queries overlap, bounded by the concurrency limit"""
+        service = InvoiceExtractionService(extraction_mode='per_field')
+        engine = SlowQueryEngine(delay=0.05)
+        
+        start = time.monotonic()
+        fields = service._query_fields(engine)
+        elapsed = time.monotonic() - start
+        
+        self.assertEqual(engine.max_in_flight, 4)
+        self.assertLess(elapsed, 0.05 * (len(FIELD_QUERIES) + 1))
+        self.assertEqual(fields['invoice_number'], 'answer')
+        self.assertEqual(fields['items'], [{'description': 'answer'}])
+    
+    @override_settings(LLAMAINDEX_QUERY_CONCURRENCY=8, LLAMAINDEX_QUERY_TIMEOUT=0.2)
+    def test_per_field_query_timeout(self):
+        """Test that a query exceeding the timeout leaves only its field empty"""
+        service = InvoiceExtractionService(extraction_mode='per_field')
+        engine = SlowQueryEngine(
+            delay=0.01, slow_queries=(FIELD_QUERIES['payment_terms'], LINE_ITEMS_QUERY)
+        )
+        
+        fields = service._query_fields(engine)
+        
+        self.assertIsNone(fields['payment_terms'])
+        self.assertEqual(fields['items'], [])
+        self.assertEqual(fields['total_amount'], 'answer')
+    
+    def test_parse_line_items_json(self):
+        """Test reading line items from a JSON answer, deriving missing totals"""
+        service = InvoiceExtractionService()
+        response = FakeResponse(
+            '```json\n[{"description": "Tornillos", "quantity": "100", "unit_price": "$ 1.234,50", '
+            '"total_price": null, "tax_rate": "21%", "product_code": "T-10"}, {"quantity": 1}]\n```'
+        )
+        
+        self.assertEqual(service._parse_line_items(response), [{
+            'description': 'Tornillos', 'quantity': 100.0, 'unit_price': 1234.5,
+            'total_price': 123450.0, 'tax_rate': 21.0, 'product_code': 'T-10',
+        }])
+    
+    def test_parse_line_items_text(self):
+        """Test reading line items from "label: value" lines"""
+        service = InvoiceExtractionService()
+        response = FakeResponse(
+            'Items:\n'
+            '1. Descripción: Servicio de consultoría, Cantidad: 2, Precio unitario: $ 5.000,00, Total: $ 10.000,00\n'
+            '2. Description: Soporte, Quantity: 4, Total: 100.50, IVA: 10,5'
+        )
+        
+        items = service._parse_line_items(response)
+        
+        self.assertEqual([item['description'] for item in items], ['Servicio de consultoría', 'Soporte'])
+        self.assertEqual(items[0]['unit_price'], 5000.0)
+        self.assertEqual(items[0]['total_price'], 10000.0)
+        self.assertEqual(items[1]['unit_price'], 25.12)
+        self.assertEqual(items[1]['tax_rate'], 10.5)
+
+
+class ExtractionCacheTest(TestCase):
+    """Test cases for the extraction result cache"""
+    
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.file_path = os.path.join(self.tmp_dir.name, 'invoice.pdf')
+        with open(self.file_path, 'wb') as f:
+            f.write(b'%PDF-1.4 factura')
+    
+    def test_duplicate_document_is_served_from_cache(self):
+        """Test that the second extraction of the same bytes skips the pipeline"""
+        result = {'success': True, 'data': {'invoice_number': '0001-00001234'}}
+        cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+        
+        with override_settings(EXTRACTION_CACHE={'BACKEND': 'disk', 'LOCATION': cache_dir}):
+            service = InvoiceExtractionService()
+            with mock.patch.object(service, '_extract_invoice_data', return_value=result) as extract:
+                self.assertEqual(service.extract_invoice_data(self.file_path), result)
+                self.assertEqual(service.extract_invoice_data(self.file_path), result)
+                self.assertEqual(extract.call_count, 1)
+                
+                service.extract_invoice_data(self.file_path, use_cache=False)
+                self.assertEqual(extract.call_count, 2)
+            
+            self.assertEqual(get_extraction_cache().stats(), {'hits': 1, 'misses': 1})
+    
+    def test_failed_extractions_are_not_cached(self):
+        """Test that failures are retried on the next upload"""
+        result = {'success': False, 'error': 'boom'}
+        
+        with override_settings(EXTRACTION_CACHE={'BACKEND': 'db'}):
+            service = InvoiceExtractionService()
+            with mock.patch.object(service, '_extract_invoice_data', return_value=result) as extract:
+                service.extract_invoice_data(self.file_path)
+                service.extract_invoice_data(self.file_path)
+                self.assertEqual(extract.call_count, 2)
+    
+    def test_disk_cache_ttl_and_lru_eviction(self):
+        """Test that the disk backend expires old entries and evicts the least recently used"""
+        cache = DiskExtractionCache(location=self.tmp_dir.name, ttl=60, max_entries=2)
+        cache.set('a', {'value': 'a'})
+        cache.set('b', {'value': 'b'})
+        
+        # Make 'b' the least recently used entry
+        old = time.time() - 30
+        os.utime(cache._path('b'), (old, old))
+        cache.set('c', {'value': 'c'})
+        
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), {'value': 'a'})
+        
+        expired = time.time() - 120
+        os.utime(cache._path('a'), (expired, expired))
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 2})
+    
+    def test_disk_cache_scans_only_when_over_max_entries(self):
+        """Test that the disk backend does not list the directory on every set"""
+        cache = DiskExtractionCache(location=self.tmp_dir.name, max_entries=6)
+        with mock.patch.object(cache, '_entries', wraps=cache._entries) as entries:
+            for key in 'abcdef':
+                cache.set(key, {'value': key})
+                cache.set(key, {'value': key})
+            self.assertEqual(entries.call_count, 1)
+            
+            cache.set('g', {'value': 'g'})
+            self.assertEqual(entries.call_count, 2)
+        
+        self.assertEqual(len(cache._entries()), 5)
+        self.assertEqual(list(cache.location.glob('*/*.tmp')), [])
+    
+    def test_disk_cache_entry_removed_while_reading_is_a_miss(self):
+        """Test that an entry deleted by another process is treated as a miss"""
+        cache = DiskExtractionCache(location=self.tmp_dir.name)
+        cache.set('a', {'value': 'a'})
+        
+        with mock.patch('invoice_extractor.cache.os.utime', side_effect=FileNotFoundError):
+            self.assertIsNone(cache.get('a'))
+    
+    def test_db_cache_lru_eviction(self):
+        """Test that the database backend keeps at most max_entries rows"""
+        cache = DatabaseExtractionCache(ttl=60, max_entries=2)
+        for key in ('a', 'b', 'c'):
+            cache.set(key, {'value': key})
+        
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), {'value': 'c'})
+
+
+COMPLETE_EXTRACTION = {
+    'invoice_number': '0001-00001234',
+    'invoice_date': '15/01/2024',
+    'vendor_name': 'Empresa Ejemplo S.A.',
+    'vendor_cuit': '30-71234567-1',
+    'vendor_address': 'Av. Corrientes 1234, CABA',
+    'customer_name': 'Cliente S.R.L.',
+    'customer_cuit': '20-12345678-6',
+    'customer_address': 'Av. Santa Fe 4321, CABA',
+    'subtotal': '$10.000,00',
+    'tax_amount': '$2.100,00',
+    'total_amount': '$12.100,00',
+    'payment_terms': 'Contado',
+    'currency': 'ARS',
+    'items': [{'description': 'Producto', 'quantity': 1.0, 'total_price': 10000.0}],
+}
+
+EXTRACTED_INVOICE = {
+    'success': True,
+    'data': {
+        'invoice_number': '0001-00001234',
+        'invoice_date': '15/01/2024',
+        'vendor_name': 'Empresa Ejemplo S.A.',
+        'vendor_cuit': '30-12345678-9',
+        'total_amount': '$12.100,00',
+        'currency': 'ARS',
+        'items': [],
+    },
+}
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), EXTRACTION_CACHE={})
+class ExtractionJobQueueTest(APITestCase):
+    """Test cases for the extraction job queue"""
+    
+    def upload(self):
+        test_file = SimpleUploadedFile(
+            'factura.pdf',
+            b'%PDF-1.4 factura',
+            content_type='application/pdf'
+        )
+        return self.client.post(
+            '/api/invoices/process/',
+            {'document': test_file},
+            format='multipart'
+        )
+    
+    def test_upload_queues_invoice(self):
+        """Test that upload returns 202 with a pending invoice and a queued job"""
+        response = self.upload()
+        
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], 'pending')
+        invoice = Invoice.objects.get(pk=response.data['id'])
+        self.assertEqual(invoice.status, 'pending')
+        self.assertEqual(invoice.jobs.get().status, 'queued')
+        self.assertTrue(response.data['status_url'].endswith(f'/api/invoices/{invoice.id}/status/'))
+    
+    @mock.patch('invoice_extractor.jobs.InvoiceExtractionService.extract_invoice_data',
+                return_value=EXTRACTED_INVOICE)
+    def test_worker_processes_queued_invoice(self, extract):
+        """Test that a worker completes the job and the status endpoint reports it"""
+        invoice_id = self.upload().data['id']
+        
+        job = run_next_job('test-worker')
+        
+        self.assertEqual(job.status, 'completed')
+        self.assertIsNone(run_next_job('test-worker'))
+        invoice = Invoice.objects.get(pk=invoice_id)
+        self.assertEqual(invoice.status, 'completed')
+        self.assertEqual(invoice.total_amount, Decimal('12100.00'))
+        
+        response = self.client.get(f'/api/invoices/{invoice_id}/status/')
+        self.assertEqual(response.data['status'], 'completed')
+        self.assertEqual(response.data['job'], {'status': 'completed', 'attempts': 1})
+    
+    @override_settings(EXTRACTION_JOB_MAX_ATTEMPTS=2)
+    def test_stale_jobs_are_requeued_until_max_attempts(self):
+        """Test that jobs of a dead worker are requeued, or failed after the last attempt"""
+        for _ in range(2):
+            self.upload()
+        started_at = timezone.now() - timedelta(hours=1)
+        first, last = ExtractionJob.objects.order_by('id')
+        ExtractionJob.objects.filter(pk=first.pk).update(status='running', attempts=1, started_at=started_at)
+        ExtractionJob.objects.filter(pk=last.pk).update(status='running', attempts=2, started_at=started_at)
+        
+        self.assertEqual(requeue_stale_jobs(), 1)
+        
+        first.refresh_from_db()
+        last.refresh_from_db()
+        self.assertEqual(first.status, 'queued')
+        self.assertEqual(last.status, 'failed')
+        self.assertEqual(last.invoice.status, 'failed')
+        self.assertEqual(last.invoice.events.last().stage, 'failed')
+        self.assertEqual(requeue_stale_jobs(), 0)
+    
+    @mock.patch('invoice_extractor.jobs.InvoiceExtractionService.extract_invoice_data',
+                return_value=EXTRACTED_INVOICE)
+    def test_result_of_a_run_taken_over_is_not_recorded(self, extract):
+        """Test that a run requeued as stale does not overwrite the job of the next run"""
+        self.upload()
+        job = claim_next_job('slow-worker')
+        ExtractionJob.objects.filter(pk=job.pk).update(status='running', worker='other-worker')
+        
+        run_job(job)
+        
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker), ('running', 'other-worker'))
+    
+    def test_worker_survives_database_errors(self):
+        """Test that an error running a job is logged and the worker keeps polling"""
+        calls = []
+        
+        def run_next_job(worker_id):
+            calls.append(worker_id)
+            if len(calls) == 1:
+                raise RuntimeError('database is locked')
+            return None
+        
+        with mock.patch('invoice_extractor.management.commands.run_extraction_worker.run_next_job',
+                        side_effect=run_next_job), \
+                self.assertLogs('invoice_extractor.management.commands.run_extraction_worker', 'ERROR'):
+            call_command('run_extraction_worker', concurrency=1, once=True, poll_interval=0, stdout=StringIO())
+        
+        self.assertEqual(len(calls), 2)
+    
+    def test_duplicate_upload_shares_stored_document(self):
+        """Test that uploading the same document twice stores it once"""
+        first = Invoice.objects.get(pk=self.upload().data['id'])
+        response = self.upload()
+        second = Invoice.objects.get(pk=response.data['id'])
+        
+        digest = hashlib.sha256(b'%PDF-1.4 factura').hexdigest()
+        self.assertEqual(response.data['duplicate_of'], first.id)
+        self.assertEqual(first.content_hash, digest)
+        self.assertEqual(second.document.name, first.document.name)
+        self.assertEqual(first.document.name, f'invoices/{digest[:2]}/{digest[2:4]}/{digest}.pdf')
+        self.assertEqual(os.listdir(os.path.dirname(first.document.path)), [f'{digest}.pdf'])
+    
+    def test_upload_is_hashed_while_streaming(self):
+        """Test that the upload handler hashes the document and moves it into place"""
+        with mock.patch('invoice_extractor.storage.hashlib') as storage_hashlib:
+            invoice = Invoice.objects.get(pk=self.upload().data['id'])
+        
+        storage_hashlib.sha256.assert_not_called()
+        digest = hashlib.sha256(b'%PDF-1.4 factura').hexdigest()
+        self.assertEqual(invoice.content_hash, digest)
+        with invoice.document.open('rb') as stored:
+            self.assertEqual(stored.read(), b'%PDF-1.4 factura')
+        incoming = str(settings.MEDIA_ROOT) + '-incoming'
+        self.assertEqual(os.listdir(incoming), [])
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, 'invoices', '.incoming')))
+    
+    def test_upload_rejects_content_not_matching_extension(self):
+        """Test that a file is rejected when its magic bytes do not match its extension"""
+        png = SimpleUploadedFile('factura.pdf', b'\x89PNG\r\n\x1a\n' + b'\x00' * 32, content_type='application/pdf')
+        docx = SimpleUploadedFile('factura.docx', self.make_zip({'notes.txt': b'hola'}), content_type='application/octet-stream')
+        
+        for document in (png, docx):
+            response = self.client.post('/api/invoices/process/', {'document': document}, format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('File content is not a valid', response.data['document'][0])
+        self.assertFalse(Invoice.objects.exists())
+    
+    def test_oversized_upload_is_rejected(self):
+        """Test that the upload handler stops writing a document past the size limit"""
+        with mock.patch('invoice_extractor.uploads.MAX_DOCUMENT_SIZE', 1024), \
+             mock.patch('invoice_extractor.serializers.MAX_DOCUMENT_SIZE', 1024):
+            document = SimpleUploadedFile('factura.pdf', b'%PDF-1.4' + b'0' * 4096, content_type='application/pdf')
+            response = self.client.post('/api/invoices/process/', {'document': document}, format='multipart')
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Invoice.objects.exists())
+    
+    def make_zip(self, members):
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            for name, content in members.items():
+                archive.writestr(name, content)
+        return buffer.getvalue()
+    
+    @override_settings(INVOICE_REUSE_DUPLICATE_EXTRACTION=True)
+    @mock.patch('invoice_extractor.jobs.InvoiceExtractionService.extract_invoice_data',
+                return_value=EXTRACTED_INVOICE)
+    def test_duplicate_upload_reuses_extraction(self, extract):
+        """Test that a duplicate of a completed invoice is not extracted again"""
+        first_id = self.upload().data['id']
+        run_next_job()
+        
+        response = self.upload()
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['duplicate_of'], first_id)
+        self.assertEqual(response.data['data']['total_amount'], '12100.00')
+        self.assertEqual(extract.call_count, 1)
+        self.assertFalse(ExtractionJob.objects.filter(invoice_id=response.data['id']).exists())
+    
+    def test_save_extraction_bulk_creates_items(self):
+        """Test that line items replace the previous ones in a single INSERT"""
+        invoice = Invoice.objects.create(original_filename='a.pdf')
+        InvoiceItem.objects.create(
+            invoice=invoice, description='Old', quantity=1,
+            unit_price=Decimal('1.00'), total_price=Decimal('1.00')
+        )
+        extracted = dict(EXTRACTED_INVOICE['data'], items=[
+            {'description': f'Producto {i}', 'quantity': 2, 'unit_price': 10.005,
+             'total_price': 20.01, 'tax_rate': 21, 'product_code': f'P{i}'}
+            for i in range(100)
+        ])
+        
+        with CaptureQueriesContext(connection) as queries:
+            save_extraction(invoice, extracted, InvoiceExtractionService())
+        
+        inserts = [q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "invoice_extractor_invoiceitem"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(invoice.items.count(), 100)
+        item = invoice.items.first()
+        self.assertEqual(item.unit_price, Decimal('10.01'))
+        self.assertEqual(item.tax_rate, Decimal('21.00'))
+        self.assertEqual(item.product_code, 'P0')
+        self.assertEqual(invoice.status, 'completed')
+    
+    @override_settings(EXTRACTION_JOB_MAX_ATTEMPTS=2)
+    @mock.patch('invoice_extractor.jobs.InvoiceExtractionService.extract_invoice_data',
+                return_value={'success': False, 'error': 'LLM unavailable'})
+    def test_failed_jobs_are_retried(self, extract):
+        """Test that failing jobs are requeued until the attempt limit"""
+        invoice_id = self.upload().data['id']
+        
+        self.assertEqual(run_next_job().status, 'queued')
+        self.assertEqual(Invoice.objects.get(pk=invoice_id).status, 'pending')
+        self.assertEqual(run_next_job().status, 'failed')
+        self.assertEqual(Invoice.objects.get(pk=invoice_id).status, 'failed')
+        self.assertIsNone(claim_next_job())
+    
+    def test_claimed_job_is_not_claimed_twice(self):
+        """Test that two workers never get the same job"""
+        invoice = Invoice.objects.create(original_filename='a.pdf')
+        enqueue_extraction(invoice)
+        
+        self.assertIsNotNone(claim_next_job('worker-1'))
+        self.assertIsNone(claim_next_job('worker-2'))
+    
+    @override_settings(INVOICE_PROCESSING_ASYNC=False)
+    @mock.patch('invoice_extractor.jobs.InvoiceExtractionService.extract_invoice_data',
+                return_value=EXTRACTED_INVOICE)
+    def test_synchronous_processing(self, extract):
+        """Test that upload processes the document inline when async processing is off"""
+        response = self.upload()
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['data']['invoice_number'], '0001-00001234')
+        self.assertEqual(ExtractionJob.objects.get().status, 'completed')
+    
+    @override_settings(INVOICE_PROCESSING_ASYNC=False)
+    @mock.patch('invoice_extractor.jobs.InvoiceExtractionService.extract_invoice_data',
+                return_value={'success': False, 'error': 'LLM unavailable'})
+    def test_synchronous_processing_runs_once(self, extract):
+        """Test that an inline extraction is never queued and is not retried in the request"""
+        with mock.patch('invoice_extractor.jobs.ExtractionJob.objects.create',
+                        wraps=ExtractionJob.objects.create) as create:
+            response = self.upload()
+        
+        self.assertEqual(create.call_args.kwargs['status'], 'running')
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(extract.call_count, 1)
+        job = ExtractionJob.objects.get()
+        self.assertEqual((job.status, job.attempts), ('failed', 1))
+        self.assertIsNone(run_next_job('test-worker'))
+    
+    @mock.patch('invoice_extractor.jobs.InvoiceExtractionService.extract_invoice_data',
+                return_value=EXTRACTED_INVOICE)
+    def test_progress_events_stream(self, extract):
+        """Test that the stages of an extraction are streamed as Server-Sent Events"""
+        invoice_id = self.upload().data['id']
+        run_next_job('test-worker')
+        
+        response = self.client.get(f'/api/invoices/{invoice_id}/events/', HTTP_ACCEPT='text/event-stream')
+        
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        messages = [
+            dict(line.split(': ', 1) for line in block.splitlines())
+            for block in b''.join(response.streaming_content).decode().split('\n\n')
+            if block.startswith('id:')
+        ]
+        self.assertEqual(
+            [message['event'] for message in messages],
+            ['uploaded', 'processing', 'items_saved', 'completed']
+        )
+        self.assertEqual(json.loads(messages[2]['data'])['count'], 0)
+        
+        # Resuming after the processing event only sends the later ones
+        response = self.client.get(
+            f'/api/invoices/{invoice_id}/events/', HTTP_LAST_EVENT_ID=messages[1]['id']
+        )
+        content = b''.join(response.streaming_content).decode()
+        self.assertNotIn('event: processing', content)
+        self.assertIn('event: completed', content)
+        self.assertEqual(
+            self.client.get('/api/invoices/999/events/', HTTP_ACCEPT='text/event-stream').status_code, 404
+        )
+    
+    def test_events_stream_replays_only_the_last_run(self):
+        """Test that a reprocessed invoice's stream starts after the previous run"""
+        invoice = Invoice.objects.create(original_filename='a.pdf', status='completed')
+        for stage in ('uploaded', 'completed', 'processing', 'completed'):
+            InvoiceEvent.objects.create(invoice=invoice, stage=stage)
+        
+        response = self.client.get(f'/api/invoices/{invoice.pk}/events/', HTTP_ACCEPT='text/event-stream')
+        
+        content = b''.join(response.streaming_content).decode()
+        self.assertEqual(re.findall(r'event: (\w+)', content), ['processing', 'completed'])
+    
+    def test_prune_events_of_finished_runs(self):
+        """Test that only the events of runs finished before the retention are deleted"""
+        reprocessed, retrying, recent = (
+            Invoice.objects.create(original_filename=f'{name}.pdf') for name in ('a', 'b', 'c')
+        )
+        old_events = [
+            InvoiceEvent.objects.create(invoice=reprocessed, stage='uploaded'),
+            InvoiceEvent.objects.create(invoice=reprocessed, stage='completed'),
+            InvoiceEvent.objects.create(invoice=retrying, stage='failed', data={'retrying': True}),
+            InvoiceEvent.objects.create(invoice=retrying, stage='processing'),
+        ]
+        InvoiceEvent.objects.filter(pk__in=[event.pk for event in old_events]).update(
+            created_at=timezone.now() - timedelta(days=2)
+        )
+        InvoiceEvent.objects.create(invoice=reprocessed, stage='processing')
+        InvoiceEvent.objects.create(invoice=recent, stage='completed')
+        
+        out = StringIO()
+        call_command('prune_invoice_events', stdout=out)
+        
+        self.assertIn('Deleted 2 invoice events', out.getvalue())
+        self.assertEqual(
+            list(InvoiceEvent.objects.values_list('invoice__original_filename', 'stage')),
+            [('b.pdf', 'failed'), ('b.pdf', 'processing'), ('a.pdf', 'processing'), ('c.pdf', 'completed')]
+        )
+    
+    @mock.patch('invoice_extractor.jobs.InvoiceExtractionService.extract_invoice_data',
+                return_value=EXTRACTED_INVOICE)
+    def test_reprocess_repairs_the_previous_extraction(self, extract):
+        """Test that reprocessing repairs the previous extraction unless refreshed"""
+        invoice_id = self.upload().data['id']
+        run_next_job()
+        repaired = {'success': True, 'data': EXTRACTED_INVOICE['data'], 'repaired_fields': ['subtotal']}
+        
+        with mock.patch('invoice_extractor.jobs.InvoiceExtractionService.repair_invoice_data',
+                        return_value=repaired) as repair:
+            response = self.client.get(f'/api/invoices/{invoice_id}/reprocess/')
+            refreshed = self.client.get(f'/api/invoices/{invoice_id}/reprocess/?refresh=true')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['repaired_fields'], ['subtotal'])
+        self.assertEqual(repair.call_count, 1)
+        self.assertEqual(refreshed.status_code, status.HTTP_200_OK)
+        self.assertNotIn('repaired_fields', refreshed.data)
+        self.assertEqual(extract.call_args.kwargs['use_cache'], False)
+        self.assertEqual(Invoice.objects.get(pk=invoice_id).status, 'completed')
+    
+    @mock.patch('invoice_extractor.jobs.InvoiceExtractionService.aextract_invoice_data',
+                new_callable=mock.AsyncMock, return_value=EXTRACTED_INVOICE)
+    def test_async_process_and_reprocess(self, aextract):
+        """Test the async views extract inline through aextract_invoice_data"""
+        test_file = SimpleUploadedFile('factura.pdf', b'%PDF-1.4 factura', content_type='application/pdf')
+        response = self.client.post('/api/invoices/process/async/', {'document': test_file}, format='multipart')
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['data']['invoice_number'], '0001-00001234')
+        self.assertEqual(ExtractionJob.objects.get().status, 'completed')
+        
+        aextract.return_value = {'success': False, 'error': 'LLM unavailable'}
+        test_file = SimpleUploadedFile('factura2.pdf', b'%PDF-1.4 factura 2', content_type='application/pdf')
+        failed = self.client.post('/api/invoices/process/async/', {'document': test_file}, format='multipart')
+        self.assertEqual(failed.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(ExtractionJob.objects.get(invoice_id=failed.json()['id']).status, 'failed')
+        self.assertIsNone(run_next_job('test-worker'))
+        aextract.return_value = EXTRACTED_INVOICE
+        
+        invoice_id = response.json()['id']
+        response = self.client.get(f'/api/invoices/{invoice_id}/reprocess/async/?refresh=true')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['data']['total_amount'], '12100.00')
+        self.assertEqual(aextract.call_args.kwargs['use_cache'], False)
+        self.assertEqual(self.client.get('/api/invoices/999/reprocess/async/').status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), EXTRACTION_CACHE={})
+class InvoiceBatchUploadTest(APITestCase):
+    """Test cases for the batch upload endpoint"""
+    
+    def make_zip(self, members):
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            for name, content in members.items():
+                archive.writestr(name, content)
+        return SimpleUploadedFile('facturas.zip', buffer.getvalue(), content_type='application/zip')
+    
+    def test_batch_upload_with_files_and_zip(self):
+        """Test that files and ZIP members are queued as one batch"""
+        archive = self.make_zip({
+            'enero/factura2.pdf': b'%PDF-1.4 factura 2',
+            'enero/LEEME.txt': b'not an invoice',
+        })
+        documents = [
+            SimpleUploadedFile('factura1.pdf', b'%PDF-1.4 factura 1', content_type='application/pdf'),
+            archive,
+        ]
+        
+        response = self.client.post(
+            '/api/invoices/batch/', {'documents': documents}, format='multipart'
+        )
+        
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual([s['name'] for s in response.data['skipped']], ['enero/LEEME.txt'])
+        invoices = Invoice.objects.filter(batch_id=response.data['batch_id'])
+        self.assertEqual(
+            sorted(invoices.values_list('original_filename', flat=True)),
+            ['factura1.pdf', 'factura2.pdf']
+        )
+        self.assertEqual(ExtractionJob.objects.filter(invoice__in=invoices, status='queued').count(), 2)
+        member = invoices.get(original_filename='factura2.pdf')
+        with member.document.open('rb') as document:
+            self.assertEqual(document.read(), b'%PDF-1.4 factura 2')
+        self.assertEqual(member.content_hash, hashlib.sha256(b'%PDF-1.4 factura 2').hexdigest())
+    
+    @mock.patch('invoice_extractor.jobs.InvoiceExtractionService.extract_invoice_data',
+                return_value=EXTRACTED_INVOICE)
+    def test_batch_progress(self, extract):
+        """Test the aggregate progress counts of a batch"""
+        documents = [
+            SimpleUploadedFile(f'factura{i}.pdf', b'%PDF-1.4', content_type='application/pdf')
+            for i in range(3)
+        ]
+        batch_id = self.client.post(
+            '/api/invoices/batch/', {'documents': documents}, format='multipart'
+        ).data['batch_id']
+        run_next_job()
+        
+        response = self.client.get(f'/api/invoices/batch/{batch_id}/')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total'], 3)
+        self.assertEqual(response.data['completed'], 1)
+        self.assertEqual(response.data['pending'], 2)
+        self.assertFalse(response.data['finished'])
+    
+    def test_batch_limits_are_checked_before_decompressing(self):
+        """Test that a batch over the file or uncompressed size limit is rejected unread"""
+        archive = self.make_zip({f'factura{i}.pdf': b'%PDF-1.4 ' + b'0' * 200 for i in range(3)})
+        
+        for limits in ({'INVOICE_BATCH_MAX_FILES': 2}, {'INVOICE_BATCH_MAX_UNCOMPRESSED_SIZE': 500}):
+            archive.seek(0)
+            with self.subTest(**limits), override_settings(**limits), \
+                    mock.patch.object(zipfile.ZipFile, 'open', side_effect=AssertionError('decompressed')):
+                response = self.client.post(
+                    '/api/invoices/batch/', {'documents': [archive]}, format='multipart'
+                )
+            
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('at most', response.data['documents'][0])
+        self.assertFalse(Invoice.objects.exists())
+    
+    def test_batch_upload_rejects_invalid_file(self):
+        """Test that an unsupported file outside a ZIP rejects the batch"""
+        documents = [SimpleUploadedFile('notes.txt', b'hello', content_type='text/plain')]
+        
+        response = self.client.post(
+            '/api/invoices/batch/', {'documents': documents}, format='multipart'
+        )
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Invoice.objects.exists())
+
+
+class FastPathExtractionTest(TestCase):
+    """Test cases for the deterministic AFIP fast path"""
+    
+    def test_extract_afip_fields(self):
+        """Test that every header field of the AFIP layout is found"""
+        fields = extract_fields('\n'.join(AFIP_INVOICE_LINES))
+        values = {field: match.value for field, match in fields.items()}
+        
+        self.assertEqual(values, {
+            'invoice_number': '00002-00000123',
+            'invoice_date': '15/01/2024',
+            'vendor_name': 'EMPRESA EJEMPLO S.A.',
+            'vendor_address': 'Av. Siempreviva 742 - CABA',
+            'vendor_cuit': '30712345671',
+            'customer_cuit': '20123456786',
+            'customer_name': 'CLIENTE EJEMPLO SRL',
+            'customer_address': 'Calle Falsa 123 - Rosario',
+            'payment_terms': 'Contado',
+            'subtotal': '10.000,00',
+            'tax_amount': '2100,00',
+            'total_amount': '12.100,00',
+            'currency': 'ARS',
+        })
+        self.assertTrue(all(match.confidence >= 0.8 for match in fields.values()))
+    
+    def test_low_confidence_for_invalid_cuit_and_inconsistent_totals(self):
+        """Test that suspicious values get a low confidence"""
+        lines = [
+            line.replace('30712345671', '30712345670').replace('12.100,00', '12.000,00')
+            for line in AFIP_INVOICE_LINES
+        ]
+        fields = extract_fields('\n'.join(lines))
+        
+        self.assertLess(fields['vendor_cuit'].confidence, 0.8)
+        self.assertLess(fields['total_amount'].confidence, 0.8)
+        self.assertGreaterEqual(fields['customer_cuit'].confidence, 0.8)
+    
+    def test_currency_is_read_from_the_moneda_field(self):
+        """Test that dollars mentioned outside the Moneda field do not set the currency"""
+        mentioned = extract_fields('\n'.join(AFIP_INVOICE_LINES + ['Tipo de cambio USD de referencia: 850,00']))
+        labelled = extract_fields('\n'.join(AFIP_INVOICE_LINES + ['Moneda: Dólar Estadounidense']))
+        
+        self.assertNotIn('currency', mentioned)
+        self.assertEqual(labelled['currency'], ('USD', 0.9))
+    
+    def test_invoice_number_matches_the_afip_qr(self):
+        """Test that the fast path and the AFIP QR pad the invoice number the same way"""
+        fields = extract_fields('Punto de Venta: 2 Comp. Nro: 123')
+        
+        self.assertEqual(fields['invoice_number'].value, '00002-00000123')
+        self.assertEqual(payload_to_fields({'ptoVta': 2, 'nroCmp': 123})['invoice_number'].value,
+                         fields['invoice_number'].value)
+    
+    def test_fast_path_reads_pdf_text_layer(self):
+        """Test that the service reads the fields from a real PDF"""
+        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as f:
+            f.write(make_text_pdf(AFIP_INVOICE_LINES))
+        self.addCleanup(os.unlink, f.name)
+        
+        fields = InvoiceExtractionService()._fast_path_fields(f.name)
+        
+        self.assertEqual(fields['invoice_number'].value, '00002-00000123')
+        self.assertEqual(fields['total_amount'].value, '12.100,00')
+        self.assertEqual(
+            InvoiceExtractionService().invalid_fields(
+                {field: match.value for field, match in fields.items()}
+            ),
+            []
+        )
+    
+    def test_structured_extraction_keeps_fast_path_fields(self):
+        """Test that known fields are not queried again in the fallback"""
+        service = InvoiceExtractionService(extraction_mode='structured')
+        structured_engine = FakeQueryEngine(default=ArgentineInvoice(total_amount='1,00'))
+        query_engine = FakeQueryEngine()
+        known = {'total_amount': '$ 12.100,00', 'vendor_cuit': '30712345671'}
+        
+        fields = service._query_structured_fields(structured_engine, query_engine, known_fields=known)
+        
+        self.assertEqual(fields['total_amount'], '$ 12.100,00')
+        self.assertNotIn(FIELD_QUERIES['vendor_cuit'], query_engine.queries)
+        self.assertIn(FIELD_QUERIES['vendor_name'], query_engine.queries)
+
+
+class PagePruningTest(TestCase):
+    """Test cases for the selection of invoice pages in multi-page PDFs"""
+    
+    INVOICE_PAGE = '\n'.join(AFIP_INVOICE_LINES)
+    TERMS_PAGE = 'Condiciones generales: la mercaderia viaja por cuenta y riesgo del comprador. ' * 20
+    REMITO_PAGE = 'REMITO R 0001-00000456 CUIT: 30-71234567-1 Bultos: 3 Total de bultos: 3'
+    
+    def test_select_pages(self):
+        """Test that invoice pages are kept and terms pages skipped"""
+        pages = [self.INVOICE_PAGE] + [self.TERMS_PAGE] * 18 + [self.REMITO_PAGE]
+        
+        self.assertEqual(select_pages(pages, max_pages=3), [0, 19])
+        self.assertEqual(select_pages(pages, max_pages=1), [0])
+        # Without a text layer there is nothing to score: keep the first pages
+        self.assertEqual(select_pages([''] * 20, max_pages=3), [0, 1, 2])
+    
+    @skipUnless(LLAMAINDEX_AVAILABLE, 'Llamaindex not installed')
+    def test_only_invoice_pages_are_loaded(self):
+        """Test that the query engines only get the invoice pages of a long PDF"""
+        pages = [self.TERMS_PAGE, self.INVOICE_PAGE, self.TERMS_PAGE, self.TERMS_PAGE]
+        
+        with mock.patch('invoice_extractor.loaders.extract_pdf_pages', return_value=pages):
+            documents = load_document('factura.pdf', afip_qr=False, max_pages=2).documents
+            all_documents = load_document('factura.pdf', afip_qr=False).documents
+        
+        self.assertEqual([document.text for document in documents], [self.INVOICE_PAGE])
+        self.assertEqual(documents[0].metadata['page_label'], '2')
+        self.assertEqual(len(all_documents), 4)
+    
+    def test_short_pdfs_are_kept_whole(self):
+        """Test that a continuation page without keywords is kept when there are few pages"""
+        pages = [self.INVOICE_PAGE, 'Bulon 8mm x 100 $ 1.500,00\nSubtotal: $ 10.000,00', self.TERMS_PAGE]
+        
+        self.assertEqual(select_pages(pages, max_pages=3), [0, 1, 2])
+        self.assertEqual(select_pages(pages + [self.TERMS_PAGE], max_pages=3), [0])
+
+
+@skipUnless(LLAMAINDEX_AVAILABLE, 'Llamaindex not installed')
+class DocumentLoaderTest(TestCase):
+    """Test cases for the document loader process pool"""
+    
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, 'factura.pdf')
+        with open(self.path, 'wb') as f:
+            f.write(make_text_pdf(AFIP_INVOICE_LINES))
+    
+    def test_load_in_worker_process(self):
+        """Test that a document loaded in a worker process matches one loaded inline"""
+        loader = DocumentLoader(workers=1, timeout=60)
+        self.addCleanup(loader.shutdown)
+        
+        loaded = loader.load(self.path, afip_qr=False)
+        
+        self.assertEqual(loaded.page_texts, load_document(self.path, afip_qr=False).page_texts)
+        self.assertIn('Importe Total', loaded.documents[0].text)
+    
+    def test_timeout_replaces_the_process(self):
+        """Test that a document over the timeout fails and later loads get a new process"""
+        loader = DocumentLoader(workers=1, timeout=0.0001)
+        self.addCleanup(loader.shutdown)
+        
+        with self.assertRaises(DocumentLoadTimeout):
+            loader.load(self.path, afip_qr=False)
+        
+        loader.timeout = 60
+        self.assertEqual(len(loader.load(self.path, afip_qr=False).documents), 1)
+        self.assertEqual(len(loader._processes), 1)
+    
+    def test_timeout_only_counts_parsing(self):
+        """Test that a stuck document neither times out the documents waiting for a process nor the others"""
+        # Opening a FIFO nobody writes to blocks the worker process forever
+        stuck_path = os.path.join(os.path.dirname(self.path), 'stuck.pdf')
+        os.mkfifo(stuck_path)
+        loader = DocumentLoader(workers=2, timeout=1)
+        self.addCleanup(loader.shutdown)
+        
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            stuck = [pool.submit(loader.load, stuck_path) for _ in range(2)]
+            time.sleep(0.2)
+            loaded = pool.submit(loader.load, self.path, afip_qr=False)
+            
+            self.assertEqual(len(loaded.result().documents), 1)
+            for future in stuck:
+                self.assertRaises(DocumentLoadTimeout, future.result)
+
+
+AFIP_QR_PAYLOAD = {
+    'ver': 1, 'fecha': '2024-01-15', 'cuit': 30712345671, 'ptoVta': 2,
+    'tipoCmp': 1, 'nroCmp': 123, 'importe': 12100, 'moneda': 'PES', 'ctz': 1,
+    'tipoDocRec': 80, 'nroDocRec': 20123456786, 'tipoCodAut': 'E', 'codAut': 74123456789012,
+}
+
+
+def afip_qr_url(payload=AFIP_QR_PAYLOAD):
+    encoded = base64.b64encode(json.dumps(payload).encode()).decode()
+    return f'https://www.afip.gob.ar/fe/qr/?p={encoded}'
+
+
+@skipUnless(PILLOW_AVAILABLE, 'Pillow not installed')
+class ImagePreprocessingTest(TestCase):
+    """Test cases for the image preprocessing stage"""
+    
+    def photo(self, size=(1200, 800), orientation=None):
+        """JPEG of a white page on a dark table, with optional EXIF orientation"""
+        from PIL import Image
+        
+        image = Image.new('RGB', size, (40, 40, 40))
+        image.paste(Image.new('RGB', (size[0] // 2, size[1] // 2), 'white'), (size[0] // 4, size[1] // 4))
+        exif = image.getexif()
+        if orientation:
+            exif[0x0112] = orientation
+        buffer = BytesIO()
+        image.save(buffer, format='JPEG', exif=exif.tobytes())
+        buffer.seek(0)
+        return buffer
+    
+    def test_normalize_image(self):
+        """Test that photos are rotated per EXIF, cropped to the page and made grayscale"""
+        from PIL import Image
+        
+        image = normalize_image(Image.open(self.photo(orientation=6)), dpi=200)
+        
+        self.assertEqual(image.mode, 'L')
+        # 90 degree rotation: the 600x400 page ends up portrait, plus a 1% margin
+        self.assertAlmostEqual(image.width, 400, delta=30)
+        self.assertAlmostEqual(image.height, 600, delta=30)
+    
+    def test_normalize_image_downsamples_to_dpi(self):
+        """Test that the long side is capped at the DPI applied to an A4 page"""
+        from PIL import Image
+        
+        image = normalize_image(Image.open(self.photo(size=(4000, 3000))), dpi=100)
+        
+        self.assertLessEqual(max(image.size), 1170)
+    
+    def test_preprocess_image_is_cached_by_content_hash(self):
+        """Test that each document is preprocessed once and other types are left alone"""
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        path = os.path.join(tmp_dir.name, 'ticket.jpg')
+        with open(path, 'wb') as f:
+            f.write(self.photo().getvalue())
+        
+        with override_settings(IMAGE_PREPROCESSING_CACHE_DIR=os.path.join(tmp_dir.name, 'cache'),
+                               IMAGE_PREPROCESSING_ENABLED=True):
+            preprocessed = preprocess_image(path, content_hash='ab' * 32)
+            with mock.patch('invoice_extractor.preprocessing.normalize_image') as normalize:
+                self.assertEqual(preprocess_image(path, content_hash='ab' * 32), preprocessed)
+            normalize.assert_not_called()
+            self.assertEqual(preprocess_image(os.path.join(tmp_dir.name, 'factura.pdf')), os.path.join(tmp_dir.name, 'factura.pdf'))
+            with override_settings(IMAGE_PREPROCESSING_ENABLED=False):
+                self.assertEqual(preprocess_image(path), path)
+        
+        self.assertTrue(preprocessed.endswith(f"{'ab' * 32}-200dpi.png"))
+        self.assertTrue(os.path.exists(preprocessed))
+
+
+class AfipQRTest(TestCase):
+    """Test cases for AFIP QR code decoding"""
+    
+    def test_parse_afip_qr_url(self):
+        """Test decoding the payload and mapping it to invoice fields"""
+        payload = parse_afip_qr_url(afip_qr_url())
+        fields = {field: match.value for field, match in payload_to_fields(payload).items()}
+        
+        self.assertEqual(fields, {
+            'vendor_cuit': '30712345671',
+            'invoice_number': '00002-00000123',
+            'invoice_date': '2024-01-15',
+            'total_amount': '12100,00',
+            'currency': 'ARS',
+            'customer_cuit': '20123456786',
+        })
+        service = InvoiceExtractionService()
+        self.assertEqual(service.parse_currency(fields['total_amount']), 12100.0)
+        self.assertEqual(service.parse_date(fields['invoice_date']), '2024-01-15')
+    
+    def test_parse_rejects_other_urls(self):
+        """Test that QR codes that are not AFIP invoice codes are ignored"""
+        encoded = afip_qr_url().split('p=')[1]
+        self.assertIsNone(parse_afip_qr_url(f'https://example.com/fe/qr/?p={encoded}'))
+        self.assertIsNone(parse_afip_qr_url('https://www.afip.gob.ar/fe/qr/?p=not-base64!'))
+        self.assertIsNone(parse_afip_qr_url(None))
+    
+    @skipUnless(QR_DECODER_AVAILABLE and QRCODE_AVAILABLE, 'QR code libraries not installed')
+    def test_find_qr_in_image_and_pdf(self):
+        """Test decoding a synthetic QR code from a PNG and from a PDF embedding it"""
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        image = qrcode.make(afip_qr_url()).get_image().convert('RGB')
+        png_path = os.path.join(tmp_dir.name, 'ticket.png')
+        pdf_path = os.path.join(tmp_dir.name, 'factura.pdf')
+        image.save(png_path)
+        image.save(pdf_path)
+        
+        self.assertEqual(find_afip_qr(png_path)['nroCmp'], 123)
+        self.assertEqual(find_afip_qr(pdf_path)['cuit'], 30712345671)
+
+
+FAKE_LLM_BACKEND = {'BACKEND': 'fake', 'MODEL': 'fake', 'FAKE_LATENCY': 0}
+
+
+@override_settings(LLM_BACKEND=FAKE_LLM_BACKEND, EXTRACTION_CACHE={})
+class LLMBackendTest(TestCase):
+    """Test cases for the pluggable LLM backends"""
+    
+    def test_unknown_backend(self):
+        """Test that a misspelled backend is reported"""
+        from django.core.exceptions import ImproperlyConfigured
+        
+        with self.assertRaises(ImproperlyConfigured):
+            build_llm({'BACKEND': 'gpt', 'MODEL': 'x', 'API_KEY': ''})
+    
+    def test_openai_without_api_key(self):
+        """Test that the OpenAI backend is left unconfigured without a key"""
+        self.assertIsNone(build_llm({'BACKEND': 'openai', 'MODEL': 'x', 'API_KEY': ''}))
+    
+    @skipUnless(LLAMAINDEX_AVAILABLE, 'Llamaindex not installed')
+    def test_views_do_not_import_llamaindex(self):
+        """Test that serving the API does not import Llamaindex or OpenCV until something is extracted"""
+        script = (
+            "import sys, django; django.setup(); import invoice_extractor.urls; "
+            "print(sorted(name for name in sys.modules if name.startswith(('llama_index.core', 'cv2'))))"
+        )
+        output = subprocess.run(
+            [sys.executable, '-c', script], capture_output=True, text=True, check=True,
+            env=dict(os.environ, DJANGO_SETTINGS_MODULE='extractor_project.settings'),
+        ).stdout
+        
+        self.assertEqual(output.strip(), '[]')
+    
+    def test_extraction_service_is_shared(self):
+        """Test that the process-wide service is rebuilt only when its settings change"""
+        service = get_extraction_service()
+        
+        self.assertIs(get_extraction_service(), service)
+        with override_settings(LLAMAINDEX_EXTRACTION_MODE='per_field'):
+            self.assertEqual(get_extraction_service().extraction_mode, 'per_field')
+        self.assertIsNot(get_extraction_service(), service)
+    
+    @skipUnless(LLAMAINDEX_AVAILABLE, 'Llamaindex not installed')
+    def test_fake_backend_end_to_end(self):
+        """Test a full extraction offline with the fake backend"""
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        file_path = os.path.join(tmp_dir.name, 'ticket.pdf')
+        with open(file_path, 'wb') as f:
+            f.write(make_text_pdf(['TICKET', 'Total 12.100,00']))
+        
+        for mode in ('structured', 'per_field'):
+            with self.subTest(mode=mode):
+                service = InvoiceExtractionService(extraction_mode=mode)
+                stages = []
+                progress = lambda stage, data: stages.append(stage)
+                results = [
+                    service.extract_invoice_data(file_path, progress=progress),
+                    async_to_sync(service.aextract_invoice_data)(file_path, progress=progress),
+                ]
+                
+                self.assertEqual(stages.count('parsed'), 2)
+                self.assertIn('llm_fields', stages)
+                for result in results:
+                    self.assertTrue(result['success'], result.get('error'))
+                    self.assertEqual(result['data']['vendor_name'], 'EMPRESA EJEMPLO S.A.')
+                    self.assertEqual(result['data']['total_amount'], '$12.100,00')
+                    self.assertTrue(result['data']['items'])
@@ -0,0 +1,212 @@
+"""
+Streaming handling of uploaded invoice documents
+
+HashingUploadHandler (see settings.FILE_UPLOAD_HANDLERS) writes every
+uploaded file straight to the file system of the document storage while
+hashing it and sniffing its first bytes. The content-addressed storage then only
+has to rename the file into place: the document is written once and never
+read back to be hashed or validated.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import zipfile
+from typing import Optional
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+logger = logging.getLogger(__name__)
+
+# Limit file size to 10MB
+MAX_DOCUMENT_SIZE = 10 * 1024 * 1024
+
+# Document types by extension, as detected from the file contents
+EXTENSION_TYPES = {
+    'pdf': 'pdf',
+    'jpg': 'jpeg',
+    'jpeg': 'jpeg',
+    'png': 'png',
+    'docx': 'docx',
+    'zip': 'zip',
+}
+
+SNIFF_SIZE = 1024
+ZIP_SIGNATURES = (b'PK\x03\x04', b'PK\x05\x06')
+
+
+def sniff_type(head: bytes) -> Optional[str]:
+    """
+    Return the document type given the first bytes of a file
+
+    ZIP based files are reported as 'zip'; see detect_document_type for
+    telling DOCX files apart.
+    """
+    if b'%PDF-' in head[:SNIFF_SIZE]:
+        return 'pdf'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith(ZIP_SIGNATURES):
+        return 'zip'
+    return None
+
+
+def _zip_type(file) -> Optional[str]:
+    """Return 'docx' for a Word document and 'zip' for any other valid archive"""
+    try:
+        with zipfile.ZipFile(file) as archive:
+            names = set(archive.namelist())
+    except (zipfile.BadZipFile, OSError):
+        return None
+    return 'docx' if 'word/document.xml' in names else 'zip'
+
+
+def detect_document_type(file) -> Optional[str]:
+    """
+    Return the type of an uploaded file from its contents
+
+    Files received by HashingUploadHandler were already sniffed while
+    streaming; any other file (e.g. a ZIP archive member) is sniffed here.
+
+    Returns:
+        'pdf', 'png', 'jpeg', 'docx', 'zip' or None if unrecognized
+    """
+    if hasattr(file, 'detected_type'):
+        return file.detected_type
+
+    file.seek(0)
+    kind = sniff_type(file.read(SNIFF_SIZE))
+    file.seek(0)
+    if kind == 'zip':
+        kind = _zip_type(file)
+        file.seek(0)
+    return kind
+
+
+class HashedUploadedFile(TemporaryUploadedFile):
+    """
+    Uploaded file written to a temporary file next to its final location
+
+    Carries the SHA-256 of its contents (content_hash) and the type
+    detected from them (detected_type).
+    """
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None, directory=None):
+        _, ext = os.path.splitext(name)
+        file = tempfile.NamedTemporaryFile(suffix='.upload' + ext, dir=directory)
+        # Skip TemporaryUploadedFile.__init__, which always uses FILE_UPLOAD_TEMP_DIR
+        super(TemporaryUploadedFile, self).__init__(file, name, content_type, size, charset, content_type_extra)
+        self.content_hash = None
+        self.detected_type = None
+
+
+class ArchiveMemberFile(File):
+    """
+    Member of a ZIP archive, decompressed only when it is read
+
+    The size is the one declared in the archive, which is also the most
+    that reading the member returns.
+    """
+
+    def __init__(self, archive: zipfile.ZipFile, member: zipfile.ZipInfo, name: str):
+        super().__init__(None, name)
+        self.archive = archive
+        self.member = member
+        self.size = member.file_size
+
+    @property
+    def file(self):
+        if self._file is None:
+            self._file = self.archive.open(self.member)
+        return self._file
+
+    @file.setter
+    def file(self, value):
+        self._file = value
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Upload handler that hashes, sniffs and size-checks files in one pass
+
+    Files are streamed to a temporary file in the incoming directory, on
+    the same file system as the document storage, so saving them is a
+    rename. Once a file exceeds its size
+    limit (MAX_DOCUMENT_SIZE, or INVOICE_ARCHIVE_MAX_SIZE for ZIP archives)
+    the rest of it is discarded; the reported size stays the real one so
+    that validation rejects it.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        if self.file_name.lower().endswith('.zip'):
+            self.max_size = getattr(settings, 'INVOICE_ARCHIVE_MAX_SIZE', 100 * 1024 * 1024)
+        else:
+            self.max_size = MAX_DOCUMENT_SIZE
+        self.digest = hashlib.sha256()
+        self.head = b''
+        self.size = 0
+        self.file = HashedUploadedFile(
+            self.file_name, self.content_type, 0, self.charset, self.content_type_extra,
+            directory=self._directory(),
+        )
+
+    def _directory(self) -> Optional[str]:
+        """
+        Incoming directory, on the same file system as the stored documents
+
+        INVOICE_UPLOAD_INCOMING_DIR, or <storage location>-incoming: next to
+        the storage directory rather than inside it, where files still being
+        uploaded would be served with the media files.
+        """
+        from .models import Invoice
+
+        directory = getattr(settings, 'INVOICE_UPLOAD_INCOMING_DIR', None)
+        if not directory:
+            location = getattr(Invoice._meta.get_field('document').storage, 'location', None)
+            if location is None:
+                return getattr(settings, 'FILE_UPLOAD_TEMP_DIR', None)
+            directory = os.path.normpath(location) + '-incoming'
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size > self.max_size:
+            return None
+        if len(self.head) < SNIFF_SIZE:
+            self.head += raw_data[:SNIFF_SIZE - len(self.head)]
+        self.digest.update(raw_data)
+        self.file.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        self.file.size = self.size
+        if self.size <= self.max_size:
+            self.file.content_hash = self.digest.hexdigest()
+            self.file.detected_type = sniff_type(self.head)
+            if self.file.detected_type == 'zip':
+                self.file.detected_type = _zip_type(self.file.file)
+                self.file.seek(0)
+        return self.file
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            temp_location = self.file.temporary_file_path()
+            try:
+                self.file.close()
+                os.remove(temp_location)
+            except FileNotFoundError:
+                pass
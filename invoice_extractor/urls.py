@@ -1,10 +1,13 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import InvoiceViewSet
+from .views import InvoiceViewSet, process_invoice_async, reprocess_invoice_async
 
 router = DefaultRouter()
 router.register(r'invoices', InvoiceViewSet, basename='invoice')
 
 urlpatterns = [
+    # Async (ASGI) versions of the process and reprocess actions
+    path('invoices/process/async/', process_invoice_async, name='invoice-process-async'),
+    path('invoices/<int:pk>/reprocess/async/', reprocess_invoice_async, name='invoice-reprocess-async'),
     path('', include(router.urls)),
 ]
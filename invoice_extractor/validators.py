@@ -0,0 +1,43 @@
+"""
+Validation helpers for Argentine invoice data
+"""
+import re
+from typing import Optional
+
+CUIT_WEIGHTS = (5, 4, 3, 2, 7, 6, 5, 4, 3, 2)
+
+
+def normalize_cuit(value: Optional[str]) -> Optional[str]:
+    """Return the 11 CUIT digits without separators, or None if there aren't 11"""
+    if not value:
+        return None
+    digits = re.sub(r'\D', '', str(value))
+    return digits if len(digits) == 11 else None
+
+
+def format_cuit(value: Optional[str]) -> Optional[str]:
+    """Return a CUIT as XX-XXXXXXXX-X, or unchanged if it doesn't have 11 digits"""
+    digits = normalize_cuit(value)
+    if digits is None:
+        return value
+    return f"{digits[:2]}-{digits[2:10]}-{digits[10]}"
+
+
+def format_invoice_number(punto_de_venta, number) -> str:
+    """Return an invoice number as PPPPP-NNNNNNNN, the AFIP punto de venta and comprobante number"""
+    return f"{int(punto_de_venta):05d}-{int(number):08d}"
+
+
+def is_valid_cuit(value: Optional[str]) -> bool:
+    """Check the length and verification digit of a CUIT/CUIL"""
+    digits = normalize_cuit(value)
+    if digits is None:
+        return False
+
+    total = sum(int(digit) * weight for digit, weight in zip(digits, CUIT_WEIGHTS))
+    check = 11 - total % 11
+    if check == 11:
+        check = 0
+    elif check == 10:
+        check = 9
+    return check == int(digits[10])
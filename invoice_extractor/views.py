@@ -2,18 +2,48 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
-from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.reverse import reverse
 from django.core.files.storage import default_storage
 from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from asgiref.sync import sync_to_async
 import logging
 
-from .models import Invoice, InvoiceItem
+from django.db import transaction
+from django.db.models import Count, Q
+from django.shortcuts import get_object_or_404
+
+from .analytics import summary_key, update_invoice_summary
+from .jobs import (
+    aprocess_invoice,
+    arun_job,
+    create_running_job,
+    enqueue_extraction,
+    enqueue_extractions,
+    find_reusable_extractions,
+    process_invoice,
+    reuse_extraction,
+    run_job,
+)
+from .events import aevent_stream, event_stream, record_event
+from .export import EXPORT_FORMATS, PYARROW_AVAILABLE, export_response
+from .filters import InvoiceFilterBackend
+from .models import Invoice, InvoiceBatch, InvoiceEvent, VendorMonthlySummary
+from .pagination import InvoiceCursorPagination
 from .serializers import (
     InvoiceSerializer, 
+    InvoiceListSerializer,
     InvoiceUploadSerializer,
-    InvoiceItemSerializer
+    InvoiceBatchUploadSerializer,
+    InvoiceItemSerializer,
+    VendorMonthlySummarySerializer,
+    VendorSummaryFilterSerializer
 )
-from .services import InvoiceExtractionService
+from .storage import content_sha256
 
 logger = logging.getLogger(__name__)
 
@@ -27,11 +57,48 @@ class InvoiceViewSet(viewsets.ModelViewSet):
     queryset = Invoice.objects.all()
     serializer_class = InvoiceSerializer
     parser_classes = (MultiPartParser, FormParser)
+    pagination_class = InvoiceCursorPagination
+    filter_backends = [InvoiceFilterBackend]
+    
+    def get_queryset(self):
+        """Only load what the list serializer will output"""
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            fields = InvoiceListSerializer.selected_fields(self.request.query_params)
+            if 'items' in fields:
+                queryset = queryset.prefetch_related('items')
+            if 'raw_extraction' not in fields:
+                queryset = queryset.defer('raw_extraction')
+        elif self.action == 'retrieve':
+            queryset = queryset.prefetch_related('items')
+        return queryset
+    
+    def perform_update(self, serializer):
+        """Move the invoice between vendor summaries if its totals changed"""
+        previous_key = summary_key(serializer.instance)
+        invoice = serializer.save()
+        update_invoice_summary(invoice, previous_key)
+    
+    def perform_destroy(self, instance):
+        """Remove the deleted invoice from its vendor summary"""
+        instance.delete()
+        update_invoice_summary(instance)
+    
+    def perform_content_negotiation(self, request, force=False):
+        """The export and events actions do not use the renderers"""
+        if self.action in ('export', 'events'):
+            renderer = JSONRenderer()
+            return renderer, renderer.media_type
+        return super().perform_content_negotiation(request, force)
     
     def get_serializer_class(self):
         """Return appropriate serializer based on action"""
+        if self.action == 'list':
+            return InvoiceListSerializer
         if self.action == 'upload':
             return InvoiceUploadSerializer
+        if self.action == 'batch_upload':
+            return InvoiceBatchUploadSerializer
         return InvoiceSerializer
     
     @action(detail=False, methods=['post'], url_path='process')
@@ -40,18 +107,21 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         Main endpoint to upload and process invoice documents from Argentina
         
         This endpoint accepts an invoice document (PDF, JPG, PNG, or DOCX),
-        stores it, and uses Llamaindex to extract relevant invoice data.
+        stores it and queues it for extraction with Llamaindex. The
+        extraction workers (manage.py run_extraction_worker) process the
+        queue; poll the status endpoint to know when the data is ready.
         
         Request:
             POST /api/invoices/process/
             Content-Type: multipart/form-data
             Body: document (file)
         
-        Response:
+        Response (202 Accepted):
             {
                 "id": 1,
-                "status": "processing",
-                "message": "Invoice uploaded successfully. Processing..."
+                "status": "pending",
+                "message": "Invoice uploaded successfully. Processing...",
+                "status_url": "/api/invoices/1/status/"
             }
         """
         serializer = InvoiceUploadSerializer(data=request.data)
@@ -63,142 +133,316 @@ class InvoiceViewSet(viewsets.ModelViewSet):
             )
         
         document = serializer.validated_data['document']
+        content_hash = content_sha256(document)
+        duplicate = Invoice.objects.filter(content_hash=content_hash).order_by('-id').first()
+        source = find_reusable_extractions([content_hash]).get(content_hash)
         
-        # Create invoice record
+        # Create invoice record; a duplicate document points at the stored blob
         invoice = Invoice.objects.create(
             document=document,
             original_filename=document.name,
-            status='processing'
+            content_hash=content_hash,
+            status='pending'
         )
+        record_event(invoice.id, 'uploaded')
         
-        try:
-            # Process the document using Llamaindex
-            extraction_service = InvoiceExtractionService()
-            file_path = invoice.document.path
-            
-            result = extraction_service.extract_invoice_data(file_path)
-            
-            if result['success']:
-                # Update invoice with extracted data
-                extracted = result['data']
-                
-                invoice.invoice_number = extracted.get('invoice_number')
-                invoice.vendor_name = extracted.get('vendor_name')
-                invoice.vendor_cuit = extracted.get('vendor_cuit')
-                invoice.vendor_address = extracted.get('vendor_address')
-                invoice.customer_name = extracted.get('customer_name')
-                invoice.customer_cuit = extracted.get('customer_cuit')
-                invoice.customer_address = extracted.get('customer_address')
-                invoice.payment_terms = extracted.get('payment_terms')
-                invoice.currency = extracted.get('currency', 'ARS')
-                invoice.raw_extraction = extracted
-                
-                # Parse and set financial data
-                if extracted.get('subtotal'):
-                    invoice.subtotal = extraction_service.parse_currency(
-                        extracted['subtotal']
-                    )
-                if extracted.get('tax_amount'):
-                    invoice.tax_amount = extraction_service.parse_currency(
-                        extracted['tax_amount']
-                    )
-                if extracted.get('total_amount'):
-                    invoice.total_amount = extraction_service.parse_currency(
-                        extracted['total_amount']
-                    )
-                
-                # Parse and set date
-                if extracted.get('invoice_date'):
-                    parsed_date = extraction_service.parse_date(
-                        extracted['invoice_date']
-                    )
-                    if parsed_date:
-                        invoice.invoice_date = parsed_date
-                
-                invoice.status = 'completed'
-                invoice.processed_at = timezone.now()
-                invoice.save()
-                
-                # Create line items if extracted
-                items_data = extracted.get('items', [])
-                for item_data in items_data:
-                    if isinstance(item_data, dict):
-                        InvoiceItem.objects.create(
-                            invoice=invoice,
-                            description=item_data.get('description', ''),
-                            quantity=item_data.get('quantity', 0),
-                            unit_price=item_data.get('unit_price', 0),
-                            total_price=item_data.get('total_price', 0),
-                        )
-                
-                return Response(
-                    {
-                        'id': invoice.id,
-                        'status': 'completed',
-                        'message': 'Invoice processed successfully',
-                        'data': InvoiceSerializer(invoice).data
-                    },
-                    status=status.HTTP_201_CREATED
-                )
-            else:
-                # Processing failed
-                error_detail = result.get('error', 'Unknown error')
-                invoice.status = 'failed'
-                invoice.error_message = error_detail
-                invoice.save()
-                
-                # Log the error for debugging
-                logger.error(f"Invoice {invoice.id} processing failed: {error_detail}")
-                
-                # Don't expose internal error details in production
-                error_response = {
+        if source is not None:
+            reuse_extraction(invoice, source)
+            return Response(
+                {
                     'id': invoice.id,
-                    'status': 'failed',
-                    'message': 'Failed to process invoice'
-                }
-                
-                # Only include error details in debug mode
-                if settings.DEBUG:
-                    error_response['error'] = error_detail
-                
-                return Response(
-                    error_response,
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
-                
-        except Exception as e:
-            # Handle unexpected errors
-            error_detail = str(e)
-            invoice.status = 'failed'
-            invoice.error_message = error_detail
-            invoice.save()
-            
-            # Log the error for debugging
-            logger.exception(f"Unexpected error processing invoice {invoice.id}")
-            
-            # Don't expose internal error details in production
-            error_response = {
+                    'status': 'completed',
+                    'message': 'Duplicate document, reused the existing extraction',
+                    'duplicate_of': source.id,
+                    'data': InvoiceSerializer(invoice).data
+                },
+                status=status.HTTP_201_CREATED
+            )
+        
+        if not getattr(settings, 'INVOICE_PROCESSING_ASYNC', True):
+            return self._process_now(invoice)
+        
+        enqueue_extraction(invoice)
+        
+        return Response(
+            {
                 'id': invoice.id,
-                'status': 'failed',
-                'message': 'An error occurred during processing'
+                'status': invoice.status,
+                'message': 'Invoice uploaded successfully. Processing...',
+                'duplicate_of': duplicate.id if duplicate else None,
+                'status_url': reverse('invoice-processing-status', args=[invoice.id], request=request),
+            },
+            status=status.HTTP_202_ACCEPTED
+        )
+    
+    @action(detail=False, methods=['post'], url_path='batch')
+    def batch_upload(self, request):
+        """
+        Upload many invoice documents at once
+        
+        Accepts several files and/or ZIP archives of documents. All the
+        invoices are created with a single bulk insert and queued for the
+        extraction workers, regardless of INVOICE_PROCESSING_ASYNC.
+        
+        Request:
+            POST /api/invoices/batch/
+            Content-Type: multipart/form-data
+            Body: documents (one or more files, PDF/JPG/PNG/DOCX or ZIP)
+        
+        Response (202 Accepted):
+            {
+                "batch_id": 1,
+                "count": 120,
+                "reused": 3,
+                "skipped": [{"name": "LEEME.txt", "error": "File type not supported..."}],
+                "status_url": "/api/invoices/batch/1/"
             }
-            
-            # Only include error details in debug mode
-            if settings.DEBUG:
-                error_response['error'] = error_detail
-            
+        """
+        serializer = InvoiceBatchUploadSerializer(data=request.data)
+        
+        if not serializer.is_valid():
             return Response(
-                error_response,
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                serializer.errors,
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        documents = serializer.validated_data['documents']
+        content_hashes = [content_sha256(document) for document in documents]
+        sources = find_reusable_extractions(content_hashes)
+        
+        with transaction.atomic():
+            batch = InvoiceBatch.objects.create()
+            invoices = Invoice.objects.bulk_create([
+                Invoice(
+                    document=document,
+                    original_filename=document.name,
+                    content_hash=content_hash,
+                    status='pending',
+                    batch=batch
+                )
+                for document, content_hash in zip(documents, content_hashes)
+            ])
+            InvoiceEvent.objects.bulk_create(
+                [InvoiceEvent(invoice=invoice, stage='uploaded') for invoice in invoices]
             )
+            for invoice in invoices:
+                if invoice.content_hash in sources:
+                    reuse_extraction(invoice, sources[invoice.content_hash])
+            enqueue_extractions([invoice for invoice in invoices if invoice.content_hash not in sources])
+        
+        return Response(
+            {
+                'batch_id': batch.id,
+                'count': len(invoices),
+                'reused': sum(invoice.content_hash in sources for invoice in invoices),
+                'skipped': serializer.validated_data['skipped'],
+                'status_url': reverse('invoice-batch-status', args=[batch.id], request=request),
+            },
+            status=status.HTTP_202_ACCEPTED
+        )
+    
+    @action(detail=False, methods=['get'], url_path=r'batch/(?P<batch_id>\d+)', url_name='batch-status')
+    def batch_status(self, request, batch_id=None):
+        """
+        Aggregate progress of a batch upload
+        
+        Request:
+            GET /api/invoices/batch/{batch_id}/
+        
+        Response:
+            {
+                "batch_id": 1,
+                "total": 120,
+                "pending": 80,
+                "processing": 4,
+                "completed": 35,
+                "failed": 1,
+                "finished": false
+            }
+        """
+        batch = get_object_or_404(InvoiceBatch, pk=batch_id)
+        counts = batch.invoices.aggregate(
+            total=Count('id'),
+            **{
+                value: Count('id', filter=Q(status=value))
+                for value, _ in Invoice.STATUS_CHOICES
+            }
+        )
+        
+        return Response({
+            'batch_id': batch.id,
+            'created_at': batch.created_at,
+            **counts,
+            'finished': counts['completed'] + counts['failed'] == counts['total'],
+        })
+    
+    def _process_now(self, invoice):
+        """Extract an invoice inside the request (INVOICE_PROCESSING_ASYNC = False)"""
+        # Claimed as it is created, so no extraction worker can take it, and
+        # run once: a failure is reported rather than retried in the request
+        job = create_running_job(invoice)
+        run_job(job, retry=False)
+        
+        data, status_code = _processed_job_response(job)
+        return Response(data, status=status_code)
+    
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream every invoice matching the list filters as a file
+        
+        Request:
+            GET /api/invoices/export/?format=csv|ndjson|parquet
+            GET /api/invoices/export/?format=csv&rows=items&date_from=2024-01-01
+        
+        Accepts the same filters as the list. ?rows=items exports one row
+        per line item instead of one per invoice.
+        """
+        export_format = request.query_params.get('format', 'csv')
+        rows = request.query_params.get('rows', 'invoices')
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {'error': f"Unsupported format. Choose one of: {', '.join(EXPORT_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if rows not in ('invoices', 'items'):
+            return Response(
+                {'error': "rows must be 'invoices' or 'items'"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if export_format == 'parquet' and not PYARROW_AVAILABLE:
+            return Response(
+                {'error': 'Parquet export requires pyarrow to be installed'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        queryset = self.filter_queryset(self.get_queryset())
+        return export_response(queryset, export_format, rows)
+    
+    @action(detail=False, methods=['get'])
+    def analytics(self, request):
+        """
+        Invoice totals per vendor, month and currency
+        
+        Reads the precomputed VendorMonthlySummary table, so the cost does
+        not depend on the number of invoices.
+        
+        Request:
+            GET /api/invoices/analytics/?vendor_cuit=30-71234567-1&month_from=2024-01&month_to=2024-06&currency=ARS
+        
+        Response:
+            [
+                {
+                    "vendor_cuit": "30712345671",
+                    "month": "2024-01",
+                    "currency": "ARS",
+                    "invoice_count": 12,
+                    "subtotal": "100000.00",
+                    "tax_amount": "21000.00",
+                    "total_amount": "121000.00",
+                    "updated_at": "2024-02-01T10:00:00Z"
+                }
+            ]
+        """
+        filters = VendorSummaryFilterSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+        params = filters.validated_data
+        
+        summaries = VendorMonthlySummary.objects.all()
+        if 'vendor_cuit' in params:
+            summaries = summaries.filter(vendor_cuit=params['vendor_cuit'])
+        if 'currency' in params:
+            summaries = summaries.filter(currency=params['currency'].upper())
+        if 'month_from' in params:
+            summaries = summaries.filter(month__gte=params['month_from'].replace(day=1))
+        if 'month_to' in params:
+            summaries = summaries.filter(month__lte=params['month_to'].replace(day=1))
+        
+        return Response(VendorMonthlySummarySerializer(summaries, many=True).data)
+    
+    @action(detail=True, methods=['get'], url_path='status', url_name='processing-status')
+    def processing_status(self, request, pk=None):
+        """
+        Lightweight processing status of an invoice, for polling after upload
+        
+        Request:
+            GET /api/invoices/{id}/status/
+        
+        Response:
+            {
+                "id": 1,
+                "status": "completed",
+                "processed_at": "2024-01-15T10:00:00Z",
+                "job": {"status": "completed", "attempts": 1}
+            }
+        """
+        invoice = self.get_object()
+        job = invoice.jobs.order_by('-created_at', '-id').first()
+        
+        data = {
+            'id': invoice.id,
+            'status': invoice.status,
+            'processed_at': invoice.processed_at,
+            'job': {'status': job.status, 'attempts': job.attempts} if job else None,
+        }
+        if invoice.status == 'failed' and settings.DEBUG:
+            data['error'] = invoice.error_message
+        
+        return Response(data)
+    
+    @action(detail=True, methods=['get'])
+    def events(self, request, pk=None):
+        """
+        Stream the extraction progress of an invoice as Server-Sent Events
+        
+        Each stage is sent as soon as it is reached, with the fields
+        extracted so far, and the stream ends once the invoice is completed
+        or failed. Without a Last-Event-ID header the current run is
+        replayed from its start, so connecting late loses nothing.
+        
+        Request:
+            GET /api/invoices/{id}/events/
+            Accept: text/event-stream
+        
+        Response:
+            id: 12
+            event: fast_path_fields
+            data: {"fields": {"vendor_cuit": "30712345671", ...}, "stage": "fast_path_fields"}
+        
+        Stages: uploaded, processing, parsed, fast_path_fields, llm_fields,
+        items_saved, completed, failed. Under ASGI an open stream holds no
+        thread; under WSGI it holds one until it ends.
+        """
+        invoice = self.get_object()
+        try:
+            last_event_id = int(request.headers['Last-Event-ID'])
+        except (KeyError, ValueError):
+            last_event_id = None
+        
+        if isinstance(request._request, ASGIRequest):
+            stream = aevent_stream(invoice, last_event_id)
+        else:
+            stream = event_stream(invoice, last_event_id)
+        
+        response = StreamingHttpResponse(stream, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Keep nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
     
     @action(detail=True, methods=['get'])
     def reprocess(self, request, pk=None):
         """
         Reprocess an existing invoice document
         
+        Only the fields of the previous extraction that are missing or
+        invalid are extracted again (listed in 'repaired_fields'). With
+        ?refresh=true, or if the invoice was never extracted, the whole
+        document is, bypassing the extraction cache.
+        
         Request:
             GET /api/invoices/{id}/reprocess/
+            GET /api/invoices/{id}/reprocess/?refresh=true  (full re-extraction)
         """
         invoice = self.get_object()
         
@@ -208,73 +452,168 @@ class InvoiceViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        invoice.status = 'processing'
-        invoice.save()
+        refresh = request.query_params.get('refresh', '').lower() in ('1', 'true')
+        result = process_invoice(invoice, use_cache=not refresh, incremental=not refresh)
         
-        try:
-            extraction_service = InvoiceExtractionService()
-            result = extraction_service.extract_invoice_data(invoice.document.path)
-            
-            if result['success']:
-                extracted = result['data']
-                
-                # Update fields similar to upload endpoint
-                invoice.invoice_number = extracted.get('invoice_number')
-                invoice.vendor_name = extracted.get('vendor_name')
-                invoice.vendor_cuit = extracted.get('vendor_cuit')
-                invoice.raw_extraction = extracted
-                invoice.status = 'completed'
-                invoice.processed_at = timezone.now()
-                invoice.save()
-                
-                return Response(
-                    {
-                        'id': invoice.id,
-                        'status': 'completed',
-                        'message': 'Invoice reprocessed successfully',
-                        'data': InvoiceSerializer(invoice).data
-                    }
-                )
-            else:
-                error_detail = result.get('error')
-                invoice.status = 'failed'
-                invoice.error_message = error_detail
-                invoice.save()
-                
-                # Log the error for debugging
-                logger.error(f"Invoice {invoice.id} reprocessing failed: {error_detail}")
-                
-                # Don't expose internal error details in production
-                error_response = {
-                    'error': 'Failed to reprocess invoice'
-                }
-                
-                # Only include error details in debug mode
-                if settings.DEBUG:
-                    error_response['details'] = error_detail
-                
-                return Response(
-                    error_response,
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
-                
-        except Exception as e:
-            error_detail = str(e)
-            invoice.status = 'failed'
-            invoice.error_message = error_detail
-            invoice.save()
-            
-            # Log the error for debugging
-            logger.exception(f"Unexpected error reprocessing invoice {invoice.id}")
-            
-            # Don't expose internal error details in production
-            error_response = {'error': 'An error occurred during reprocessing'}
-            
-            # Only include error details in debug mode
-            if settings.DEBUG:
-                error_response['details'] = error_detail
-            
-            return Response(
-                error_response,
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+        if result['success']:
+            response_data = {
+                'id': invoice.id,
+                'status': 'completed',
+                'message': 'Invoice reprocessed successfully',
+                'data': InvoiceSerializer(invoice).data
+            }
+            if 'repaired_fields' in result:
+                response_data['repaired_fields'] = result['repaired_fields']
+            return Response(response_data)
+        
+        # Don't expose internal error details in production
+        error_response = {'error': 'Failed to reprocess invoice'}
+        
+        # Only include error details in debug mode
+        if settings.DEBUG:
+            error_response['details'] = result.get('error')
+        
+        return Response(
+            error_response,
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+def _processed_job_response(job):
+    """Response body and status code of an upload processed inside the request"""
+    invoice = Invoice.objects.get(pk=job.invoice_id)
+    if invoice.status == 'completed':
+        return (
+            {
+                'id': invoice.id,
+                'status': 'completed',
+                'message': 'Invoice processed successfully',
+                'data': InvoiceSerializer(invoice).data
+            },
+            status.HTTP_201_CREATED
+        )
+    
+    # Don't expose internal error details in production
+    error_response = {
+        'id': invoice.id,
+        'status': 'failed',
+        'message': 'Failed to process invoice'
+    }
+    
+    # Only include error details in debug mode
+    if settings.DEBUG:
+        error_response['error'] = job.error_message
+    
+    return error_response, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+
+def _invoice_data(invoice):
+    return InvoiceSerializer(invoice).data
+
+
+def _validate_upload(request):
+    # Parsing the multipart body streams the files to disk
+    return InvoiceUploadSerializer(data=request.FILES)
+
+
+@csrf_exempt
+@require_POST
+async def process_invoice_async(request):
+    """
+    Upload an invoice document and extract it inside the request, without
+    holding a thread while the LLM answers
+    
+    Served under ASGI (e.g. uvicorn extractor_project.asgi:application),
+    the LLM calls are awaited, so one worker process can hold hundreds of
+    extractions waiting on the network. The response is that of
+    POST /api/invoices/process/ with INVOICE_PROCESSING_ASYNC = False.
+    
+    Request:
+        POST /api/invoices/process/async/
+        Content-Type: multipart/form-data
+        Body: document (file)
+    """
+    serializer = await sync_to_async(_validate_upload)(request)
+    
+    if not await sync_to_async(serializer.is_valid)():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    document = serializer.validated_data['document']
+    content_hash = content_sha256(document)
+    sources = await sync_to_async(find_reusable_extractions)([content_hash])
+    
+    invoice = await Invoice.objects.acreate(
+        document=document,
+        original_filename=document.name,
+        content_hash=content_hash,
+        status='pending'
+    )
+    await sync_to_async(record_event)(invoice.id, 'uploaded')
+    
+    if content_hash in sources:
+        source = sources[content_hash]
+        await sync_to_async(reuse_extraction)(invoice, source)
+        data = await sync_to_async(_invoice_data)(invoice)
+        return JsonResponse(
+            {
+                'id': invoice.id,
+                'status': 'completed',
+                'message': 'Duplicate document, reused the existing extraction',
+                'duplicate_of': source.id,
+                'data': data
+            },
+            status=status.HTTP_201_CREATED
+        )
+    
+    # Claimed as it is created, so no extraction worker can take it, and
+    # run once: a failure is reported rather than retried in the request
+    job = await sync_to_async(create_running_job)(invoice)
+    await arun_job(job, retry=False)
+    
+    data, status_code = await sync_to_async(_processed_job_response)(job)
+    return JsonResponse(data, status=status_code)
+
+
+@require_GET
+async def reprocess_invoice_async(request, pk):
+    """
+    Async version of GET /api/invoices/{id}/reprocess/
+    
+    Request:
+        GET /api/invoices/{id}/reprocess/async/
+        GET /api/invoices/{id}/reprocess/async/?refresh=true  (full re-extraction)
+    """
+    try:
+        invoice = await Invoice.objects.aget(pk=pk)
+    except Invoice.DoesNotExist:
+        return JsonResponse({'detail': 'No Invoice matches the given query.'}, status=status.HTTP_404_NOT_FOUND)
+    
+    if not invoice.document:
+        return JsonResponse(
+            {'error': 'No document found for this invoice'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    refresh = request.GET.get('refresh', '').lower() in ('1', 'true')
+    result = await aprocess_invoice(invoice, use_cache=not refresh, incremental=not refresh)
+    
+    if result['success']:
+        data = await sync_to_async(_invoice_data)(invoice)
+        response_data = {
+            'id': invoice.id,
+            'status': 'completed',
+            'message': 'Invoice reprocessed successfully',
+            'data': data
+        }
+        if 'repaired_fields' in result:
+            response_data['repaired_fields'] = result['repaired_fields']
+        return JsonResponse(response_data)
+    
+    # Don't expose internal error details in production
+    error_response = {'error': 'Failed to reprocess invoice'}
+    
+    # Only include error details in debug mode
+    if settings.DEBUG:
+        error_response['details'] = result.get('error')
+    
+    return JsonResponse(error_response, status=status.HTTP_500_INTERNAL_SERVER_ERROR)